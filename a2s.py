@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Minimal Source engine A2S_INFO query (UDP).
+
+Used to tell whether an instance is up (it answers on its game port) and
+whether anyone is playing on it. Handles the challenge round trip Valve
+added to A2S_INFO in 2020; split (multi-packet) replies are not needed for
+INFO and are not supported.
+"""
+import selectors
+import socket
+import struct
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+_HEADER = b"\xff\xff\xff\xff"
+_INFO_REQUEST = _HEADER + b"TSource Engine Query\x00"
+_CHALLENGE = 0x41
+_INFO_REPLY = 0x49
+
+
+class A2SError(Exception):
+    pass
+
+
+def _read_string(data: bytes, pos: int) -> Tuple[str, int]:
+    end = data.index(b"\x00", pos)
+    return data[pos:end].decode("utf-8", "replace"), end + 1
+
+
+def parse_info(data: bytes) -> Dict[str, Any]:
+    """Decode an A2S_INFO reply (including the 4-byte 0xFF header)."""
+    try:
+        if data[:4] != _HEADER or data[4] != _INFO_REPLY:
+            raise A2SError("not an A2S_INFO reply")
+        pos = 6  # header, type byte, protocol byte
+        name, pos = _read_string(data, pos)
+        map_name, pos = _read_string(data, pos)
+        folder, pos = _read_string(data, pos)
+        game, pos = _read_string(data, pos)
+        app_id, players, max_players, bots = struct.unpack_from("<hBBB", data, pos)
+    except (IndexError, ValueError, struct.error) as exc:
+        raise A2SError(f"malformed A2S_INFO reply: {exc}") from exc
+    return {
+        "name": name,
+        "map": map_name,
+        "folder": folder,
+        "game": game,
+        "app_id": app_id,
+        "players": players,
+        "max_players": max_players,
+        "bots": bots,
+    }
+
+
+def info(ip: str, port: int, timeout: float = 3.0) -> Dict[str, Any]:
+    """Query one server; raises A2SError when it does not answer in time."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.sendto(_INFO_REQUEST, (ip, port))
+            data, _ = sock.recvfrom(4096)
+            if data[:4] == _HEADER and len(data) >= 9 and data[4] == _CHALLENGE:
+                sock.sendto(_INFO_REQUEST + data[5:9], (ip, port))
+                data, _ = sock.recvfrom(4096)
+        except OSError as exc:  # includes socket.timeout
+            raise A2SError(f"{ip}:{port}: {exc or 'timed out'}") from exc
+    return parse_info(data)
+
+
+def try_info(ip: str, port: int, timeout: float = 3.0) -> Optional[Dict[str, Any]]:
+    """info(), or None when the server does not answer."""
+    try:
+        return info(ip, port, timeout)
+    except A2SError:
+        return None
+
+
+def info_many(endpoints: Iterable[Tuple[str, int]], timeout: float = 3.0) -> Dict[Tuple[str, int], Optional[Dict[str, Any]]]:
+    """
+    Query many servers at once from one non-blocking socket: every request goes out
+    up front, and replies (and challenge round trips) are handled as they arrive, so
+    the whole fleet takes about one `timeout`. {(ip, port): info or None}.
+    """
+    pending = set(endpoints)
+    out: Dict[Tuple[str, int], Optional[Dict[str, Any]]] = {ep: None for ep in pending}
+    if not pending:
+        return out
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock, selectors.DefaultSelector() as sel:
+        sock.setblocking(False)
+        sel.register(sock, selectors.EVENT_READ)
+        for ep in list(pending):
+            try:
+                sock.sendto(_INFO_REQUEST, ep)
+            except OSError:
+                pending.discard(ep)
+        deadline = time.monotonic() + timeout
+        while pending and time.monotonic() < deadline:
+            if not sel.select(deadline - time.monotonic()):
+                break
+            while True:
+                try:
+                    data, addr = sock.recvfrom(4096)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    continue  # e.g. ICMP port unreachable from one server
+                ep = (addr[0], addr[1])
+                if ep not in pending:
+                    continue
+                if data[:4] == _HEADER and len(data) >= 9 and data[4] == _CHALLENGE:
+                    try:
+                        sock.sendto(_INFO_REQUEST + data[5:9], ep)
+                    except OSError:
+                        pending.discard(ep)
+                    continue
+                try:
+                    out[ep] = parse_info(data)
+                except A2SError:
+                    continue
+                pending.discard(ep)
+    return out
+
+
+def humans(reply: Optional[Dict[str, Any]]) -> int:
+    """Players that are not bots (0 for no reply)."""
+    if not reply:
+        return 0
+    return max(0, int(reply.get("players", 0)) - int(reply.get("bots", 0)))
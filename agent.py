@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Client for the on-server agent (server_resources/scripts/tf2ctl_agent.py).
+
+setup.sh runs the agent on every VM, bound to 127.0.0.1. Requests reach it through
+a direct-tcpip channel of the controller's SSH connection, so no port is opened and
+the SSH key remains the only credential that crosses the network. The per-VM token
+(reported by the bootstrap, kept in the registry as "agent") keeps other local users
+on the VM out.
+
+Each request returns JSON. Fleet operations send one request per VM, in parallel,
+instead of one shell exec per container.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from json import JSONDecodeError
+from typing import Any, Dict, Optional, Tuple, Union
+
+try:
+    from tf2ctl.ssh_ops import SSHOps
+    from tf2ctl import tracing
+except ImportError:
+    from ssh_ops import SSHOps
+    import tracing
+
+MAX_PARALLEL = 16
+DEFAULT_TIMEOUT = 120.0
+
+# Operations the agent understands (see tf2ctl_agent.py)
+OPS = ("ping", "status", "logs", "restart", "apply_includes", "hashes", "read_logs", "demos")
+
+# Seconds the agent allows each container for these ops; it runs a VM's containers one
+# after another (and after any restart/copy already in progress on that VM)
+PER_CONTAINER = {"restart": 120.0, "apply_includes": 300.0}
+
+
+class AgentError(Exception):
+    pass
+
+
+class AgentUnreachable(AgentError):
+    """The request never reached the agent; a caller may fall back to SSH exec."""
+
+
+def timeout_for(op: str, args: Dict[str, Any]) -> float:
+    """Seconds to wait for the reply to `op`: the agent's budget for every container in `args`."""
+    per = PER_CONTAINER.get(op)
+    if per is None:
+        return DEFAULT_TIMEOUT
+    return per * max(1, len(args.get("containers") or [])) + 30.0
+
+
+def endpoint(meta: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The {"port", "token"} a registry entry's VM reported, or None when it runs no agent."""
+    info = meta.get("agent") or {}
+    return info if info.get("port") and info.get("token") else None
+
+
+def request(ip: str, private_key: str, info: Dict[str, Any], op: str, timeout: Optional[float] = None,
+            **args) -> Any:
+    """
+    Run one agent operation on the VM at `ip`; returns its result or raises AgentError
+    (AgentUnreachable when it was never delivered). `timeout` defaults to timeout_for().
+    """
+    line = json.dumps({"token": info["token"], "op": op, "args": args}) + "\n"
+    timeout = timeout_for(op, args) if timeout is None else timeout
+    with tracing.span(f"agent.{op}", host=ip) as sp:
+        try:
+            raw = SSHOps.tunnel_request(ip, "root", private_key, int(info["port"]), line.encode("utf-8"), timeout)
+        except ConnectionError as exc:
+            raise AgentUnreachable(f"agent unreachable: {exc}") from exc
+        except TimeoutError as exc:
+            raise AgentError(f"no reply from the agent within {timeout:.0f}s") from exc
+        sp["bytes"] = len(raw)
+    try:
+        reply = json.loads(raw)
+    except JSONDecodeError as exc:
+        raise AgentError(f"bad reply from agent: {raw[:200]!r}") from exc
+    if not isinstance(reply, dict) or not reply.get("ok"):
+        raise AgentError(str(reply.get("error") if isinstance(reply, dict) else reply))
+    return reply.get("result")
+
+
+def fleet(targets: Dict[str, Tuple[str, Dict[str, Any], Dict[str, Any]]], op: str,
+          private_key: str) -> Dict[str, Union[Any, AgentError]]:
+    """
+    Send `op` to several VMs at once. `targets` is {host: (ip, endpoint, args)}; returns
+    {host: result}, with an AgentError as the value for hosts whose request failed.
+    """
+    def one(item):
+        host, (ip, info, args) = item
+        with tracing.tags(server=host):
+            try:
+                return host, request(ip, private_key, info, op, **args)
+            except AgentError as exc:
+                return host, exc
+
+    if not targets:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL, len(targets))) as pool:
+        return dict(pool.map(one, targets.items()))
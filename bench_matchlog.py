@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the srcds match-log parser (matchlog.py).
+
+Feeds recorded srcds logs (tf/logs/*.log, or the srcds__*.log.gz archives that
+collect-logs keeps under .tf2ctl/logstore/<server>/) through one Pipeline as if
+--servers servers were replaying them at once (line by line, interleaved), and
+reports:
+
+  * lines/s and MB/s over the best of --runs passes, with every event subscribed
+  * the events the recorded logs produced
+  * peak memory while streaming the logs once and --repeat times; the parser
+    keeps constant memory per server, so the two should match
+
+Without log files a synthetic recording (6v6 matches with the usual supstats
+damage/heal/chat chatter) is generated. Exits 1 when throughput is below
+--target or memory grows with the input:
+
+    python bench_matchlog.py                       # or: make bench-matchlog
+    python bench_matchlog.py .tf2ctl/logstore/tf2-07/srcds__*.log.gz --servers 50
+"""
+import argparse
+import gc
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Iterator, List
+
+try:
+    from tf2ctl import matchlog
+except ImportError:
+    import matchlog
+
+# Lines per second a single core should manage with every event subscribed
+TARGET_LINES_PER_SEC = 250_000.0
+
+# Allowed peak-memory growth between streaming the logs once and --repeat times
+MEMORY_SLACK_BYTES = 256 * 1024
+
+_CLASSES = ("scout", "soldier", "pyro", "demoman", "heavyweapons", "engineer", "medic", "sniper", "spy")
+_WEAPONS = ("scattergun", "tf_projectile_rocket", "tf_projectile_pipe", "minigun", "sniperrifle", "knife")
+
+
+def _synthetic(path: Path, matches: int, seed: int = 27015):
+    """Write a recording of `matches` 6v6 matches to `path`."""
+    # pylint: disable=too-many-locals
+    rnd = random.Random(seed)
+    t = 1_760_000_000
+    players = [(f"player{i}", i + 2, f"[U:1:{100000 + i}]", "Red" if i < 6 else "Blue") for i in range(12)]
+
+    def stamp() -> str:
+        return time.strftime("L %m/%d/%Y - %H:%M:%S: ", time.gmtime(t))
+
+    def who(p) -> str:
+        return f'"{p[0]}<{p[1]}><{p[2]}><{p[3]}>"'
+
+    with path.open("w", encoding="utf-8") as fp:
+        fp.write(f'{stamp()}Loading map "cp_process_final"\n')
+        for p in players:
+            fp.write(f'{stamp()}{who((p[0], p[1], p[2], ""))} connected, address "10.0.0.{p[1]}:27005"\n')
+            fp.write(f'{stamp()}{who((p[0], p[1], p[2], "Unassigned"))} joined team "{p[3]}"\n')
+            fp.write(f'{stamp()}{who(p)} changed role to "{rnd.choice(_CLASSES)}"\n')
+        for _ in range(matches):
+            score = {"Red": 0, "Blue": 0}
+            while max(score.values()) < 5:
+                fp.write(f'{stamp()}World triggered "Round_Start"\n')
+                for _ in range(rnd.randint(30, 60)):
+                    t += rnd.randint(1, 6)
+                    a, v = rnd.sample(players, 2)
+                    for _ in range(rnd.randint(4, 12)):
+                        fp.write(f'{stamp()}{who(a)} triggered "damage" against {who(v)} (damage "{rnd.randint(10, 90)}")'
+                                 f' (weapon "{rnd.choice(_WEAPONS)}")\n')
+                    fp.write(f'{stamp()}{who(a)} triggered "healed" against {who(v)} (healing "{rnd.randint(20, 200)}")\n')
+                    if a[3] != v[3]:
+                        fp.write(f'{stamp()}{who(a)} killed {who(v)} with "{rnd.choice(_WEAPONS)}" '
+                                 f'(attacker_position "1 2 3") (victim_position "4 5 6")\n')
+                    if rnd.random() < 0.05:
+                        fp.write(f'{stamp()}{who(a)} say "gg no re"\n')
+                winner = rnd.choice(("Red", "Blue"))
+                score[winner] += 1
+                fp.write(f'{stamp()}World triggered "Round_Win" (winner "{winner}")\n')
+                fp.write(f'{stamp()}World triggered "Round_Length" (seconds "{rnd.randint(60, 400)}.00")\n')
+                for team, pts in score.items():
+                    fp.write(f'{stamp()}Team "{team}" current score "{pts}" with "6" players\n')
+            fp.write(f'{stamp()}World triggered "Game_Over" reason "Reached Win Limit"\n')
+            for team, pts in score.items():
+                fp.write(f'{stamp()}Team "{team}" final score "{pts}" with "6" players\n')
+        fp.write(f'{stamp()}{who(players[0])} disconnected (reason "Disconnect by user.")\n')
+
+
+def _labels(servers: int) -> List[str]:
+    return [f"tf2-{i + 1:02d}" for i in range(servers)]
+
+
+def _recorded(paths: List[Path], repeat: int = 1) -> Iterator[str]:
+    for _ in range(repeat):
+        for path in paths:
+            yield from matchlog.read_lines(path)
+
+
+def _throughput(lines: List[str], servers: int, runs: int) -> tuple:
+    best, counts = float("inf"), Counter()
+    labels = _labels(servers)
+    for _ in range(runs):
+        pipeline = matchlog.Pipeline()
+        counts = Counter()
+        pipeline.subscribe(lambda e, seen=counts: seen.update((e["event"],)))
+        feed = pipeline.feed_line
+        gc.collect()
+        start = time.perf_counter()
+        for line in lines:
+            for server in labels:
+                feed(server, line)
+        best = min(best, time.perf_counter() - start)
+    return best, counts
+
+
+def _peak_memory(paths: List[Path], servers: int, repeat: int) -> int:
+    """Peak bytes allocated while streaming the logs `repeat` times through a fresh Pipeline."""
+    pipeline = matchlog.Pipeline()
+    pipeline.subscribe(lambda e: None)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        labels = _labels(servers)
+        for line in _recorded(paths, repeat):
+            for server in labels:
+                pipeline.feed_line(server, line)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main() -> int:
+    # pylint: disable=too-many-locals
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("logs", nargs="*", type=Path, help="recorded srcds logs (.log or .log.gz)")
+    parser.add_argument("--servers", type=int, default=10, help="servers replaying the logs side by side")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=2, help="passes for the memory comparison")
+    parser.add_argument("--matches", type=int, default=10, help="matches in the synthetic recording")
+    parser.add_argument("--target", type=float, default=TARGET_LINES_PER_SEC, help="minimum lines/s")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="tf2ctl-bench-") as tmp:
+        paths = list(args.logs)
+        if not paths:
+            paths = [Path(tmp) / "synthetic.log"]
+            _synthetic(paths[0], args.matches)
+        lines = list(_recorded(paths))
+        count = len(lines) * args.servers
+        size = sum(len(line.encode("utf-8")) for line in lines) * args.servers
+        elapsed, counts = _throughput(lines, args.servers, args.runs)
+        del lines
+        once = _peak_memory(paths, args.servers, 1)
+        repeated = _peak_memory(paths, args.servers, args.repeat)
+
+    rate = count / elapsed if elapsed else float("inf")
+    print(f"{count} lines ({size / 1e6:.1f} MB): {len(paths)} log(s) replayed by {args.servers} servers; "
+          f"best of {args.runs} runs")
+    print(f"  {elapsed:8.3f} s   {rate:12,.0f} lines/s   {size / 1e6 / elapsed:8.1f} MB/s   "
+          f"(target {args.target:,.0f} lines/s)")
+    print("\nevents:")
+    for kind in matchlog.EVENTS:
+        print(f"  {counts.get(kind, 0):8d}  {kind}")
+    print(f"\npeak memory streaming the logs once: {once / 1024:8.1f} KiB, "
+          f"{args.repeat} times: {repeated / 1024:8.1f} KiB ({once / 1024 / args.servers:.1f} KiB per server)")
+
+    ok = True
+    if rate < args.target:
+        print(f"\nFAIL: {rate:,.0f} lines/s is below the target of {args.target:,.0f}")
+        ok = False
+    if repeated > once + MEMORY_SLACK_BYTES:
+        print(f"\nFAIL: memory grew with the input ({once} -> {repeated} bytes); per-server state must stay bounded")
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
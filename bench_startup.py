@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Start-up benchmark for the headless CLI.
+
+Runs `python -X importtime cli.py <command>` against a throwaway copy of the
+tool (so your .tf2ctl/ state is never touched) with a registry of --servers
+fake instances, and reports:
+
+  * median wall time of `list` and `--help` next to a bare interpreter start
+  * the slowest imports (cumulative, from -X importtime)
+  * whether any heavy dependency (paramiko, cryptography, requests) was loaded
+
+Exits 1 when `list` is slower than --target-ms or imports a heavy dependency,
+so it can gate changes:
+
+    python bench_startup.py              # or: make bench-startup
+    python bench_startup.py --runs 20 --target-ms 200
+"""
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parent
+
+# `list` should stay well under this on a typical machine (interpreter start included)
+LIST_TARGET_MS = 250.0
+
+# Modules `list` must not import; they load lazily when an operation needs them
+HEAVY_MODULES = ("paramiko", "cryptography", "requests")
+
+
+def _fake_registry(count: int) -> Dict[str, dict]:
+    reg = {}
+    for i in range(count):
+        host = f"tf2-{i // 2 + 1:03d}"
+        reg[f"{host}-{i % 2 + 1}"] = {
+            "provider": "digitalocean", "id": 1000 + i // 2, "ip": f"10.0.{i // 250}.{i % 250 + 1}",
+            "region": "fra1", "size": "s-2vcpu-4gb", "host": host,
+            "container": "tf2" if i % 2 == 0 else "tf2-2", "instance": i % 2, "instances_per_vm": 2,
+            "game_port": 27015 + (i % 2) * 100, "stv_port": 27020 + (i % 2) * 100,
+            "hostname": f"{host}-{i % 2 + 1}", "rcon_password": "x", "sv_password": "y", "stv_password": "stv",
+            "start_map": "cp_badlands",
+        }
+    return reg
+
+
+def _sandbox(servers: int) -> Path:
+    root = Path(tempfile.mkdtemp(prefix="tf2ctl-bench-"))
+    for path in PROJECT_ROOT.glob("*.py"):
+        shutil.copy2(path, root / path.name)
+    state = root / ".tf2ctl"
+    state.mkdir()
+    (state / "config.json").write_text(json.dumps({"provider": "digitalocean"}), encoding="utf-8")
+    (state / "servers.json").write_text(json.dumps(_fake_registry(servers)), encoding="utf-8")
+    return root
+
+
+def _run(cwd: Path, args: List[str]) -> Tuple[float, str]:
+    """Wall time in ms and the -X importtime report of one run."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", *args], cwd=cwd, capture_output=True,
+                          text=True, check=False)
+    elapsed = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        raise SystemExit(f"{' '.join(args)} failed (exit {proc.returncode}):\n{proc.stderr[-2000:]}")
+    return elapsed, proc.stderr
+
+
+def _imports(report: str) -> Dict[str, int]:
+    """{module: cumulative microseconds} from an -X importtime report."""
+    out: Dict[str, int] = {}
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        if cumulative.strip().isdigit():
+            out[name.strip()] = int(cumulative.strip())
+    return out
+
+
+def _median(cwd: Path, args: List[str], runs: int) -> Tuple[float, str]:
+    times, report = [], ""
+    for _ in range(runs):
+        ms, report = _run(cwd, args)
+        times.append(ms)
+    return statistics.median(times), report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--servers", type=int, default=200, help="fake instances in the registry")
+    parser.add_argument("--target-ms", type=float, default=LIST_TARGET_MS)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to show")
+    args = parser.parse_args()
+
+    root = _sandbox(args.servers)
+    try:
+        bare, _ = _median(root, ["-c", "pass"], args.runs)
+        help_ms, _ = _median(root, ["cli.py", "--help"], args.runs)
+        list_ms, report = _median(root, ["cli.py", "list"], args.runs)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    imports = _imports(report)
+    heavy = sorted({name.split(".")[0] for name in imports if name.split(".")[0] in HEAVY_MODULES})
+    print(f"median of {args.runs} runs, {args.servers} instances in the registry")
+    print(f"  python -c pass  {bare:8.1f} ms")
+    print(f"  cli.py --help   {help_ms:8.1f} ms")
+    print(f"  cli.py list     {list_ms:8.1f} ms   (target {args.target_ms:.0f} ms, "
+          f"{list_ms - bare:.1f} ms over a bare interpreter)")
+    print("\nslowest imports for `list` (cumulative):")
+    for name, us in sorted(imports.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    ok = True
+    if heavy:
+        print(f"\nFAIL: `list` imported {', '.join(heavy)}; keep them behind lazy imports")
+        ok = False
+    if list_ms > args.target_ms:
+        print(f"\nFAIL: `list` took {list_ms:.1f} ms (target {args.target_ms:.0f} ms)")
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Bootstrap bundle for configure_server.
+
+Everything a configure needs (one substituted setup.sh per srcds instance on
+the VM, the copy/wait helpers, the on-server agent, includes/ and a manifest)
+is packed into one
+gzip'd tar. The controller
+streams it into a single SSH exec:
+
+    mkdir -p DIR && tar -xzf - -C DIR && bash DIR/bootstrap.sh
+
+bootstrap.sh installs the scripts, waits for apt, runs setup for each instance
+and finishes with one `__TF2CTL_RESULT__ {json}` line, so a configure costs one
+round trip.
+"""
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+from datetime import datetime, UTC
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+REMOTE_DIR = "/root/tf2ctl-bundle"
+RESULT_MARKER = "__TF2CTL_RESULT__"
+# On-server agent (server_resources/scripts/), installed by the bootstrap and started by setup.sh
+AGENT_SCRIPT = "tf2ctl_agent.py"
+BUNDLE_VERSION = 1
+
+COPY_SCRIPT = r"""#!/usr/bin/env bash
+set -e
+log="/root/tf2-setup.log"
+container="${1:-tf2}"
+
+{
+  echo "=== Copying resources into container: $container ==="
+  if ! docker inspect "$container" >/dev/null 2>&1; then
+    echo "Container $container does not exist yet; skipping copy."
+    exit 0
+  fi
+
+  if ! docker ps --format '{{.Names}}' | grep -qx "$container"; then
+    echo "WARN: container $container not running; trying to start..."
+    docker start "$container" >/dev/null 2>&1 || true
+  fi
+
+  # If a server.cfg exists in the uploaded cfg-like dir, rename it to tf2ctl.cfg to avoid overwriting generated server.cfg
+  for d in cfg cfgs configs; do
+    if [ -f "/root/tf2-includes/$d/server.cfg" ]; then
+      echo "Found user server.cfg in $d/, renaming to tf2ctl.cfg"
+      mv "/root/tf2-includes/$d/server.cfg" "/root/tf2-includes/$d/tf2ctl.cfg"
+    fi
+  done
+
+  # cfg-like dirs -> /home/tf2/server/tf/cfg/
+  for d in cfg cfgs configs; do
+    if [ -d "/root/tf2-includes/$d" ]; then
+      echo "Copying $d/ -> /home/tf2/server/tf/cfg/"
+      docker cp "/root/tf2-includes/$d/." "$container:/home/tf2/server/tf/cfg/"
+    fi
+  done
+
+  # Ensure autoexec.cfg will exec our overrides on every start (after server.cfg)
+  docker exec "$container" bash -lc 'CFG="/home/tf2/server/tf/cfg/autoexec.cfg"; touch "$CFG"; grep -q "^exec tf2ctl.cfg" "$CFG" || echo "exec tf2ctl.cfg" >> "$CFG"'
+
+  # maps/ -> /home/tf2/server/tf/maps/
+  if [ -d /root/tf2-includes/maps ]; then
+    echo "Copying maps/ -> /home/tf2/server/tf/maps/"
+    docker cp /root/tf2-includes/maps/. "$container:/home/tf2/server/tf/maps/"
+  fi
+
+  # addons/ -> /home/tf2/server/tf/addons/
+  if [ -d /root/tf2-includes/addons ]; then
+    echo "Copying addons/ -> /home/tf2/server/tf/addons/"
+    docker cp /root/tf2-includes/addons/. "$container:/home/tf2/server/tf/addons/"
+  fi
+
+  # Other downloadable assets (also mirrored to FastDL) -> /home/tf2/server/tf/<dir>/
+  for d in materials models sound resource particles; do
+    if [ -d "/root/tf2-includes/$d" ]; then
+      echo "Copying $d/ -> /home/tf2/server/tf/$d/"
+      docker cp "/root/tf2-includes/$d/." "$container:/home/tf2/server/tf/$d/"
+    fi
+  done
+
+  echo "=== Finished copying resources ==="
+} | tee -a "$log"
+"""
+
+# Waits for cloud-init and apt/dpkg to finish to avoid lock races.
+# Prints a heartbeat every ~30s so the controller's stall detection does not fire.
+WAIT_SCRIPT = """#!/usr/bin/env bash
+set -e
+for i in $(seq 1 200); do
+  if [ -f /var/lib/cloud/instance/boot-finished ] || [ -f /var/local/tf2ctl-init-done ]; then
+    break
+  fi
+  [ $((i % 10)) -eq 0 ] && echo "waiting for cloud-init..."
+  sleep 3
+done
+for i in $(seq 1 200); do
+  if ! pgrep -x unattended-upgrade >/dev/null 2>&1 \\
+     && ! pgrep -x apt >/dev/null 2>&1 \\
+     && ! pgrep -x apt-get >/dev/null 2>&1 \\
+     && ! pgrep -x dpkg >/dev/null 2>&1; then
+    break
+  fi
+  [ $((i % 10)) -eq 0 ] && echo "waiting for apt/dpkg..."
+  sleep 3
+done
+exit 0
+"""
+
+BOOTSTRAP_SCRIPT = r"""#!/usr/bin/env bash
+# Generated by tf2ctl: installs this bundle and runs setup in a single exec.
+B="$(cd "$(dirname "$0")" && pwd)"
+LOG=/root/tf2-setup.log
+MAPS=/home/tf2server/tf2-server/maps
+phase_begin() { echo "__TF2CTL_PHASE__ $1 begin $(date +%s.%N)"; }
+phase_end() { echo "__TF2CTL_PHASE__ $1 end $(date +%s.%N)"; }
+
+phase_begin bundle_install
+# Large content (includes/, maps/) may have been placed by fan-out distribution instead
+if [ -f "$B/shared" ]; then
+  S="/root/tf2ctl-shared/$(cat "$B/shared").tgz"
+  if [ ! -f "$S" ]; then
+    echo "shared payload $S is missing"
+    exit 1
+  fi
+  tar -xzf "$S" -C "$B"
+  find /root/tf2ctl-shared -name '*.tgz' ! -path "$S" -delete
+fi
+for c in $(cat "$B/instances"); do
+  install -m 700 "$B/setup-$c.sh" "/root/tf2-setup-$c.sh"
+done
+install -m 700 "$B/tf2-copy.sh" /root/tf2-copy.sh
+install -m 700 "$B/tf2-wait.sh" /root/tf2-wait.sh
+if [ -f "$B/tf2ctl_agent.py" ]; then
+  install -D -m 700 "$B/tf2ctl_agent.py" /usr/local/lib/tf2ctl/agent.py
+fi
+if [ -d "$B/includes" ]; then
+  mkdir -p /root/tf2-includes
+  cp -a "$B/includes/." /root/tf2-includes/
+fi
+cp "$B/manifest.json" /root/tf2ctl-manifest.json
+mkdir -p "$MAPS" /var/local/tf2ctl
+# Maps from the controller's store: only the hashes this server was missing are shipped
+if [ -f "$B/maps/SHA256SUMS" ]; then
+  if ! (cd "$B/maps" && sha256sum -c --quiet SHA256SUMS); then
+    echo "map bundle checksum mismatch"
+    exit 1
+  fi
+  install -m 644 "$B"/maps/*.bsp "$MAPS/"
+  id -u tf2server >/dev/null 2>&1 && chown tf2server:tf2server "$MAPS"/*.bsp
+fi
+# Add a helpful alias on the host shell
+PROFILE=/root/.bashrc; touch "$PROFILE"
+grep -q "alias tf2apply=" "$PROFILE" || echo 'alias tf2apply="bash /root/tf2-copy.sh"' >> "$PROFILE"
+phase_end bundle_install
+
+phase_begin apt_wait
+bash /root/tf2-wait.sh
+phase_end apt_wait
+
+: > "$LOG"
+SETUP_RC=0
+PER_INSTANCE=""
+TUNING=""
+for c in $(cat "$B/instances"); do
+  echo "=== Setting up instance $c ==="
+  bash -x "/root/tf2-setup-$c.sh" 2>&1 | tee -a "$LOG"
+  rc=${PIPESTATUS[0]}
+  [ "$rc" -ne 0 ] && SETUP_RC=$rc
+  PER_INSTANCE="$PER_INSTANCE${PER_INSTANCE:+, }\"$c\": $rc"
+  # Applied tuning, as recorded by setup.sh (audited in the controller's registry)
+  f="/var/local/tf2ctl/tuning-$c.json"
+  [ -s "$f" ] && TUNING="$TUNING${TUNING:+, }\"$c\": $(cat "$f")"
+done
+
+# Map inventory ({name: sha256}); hashes are cached by size+mtime so large maps are hashed once
+CACHE=/var/local/tf2ctl/maps.inventory
+touch "$CACHE"
+INV=""
+NEW_CACHE=""
+for f in "$MAPS"/*.bsp; do
+  [ -f "$f" ] || continue
+  n=$(basename "$f" .bsp)
+  st=$(stat -c '%s:%Y' "$f")
+  sha=$(awk -v n="$n" -v st="$st" '$1 == n && $2 == st { print $3 }' "$CACHE")
+  [ -n "$sha" ] || sha=$(sha256sum "$f" | cut -d' ' -f1)
+  NEW_CACHE="$NEW_CACHE$n $st $sha"$'\n'
+  INV="$INV${INV:+, }\"$n\": \"$sha\""
+done
+printf '%s' "$NEW_CACHE" > "$CACHE"
+
+IMAGE=$(cat /var/local/tf2ctl/image.json 2>/dev/null || echo '{}')
+AGENT=$(cat /var/local/tf2ctl/agent.json 2>/dev/null || echo '{}')
+RUNNING=$(docker ps --format '{{.Names}}' 2>/dev/null | paste -sd, - || true)
+MANIFEST_SHA=$(sha256sum "$B/manifest.json" | cut -d' ' -f1)
+echo "__TF2CTL_RESULT__ {\"setup_rc\": $SETUP_RC, \"instances\": {$PER_INSTANCE}, \"tuning\": {$TUNING}, \"maps\": {$INV}, \"image\": $IMAGE, \"agent\": $AGENT, \"running\": \"$RUNNING\", \"manifest_sha256\": \"$MANIFEST_SHA\"}"
+exit $SETUP_RC
+"""
+
+
+def render_setup(setup_path: Path, substitutions: Dict[str, str]) -> bytes:
+    """Substitute placeholders into setup.sh and make sure it triggers the post-copy."""
+    # Read raw bytes (avoid Windows locale issues), decode UTF-8 with surrogateescape
+    text = setup_path.read_bytes().decode("utf-8", errors="surrogateescape")
+    # Normalize newlines for bash
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    # Perform placeholder substitutions:
+    # - ${KEY}
+    # - KEY_REPLACE
+    for k, v in substitutions.items():
+        text = text.replace("${" + k + "}", str(v))
+        text = text.replace(f"{k}_REPLACE", str(v))
+    # Ensure setup.sh triggers a post-copy every time (idempotent)
+    if "TF2CTL_POSTCOPY" not in text:
+        text += "\n# TF2CTL_POSTCOPY\nbash /root/tf2-copy.sh || true\n"
+    return text.encode("utf-8", errors="surrogateescape")
+
+
+def _add_bytes(tar: tarfile.TarFile, name: str, data: bytes, mode: int = 0o644):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+
+def content_files(server_resources: Path, extra_files: Optional[Dict[str, bytes]]) -> Dict[str, bytes]:
+    """includes/ (dotfiles skipped, as with the previous SFTP upload) plus `extra_files`."""
+    files: Dict[str, bytes] = {}
+    includes = server_resources / "includes"
+    if includes.exists():
+        for root, _, names in os.walk(includes):
+            rel = os.path.relpath(root, str(includes))
+            rel_posix = "" if rel == "." else rel.replace("\\", "/") + "/"
+            for fname in sorted(names):
+                if fname.startswith("."):
+                    continue
+                files[f"includes/{rel_posix}{fname}"] = Path(root, fname).read_bytes()
+    files.update(extra_files or {})
+    return files
+
+
+def build_shared(server_resources: Path, extra_files: Optional[Dict[str, bytes]], dest: Path) -> str:
+    """
+    Write the large, server-independent part of a bundle (includes/ and `extra_files`)
+    to `dest` as a tar.gz for fan-out distribution; returns its sha256. Bundles built
+    with shared_sha=<that hash> unpack it on the server instead of carrying it.
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(dest, mode="w:gz", compresslevel=1) as tar:
+        for name, data in sorted(content_files(server_resources, extra_files).items()):
+            _add_bytes(tar, name, data)
+    h = hashlib.sha256()
+    with dest.open("rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_bundle(server_resources: Path, instances: List[Dict[str, str]],
+                 extra_files: Optional[Dict[str, bytes]] = None, shared_sha: Optional[str] = None) -> bytes:
+    """
+    Build the bootstrap bundle (tar.gz bytes). `instances` holds one substitution
+    dict per srcds instance to set up (keyed by its CONTAINER_NAME, default "tf2").
+    `extra_files` maps bundle-relative paths to content generated on the controller
+    (e.g. "maps/<name>.bsp" + "maps/SHA256SUMS" from the map store, installed by the
+    bootstrap before setup runs). With `shared_sha`, includes/ and `extra_files` are left
+    out and the bootstrap unpacks the already distributed shared payload instead.
+    """
+    setup_path = server_resources / "scripts" / "setup.sh"
+    containers = [subs.get("CONTAINER_NAME") or "tf2" for subs in instances]
+    files: Dict[str, bytes] = {
+        f"setup-{c}.sh": render_setup(setup_path, subs) for c, subs in zip(containers, instances)
+    }
+    files.update({
+        "instances": ("\n".join(containers) + "\n").encode("utf-8"),
+        "tf2-copy.sh": COPY_SCRIPT.encode("utf-8"),
+        "tf2-wait.sh": WAIT_SCRIPT.encode("utf-8"),
+        "bootstrap.sh": BOOTSTRAP_SCRIPT.encode("utf-8"),
+    })
+    agent_path = server_resources / "scripts" / AGENT_SCRIPT
+    if agent_path.exists():
+        files[AGENT_SCRIPT] = agent_path.read_bytes()
+    if shared_sha:
+        files["shared"] = (shared_sha + "\n").encode("utf-8")
+    else:
+        files.update(content_files(server_resources, extra_files))
+
+    manifest: Dict[str, Any] = {
+        "version": BUNDLE_VERSION,
+        "created_at": datetime.now(UTC).isoformat().replace("+00:00", "Z"),
+        # Keys only: values include passwords and API keys
+        "instances": containers,
+        "substitution_keys": sorted({k for subs in instances for k in subs}),
+        "files": {name: hashlib.sha256(data).hexdigest() for name, data in sorted(files.items())},
+    }
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz", compresslevel=1) as tar:
+        for name, data in sorted(files.items()):
+            mode = 0o755 if name.endswith(".sh") else 0o644
+            _add_bytes(tar, name, data, mode)
+        _add_bytes(tar, "manifest.json", json.dumps(manifest, indent=2).encode("utf-8"))
+    return buf.getvalue()
+
+
+def remote_command() -> str:
+    return (f"rm -rf {REMOTE_DIR} && mkdir -p {REMOTE_DIR} && tar -xzf - -C {REMOTE_DIR} "
+            f"&& bash {REMOTE_DIR}/bootstrap.sh")
+
+
+def parse_result(line: str) -> Optional[Dict[str, Any]]:
+    if not line.startswith(RESULT_MARKER):
+        return None
+    try:
+        data = json.loads(line[len(RESULT_MARKER):].strip())
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
@@ -1,25 +1,65 @@
 #!/usr/bin/env python3
+# pylint: disable=too-many-lines
 import os
+import re
 import sys
 import json
+import argparse
+import contextlib
+import hashlib
+import importlib
+import math
+import shlex
 import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, Tuple, Callable
 from datetime import datetime, UTC  # timezone-aware UTC
 from json import JSONDecodeError
 
 # Try package-relative, then local
 try:
-    from tf2ctl.do_api import DigitalOceanAPI, DOAPIError
-    from tf2ctl.linode_api import LinodeAPI, LinodeAPIError
-    from tf2ctl.vultr_api import VultrAPI, VultrAPIError
     from tf2ctl.ssh_ops import SSHOps
+    from tf2ctl import tracing
+    from tf2ctl import jobs
+    from tf2ctl import map_store
+    from tf2ctl import bundle
+    from tf2ctl import distribute
+    from tf2ctl import fastdl
+    from tf2ctl import rollout
+    from tf2ctl import daemon
+    from tf2ctl import agent
+    from tf2ctl import logstore
+    from tf2ctl import logtail
+    from tf2ctl import matchlog
+    from tf2ctl import demos
+    from tf2ctl import a2s
+    from tf2ctl import watchdog
+    from tf2ctl import scaler
+    from tf2ctl import placement
+    from tf2ctl import history
 except ImportError:
-    from do_api import DigitalOceanAPI, DOAPIError
-    from linode_api import LinodeAPI, LinodeAPIError
-    from vultr_api import VultrAPI, VultrAPIError
     from ssh_ops import SSHOps
+    import tracing
+    import jobs
+    import map_store
+    import bundle
+    import distribute
+    import fastdl
+    import rollout
+    import daemon
+    import agent
+    import logstore
+    import logtail
+    import matchlog
+    import demos
+    import a2s
+    import watchdog
+    import scaler
+    import placement
+    import history
 
 # Treat this folder as the project root
 PROJECT_ROOT = Path(__file__).resolve().parent
@@ -29,21 +69,68 @@ CONFIG_DIR = PROJECT_ROOT / ".tf2ctl"
 CONFIG_PATH = CONFIG_DIR / "config.json"
 SERVERS_REG_PATH = CONFIG_DIR / "servers.json"
 LOGS_DIR = CONFIG_DIR / "logs"
+DAEMON_SOCKET = CONFIG_DIR / "daemon.sock"
+TRACES_DIR = CONFIG_DIR / "traces"
+JOBS_DIR = CONFIG_DIR / "jobs"
+MAPS_DIR = CONFIG_DIR / "maps"
+DIST_DIR = CONFIG_DIR / "dist"
+FASTDL_CACHE_DIR = CONFIG_DIR / "fastdl"
+LOGSTORE_DIR = CONFIG_DIR / "logstore"
+DEMOS_DIR = CONFIG_DIR / "demos"
+WATCHDOG_DIR = CONFIG_DIR / "watchdog"
+STRAGGLERS_PATH = CONFIG_DIR / "stragglers.jsonl"
+HISTORY_PATH = CONFIG_DIR / "history.jsonl"
+SCALER_DIR = CONFIG_DIR / "scaler"
 
 # server_resources lives INSIDE the project directory
 SERVER_RESOURCES_DIR = PROJECT_ROOT / "server_resources"
 
 DEFAULT_TAG = "tf2ctl"
 
-# Default ports (image uses host networking)
+# Ports of the first srcds instance on a VM; instance i is offset by i * PORT_STRIDE
 GAME_PORT = 27015
 STV_PORT = 27020
+CLIENT_PORT = 27005
+STEAM_PORT = 26900
+PORT_STRIDE = 100
+
+# Over-provisioned creates: each wait blocks this long before checking whether the batch is full,
+# and a VM gets this long for its IP, and again for SSH, before it counts as failed
+RACE_POLL = 20
+RACE_STEP_TIMEOUT = 900
+STRAGGLER_ACTIONS = ("delete", "pool")
+
+# Image the srcds containers run; the first configured server pins its exact digest (tf2_image_pin)
+DEFAULT_TF2_IMAGE = "ghcr.io/melkortf/tf2-competitive:latest"
+IMAGE_ARCHIVE_SUFFIX = ".tar.zst"
+
+# Host tuning profiles understood by setup.sh (see its HOST TUNING section)
+TUNING_PROFILES = ("off", "performance")
 
 SUPPORTED_PROVIDERS = {
     "digitalocean": "DigitalOcean",
     "linode": "Linode",
     "vultr": "Vultr",
 }
+# provider -> (adapter module, API class). Adapters pull in `requests`, so they are
+# imported on first use (_provider_module) rather than at start-up.
+PROVIDER_ADAPTERS = {
+    "digitalocean": ("do_api", "DigitalOceanAPI"),
+    "linode": ("linode_api", "LinodeAPI"),
+    "vultr": ("vultr_api", "VultrAPI"),
+}
+TOKEN_KEYS = {
+    "digitalocean": "do_token",
+    "linode": "linode_token",
+    "vultr": "vultr_token",
+}
+
+# Exit codes of the headless CLI (`python cli.py <command> ...`)
+EXIT_OK = 0
+EXIT_FAILED = 1      # the command ran but failed on one or more servers
+EXIT_USAGE = 2       # bad flags (argparse uses 2 as well)
+EXIT_CONFIG = 3      # missing token / SSH key / server_resources
+EXIT_PROVIDER = 4    # the provider API refused a call
 
 # ---------------------------
 # Config / Registry
@@ -65,6 +152,43 @@ def load_config() -> dict:
         "ssh_public_key": "",
         "ssh_private_key_path": "",
         "ssh_public_key_path": "",
+        "setup_stall_timeout": 600,
+        "tuning_profile": "off",
+        # "auto": fan large content out per region when a region has 2+ servers; "direct": upload to each
+        "distribution": "auto",
+        # FastDL: "off", "node" (nginx on every VM) or "host" (on fastdl_host); fastdl_url overrides both
+        "fastdl_mode": "off",
+        "fastdl_host": "",
+        "fastdl_port": fastdl.DEFAULT_PORT,
+        "fastdl_url": "",
+        "tf2_image": DEFAULT_TF2_IMAGE,
+        "tf2_image_pin": {},
+        # "pull": every server pulls the pinned image; "fanout": one pull per region, relayed as docker save | zstd
+        "image_distribution": "pull",
+        "rollout_wave_size": 1,
+        "rollout_ready_timeout": 300,
+        # Collected log lines stay searchable this long (the compressed archives are kept)
+        "log_retention_days": logstore.DEFAULT_RETENTION_DAYS,
+        # Demo harvest: concurrent downloads and their combined cap in Mbit/s (0 = uncapped)
+        "demo_parallel": demos.MAX_PARALLEL,
+        "demo_bandwidth_mbps": 0,
+        # Watchdog: seconds between probe rounds, failed A2S probes before acting, actions per instance per hour
+        "watchdog_interval": watchdog.DEFAULT_INTERVAL,
+        "watchdog_fail_threshold": watchdog.DEFAULT_FAIL_THRESHOLD,
+        "watchdog_max_actions_per_hour": watchdog.DEFAULT_MAX_ACTIONS_PER_HOUR,
+        # Over-provisioning: extra VMs raced in every create; the slowest are "delete"d or kept as idle spares ("pool")
+        "create_spare": 0,
+        "straggler_action": "delete",
+        # Scaler: windows of {region: VMs} (see scaler.py), per-region floor, and when to act; it only
+        # deletes VMs named <scaler_prefix>-..., and creates them with scaler_size unless a window says otherwise
+        "scaler_schedule": [],
+        "scaler_minimum": {},
+        "scaler_idle_minutes": scaler.DEFAULT_IDLE_MINUTES,
+        "scaler_lead_minutes": scaler.DEFAULT_LEAD_MINUTES,
+        "scaler_interval": scaler.DEFAULT_INTERVAL,
+        "scaler_prefix": "auto",
+        "scaler_size": "medium",
+        "scaler_per_vm": 1,
     }
     CONFIG_PATH.write_text(json.dumps(data, indent=2), encoding="utf-8")
     return data
@@ -90,10 +214,22 @@ def save_registry(reg: Dict[str, Any]):
 # Helpers / UI
 # ---------------------------
 
+class HeadlessError(Exception):
+    """Stops a headless command with an exit code instead of prompting."""
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+# Set by the headless CLI: a prompt becomes an error instead of blocking the caller
+_NONINTERACTIVE = False
+
 def pause():
-    input("\nPress Enter to continue...")
+    if not _NONINTERACTIVE:
+        input("\nPress Enter to continue...")
 
 def ask(prompt: str, default: Optional[str] = None) -> str:
+    if _NONINTERACTIVE:
+        raise HeadlessError(EXIT_USAGE, f"would prompt for {prompt!r}; pass it as a flag")
     sfx = f" [{default}]" if default else ""
     val = input(f"{prompt}{sfx}: ").strip()
     return val or (default or "")
@@ -116,30 +252,62 @@ def select_provider(cfg: dict) -> str:
     return cfg.get("provider", "digitalocean")
 
 def ensure_token_for_provider(cfg: dict, provider: str) -> str:
-    key_map = {
-        "digitalocean": "do_token",
-        "linode": "linode_token",
-        "vultr": "vultr_token",
-    }
-    key = key_map.get(provider, "do_token")
+    key = TOKEN_KEYS.get(provider, "do_token")
     if cfg.get(key):
         return cfg[key]
+    if _NONINTERACTIVE:
+        raise HeadlessError(EXIT_CONFIG, f"no API token for {provider}; set {key} in {CONFIG_PATH}")
     print(f"\nNo API token set for {SUPPORTED_PROVIDERS.get(provider, provider)}.")
     token = ask("Paste your API Token")
     cfg[key] = token
     save_config(cfg)
     return token
 
-def build_api(cfg: dict):
-    provider = cfg.get("provider", "digitalocean")
+class ProviderRouter:
+    """
+    What build_api() returns. Attributes are the active provider's client (create wizard,
+    region/size pickers); for_server(meta) is the client of the provider a registry entry
+    was created on, so actions on existing servers work whichever provider is active.
+    """
+
+    def __init__(self, cfg: dict):
+        self.cfg = cfg
+
+    def __getattr__(self, attr: str):
+        return getattr(_api_for_provider(self.cfg, self.cfg.get("provider", "digitalocean")), attr)
+
+    def for_server(self, meta: Dict[str, Any]):
+        return _api_for_server(self.cfg, meta)
+
+def build_api(cfg: dict) -> ProviderRouter:
+    return ProviderRouter(cfg)
+
+def _provider_module(provider: str):
+    module = PROVIDER_ADAPTERS[provider][0]
+    try:
+        return importlib.import_module(f"tf2ctl.{module}")
+    except ImportError:
+        return importlib.import_module(module)
+
+def _api_errors() -> Tuple[type, ...]:
+    """Error classes of every provider adapter, for `except _api_errors():` (only evaluated on an exception)."""
+    do, linode, vultr = (_provider_module(p) for p in ("digitalocean", "linode", "vultr"))
+    return do.DOAPIError, linode.LinodeAPIError, vultr.VultrAPIError
+
+# (provider, token) -> API client, so its HTTP session stays warm for the life of the process
+_API_CLIENTS: Dict[Tuple[str, str], Any] = {}
+
+def _api_for_provider(cfg: dict, provider: str):
+    if provider not in PROVIDER_ADAPTERS:
+        raise RuntimeError(f"Unsupported provider '{provider}'")
     token = ensure_token_for_provider(cfg, provider)
-    if provider == "digitalocean":
-        return DigitalOceanAPI(token)
-    if provider == "linode":
-        return LinodeAPI(token)
-    if provider == "vultr":
-        return VultrAPI(token)
-    raise RuntimeError(f"Unsupported provider '{provider}'")
+    if (provider, token) not in _API_CLIENTS:
+        _API_CLIENTS[(provider, token)] = getattr(_provider_module(provider), PROVIDER_ADAPTERS[provider][1])(token)
+    return _API_CLIENTS[(provider, token)]
+
+def _api_for_server(cfg: dict, meta: Dict[str, Any]):
+    """Client of the provider registry entry `meta` was created on."""
+    return _api_for_provider(cfg, meta.get("provider") or cfg.get("provider", "digitalocean"))
 
 def _harden_private_key_permissions(priv_path: Path):
     """
@@ -170,6 +338,9 @@ def _write_key_files(cfg: dict):
         return
     priv_path = CONFIG_DIR / "id_ed25519"
     pub_path  = CONFIG_DIR / "id_ed25519.pub"
+    if (cfg.get("ssh_private_key_path") == str(priv_path) and cfg.get("ssh_public_key_path") == str(pub_path)
+            and priv_path.exists() and pub_path.exists()):
+        return  # written and hardened on an earlier call
 
     if not priv_path.exists():
         priv_path.write_text(priv)
@@ -186,6 +357,8 @@ def ensure_ssh_key(cfg: dict) -> tuple[str, str]:
     if cfg.get("ssh_private_key") and cfg.get("ssh_public_key"):
         _write_key_files(cfg)
         return cfg["ssh_private_key"], cfg["ssh_public_key"]
+    if _NONINTERACTIVE:
+        raise HeadlessError(EXIT_CONFIG, "no SSH key configured; run `python cli.py` and choose Configure first")
     print("\nNo SSH key found.")
     choice = ask("Generate a new Ed25519 key? (y/n)", "y").lower()
     if choice.startswith("y"):
@@ -208,19 +381,21 @@ def ensure_ssh_key(cfg: dict) -> tuple[str, str]:
     print("Stored your SSH keypair.")
     return priv, pub
 
-def pick_region(api) -> str:
+def pick_region(api, provider: str = "", size: str = "") -> str:
+    """With `provider` and `size`, regions are listed best first by provisioning history."""
     regions = api.list_regions()
     if not regions:
         print("No regions available.")
         return ""
-    print("\nAvailable Regions:")
-    for i, r in enumerate(regions, 1):
-        slug = r.get("slug") or r.get("id") or r.get("region") or ""
-        name = r.get("name") or r.get("label") or slug
-        print(f"{i}) {slug} - {name}")
+    slugs = {r.get("slug") or r.get("id") or r.get("region") or "": r for r in regions}
+    ranked = history.rank(history.stats(history.load(HISTORY_PATH)) if provider else {},
+                          [(provider, slug, size) for slug in slugs])
+    print("\nAvailable Regions" + (" (fastest and most reliable first):" if ranked[0][1] else ":"))
+    for i, ((_, slug, _), st) in enumerate(ranked, 1):
+        name = slugs[slug].get("name") or slugs[slug].get("label") or slug
+        print(f"{i}) {slug} - {name}" + (f"  [{history.describe(st)}]" if st else ""))
     idx = int(ask("Select region number", "1"))
-    chosen = regions[idx-1]
-    return chosen.get("slug") or chosen.get("id")
+    return ranked[idx-1][0][1]
 
 def pick_size(api) -> str:
     print("\nRecommended sizes:")
@@ -231,10 +406,87 @@ def pick_size(api) -> str:
     idx = int(ask("Select size number", "2"))
     return sizes[keys[idx-1]]
 
+def _split_placement(cfg: dict, regions: Dict[str, str], size: str, count: int) -> list[Dict[str, Any]]:
+    """
+    Spread `count` VMs over `regions` ({provider: region}) with placement.split, weighted by
+    the servers each account can still create and the expected time to ready from the
+    provisioning history (the same figure the region ranking uses).
+    One {"provider", "region", "size"} per VM, interleaved so that every provider gets its
+    first create at the start of the batch; fewer than `count` when the accounts are full.
+    """
+    table = history.stats(history.load(HISTORY_PATH))
+    candidates: Dict[str, Dict[str, Any]] = {}
+    specs: Dict[str, Dict[str, Any]] = {}
+    seen: Dict[str, Optional[Dict[str, Any]]] = {}
+    for provider, region in regions.items():
+        api = _api_for_provider(cfg, provider)
+        try:
+            capacity = api.capacity_remaining()
+        except _api_errors():
+            capacity = None
+        specs[provider] = {"provider": provider, "region": region,
+                           "size": api.recommended_sizes().get(size, size)}
+        seen[provider] = history.lookup(table, (provider, region, specs[provider]["size"]))
+        candidates[provider] = {"capacity": capacity, "seconds": (seen[provider] or {}).get("expected")}
+    shares = placement.split(count, candidates)
+    print("\nSplit across providers:")
+    for provider, n in shares.items():
+        capacity = candidates[provider]["capacity"]
+        print(f"  {provider:13s} {regions[provider]:14s} {n:3d} server(s)  (can create "
+              f"{'?' if capacity is None else capacity}; {history.describe(seen[provider])})")
+    out: list[Dict[str, Any]] = []
+    while len(out) < sum(shares.values()):
+        for provider in regions:
+            if shares[provider] > sum(1 for o in out if o["provider"] == provider):
+                out.append(specs[provider])
+    return out
+
 def _name_series(prefix: str, start: int, count: int) -> list[str]:
     width = len(str(start + count))
     return [f"{prefix}-{i:0{width}d}" for i in range(start, start + count)]
 
+# ---------------------------
+# Instances (several srcds containers per VM)
+# ---------------------------
+# Registry entries are per instance. Instances on the same VM share provider id/ip and
+# carry "host" (the VM name), "container", "instance" (0-based) and their allocated ports.
+
+def _instance_ports(index: int) -> Dict[str, int]:
+    off = index * PORT_STRIDE
+    return {
+        "game_port": GAME_PORT + off,
+        "stv_port": STV_PORT + off,
+        "client_port": CLIENT_PORT + off,
+        "steam_port": STEAM_PORT + off,
+    }
+
+def _instance_names(host: str, per_vm: int) -> list[str]:
+    if per_vm <= 1:
+        return [host]
+    return [f"{host}-{i}" for i in range(1, per_vm + 1)]
+
+def _container_name(index: int) -> str:
+    return "tf2" if index == 0 else f"tf2-{index + 1}"
+
+def _inst(meta: Dict[str, Any]) -> Dict[str, Any]:
+    """Instance fields of a registry entry; entries from before multi-instance support get the defaults."""
+    out: Dict[str, Any] = {"container": "tf2", "instance": 0}
+    out.update(_instance_ports(0))
+    out.update({k: meta[k] for k in out if k in meta})
+    return out
+
+def _host_of(name: str, meta: Dict[str, Any]) -> str:
+    return meta.get("host") or name
+
+def _instances_on(reg: Dict[str, Any], host: str) -> list[str]:
+    names = [n for n, m in reg.items() if _host_of(n, m) == host]
+    return sorted(names, key=lambda n: _inst(reg[n])["instance"])
+
+def _server_config_path(meta: Dict[str, Any]) -> Path:
+    container = _inst(meta)["container"]
+    suffix = "" if container == "tf2" else f"-{container}"
+    return CONFIG_DIR / f"{meta.get('id', '')}{suffix}.json"
+
 def _choose_server_by_name(reg: Dict[str, Any]) -> Optional[str]:
     if not reg:
         print("No known servers (registry is empty).")
@@ -246,7 +498,8 @@ def _choose_server_by_name(reg: Dict[str, Any]) -> Optional[str]:
         ip = meta.get("ip", "")
         did = meta.get("id", "")
         prov = meta.get("provider", "")
-        print(f"{i}) {n:20s}  ip={ip:15s}  id={did}  [{prov}]")
+        inst = _inst(meta)
+        print(f"{i}) {n:20s}  ip={ip:15s}  port={inst['game_port']}  host={_host_of(n, meta)}  id={did}  [{prov}]")
     idx = ask("Number", "1")
     try:
         idx = int(idx)
@@ -265,11 +518,11 @@ def _ensure_ip_for(reg: Dict[str, Any], name: str, api) -> Optional[str]:
     sid = meta.get("id")
     if not sid:
         return None
-    info = api.wait_for_active_ip(sid)
+    info = api.for_server(meta).wait_for_active_ip(sid)
     ip = info.get("ip", "")
     if ip:
-        meta["ip"] = ip
-        reg[name] = meta
+        for sibling in _instances_on(reg, _host_of(name, meta)):
+            reg[sibling]["ip"] = ip
         save_registry(reg)
     return ip
 
@@ -277,7 +530,13 @@ def _print_summary_line(name: str, item: Dict[str, Any]):
     ip = item.get("ip", "")
     did = item.get("id", "")
     prov = item.get("provider", "")
-    print(f"- {name:16s} id={did} ip={ip:15s} [{prov}]")
+    inst = _inst(item)
+    print(f"- {name:16s} id={did} ip={ip:15s} port={inst['game_port']} "
+          f"container={inst['container']} host={_host_of(name, item)} [{prov}]")
+
+def _conn_strings_for(ip: str, m: Dict[str, Any]) -> Tuple[str, str, str]:
+    inst = _inst(m)
+    return _build_conn_strings(ip, inst["game_port"], inst["stv_port"], m.get("sv_password", ""), m.get("rcon_password", ""))
 
 def _build_conn_strings(ip: str, game_port: int, stv_port: int, sv_password: str, rcon_password: str) -> Tuple[str, str, str]:
     game = f'connect {ip}:{game_port}; password "{sv_password}"' if sv_password else f'connect {ip}:{game_port}'
@@ -285,11 +544,1391 @@ def _build_conn_strings(ip: str, game_port: int, stv_port: int, sv_password: str
     rcon = f'rcon_address {ip}:{game_port}; rcon_password "{rcon_password}"'
     return game, stv, rcon
 
+def _instance_record(name: str, m: Dict[str, Any]) -> Dict[str, Any]:
+    """One instance as the headless CLI reports it."""
+    inst = _inst(m)
+    return {
+        "name": name,
+        "host": _host_of(name, m),
+        "container": inst["container"],
+        "provider": m.get("provider", ""),
+        "id": m.get("id", ""),
+        "ip": m.get("ip", ""),
+        "region": m.get("region", ""),
+        "size": m.get("size", ""),
+        "game_port": inst["game_port"],
+        "stv_port": inst["stv_port"],
+        "rcon_password": m.get("rcon_password", ""),
+        "sv_password": m.get("sv_password", ""),
+        "stv_password": m.get("stv_password", ""),
+    }
+
+def _exec_instances(reg: Dict[str, Any], names: list[str], api, priv: str,
+                    command: Callable[[str], str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Run command(container) on the VM of each instance in `names`.
+    Returns {name: {"ip", "container", "rc", "stdout", "stderr"}}; rc is None when there is no IP yet.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in names:
+        ip = _ensure_ip_for(reg, name, api)
+        container = _inst(reg[name])["container"]
+        if not ip:
+            results[name] = {"ip": "", "container": container, "rc": None, "stdout": "", "stderr": "no IP yet"}
+            continue
+        rc, out, err = SSHOps.run_command(ip, "root", priv, command(container))
+        results[name] = {"ip": ip, "container": container, "rc": rc, "stdout": out, "stderr": err}
+    return results
+
+def _agent_instances(reg: Dict[str, Any], names: list[str], api, priv: str, op: str,
+                     command: Callable[[str], str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Agent operation `op` ("restart" / "apply_includes") for the instances in `names`: one
+    request per VM that runs the agent, command(container) over SSH exec for the others
+    (and for VMs whose agent could not be reached). A request that reached the agent is
+    never repeated over SSH, even when it failed or timed out. Results as _exec_instances,
+    plus "via".
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    by_host: Dict[str, list] = {}
+    for name in names:
+        by_host.setdefault(_host_of(name, reg[name]), []).append(name)
+    targets = {}
+    for host, inames in by_host.items():
+        info = agent.endpoint(reg[inames[0]])
+        ip = _ensure_ip_for(reg, inames[0], api) if info else ""
+        if info and ip:
+            targets[host] = (ip, info, {"containers": [_inst(reg[n])["container"] for n in inames]})
+    results: Dict[str, Dict[str, Any]] = {}
+    for host, reply in agent.fleet(targets, op, priv).items():
+        if isinstance(reply, agent.AgentUnreachable):
+            print(f"{host}: agent: {reply}; using SSH")
+            continue
+        for name in by_host[host]:
+            container = _inst(reg[name])["container"]
+            if isinstance(reply, agent.AgentError):
+                res = {"rc": 1, "output": f"agent: {reply}"}
+            else:
+                res = reply.get(container) or {"rc": 1, "output": "no result from the agent"}
+            results[name] = {"ip": targets[host][0], "container": container, "rc": res["rc"],
+                             "stdout": res["output"] if res["rc"] == 0 else "",
+                             "stderr": "" if res["rc"] == 0 else res["output"], "via": "agent"}
+    rest = [n for n in names if n not in results]
+    for name, res in _exec_instances(reg, rest, api, priv, command).items():
+        results[name] = {**res, "via": "ssh"}
+    return {n: results[n] for n in names}
+
+def _agent_targets(reg: Dict[str, Any], hosts: list[str], api) -> Tuple[Dict[str, Tuple[str, Dict[str, Any]]],
+                                                                       Dict[str, str]]:
+    """({host: (ip, agent endpoint)} for VMs that run the agent, {host: why not} for the rest)."""
+    targets: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    missing: Dict[str, str] = {}
+    for host in hosts:
+        first = _instances_on(reg, host)[0]
+        info = agent.endpoint(reg[first])
+        ip = _ensure_ip_for(reg, first, api)
+        if info and ip:
+            targets[host] = (ip, info)
+        else:
+            missing[host] = "no IP yet" if not ip else "no agent; re-configure to install it"
+    return targets, missing
+
+def _collect_logs(reg: Dict[str, Any], hosts: list[str], api, cfg: dict, priv: str) -> Dict[str, Dict[str, Any]]:
+    """Fetch what the logs of `hosts` gained since the last collection into the local log store."""
+    targets, missing = _agent_targets(reg, hosts, api)
+    out = logstore.collect(LOGSTORE_DIR, targets, priv, float(cfg.get("log_retention_days",
+                                                                      logstore.DEFAULT_RETENTION_DAYS)))
+    out.update({h: {"error": why} for h, why in missing.items()})
+    return dict(sorted(out.items()))
+
+def _demo_listings(reg: Dict[str, Any], names: list[str], api, priv: str) -> Tuple[Dict[str, Tuple[str, str, list]],
+                                                                                  Dict[str, str]]:
+    """
+    The .dem files of each instance in `names`: one agent request per VM, in parallel, and
+    `find` over SSH (also in parallel) where there is no agent. Returns
+    ({name: (ip, container, listing)}, {name: why not}).
+    """
+    # pylint: disable=too-many-locals,too-many-branches
+    by_host: Dict[str, list] = {}
+    for name in names:
+        by_host.setdefault(_host_of(name, reg[name]), []).append(name)
+    targets, _ = _agent_targets(reg, sorted(by_host), api)
+    listings: Dict[str, Tuple[str, str, list]] = {}
+    errors: Dict[str, str] = {}
+    demo_requests = {h: (ip, info, {"containers": [_inst(reg[n])["container"] for n in by_host[h]]})
+                     for h, (ip, info) in targets.items()}
+    for host, reply in agent.fleet(demo_requests, "demos", priv).items():
+        if isinstance(reply, agent.AgentError):
+            print(f"{host}: agent: {reply}; using SSH")
+            continue
+        for name in by_host[host]:
+            container = _inst(reg[name])["container"]
+            res = reply.get(container) or {"error": "no result from the agent"}
+            if "error" in res:
+                errors[name] = res["error"]
+            else:
+                listings[name] = (targets[host][0], container, res["demos"])
+    rest = {}
+    for name in names:
+        if name not in listings and name not in errors:
+            ip = _ensure_ip_for(reg, name, api)
+            if ip:
+                rest[name] = (ip, _inst(reg[name])["container"])
+            else:
+                errors[name] = "no IP yet"
+    for name, listing in demos.list_over_ssh(rest, priv).items():
+        if isinstance(listing, str):
+            errors[name] = listing
+        else:
+            listings[name] = (*rest[name], listing)
+    return listings, errors
+
+def _harvest_demos(reg: Dict[str, Any], names: list[str], api, cfg: dict, priv: str,
+                   parallel: Optional[int] = None, limit_mbps: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+    """Download the finished demos of `names` that are not in .tf2ctl/demos/<name>/ yet."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    listings, errors = _demo_listings(reg, names, api, priv)
+    parallel = parallel or int(cfg.get("demo_parallel", demos.MAX_PARALLEL))
+    limit_mbps = float(cfg.get("demo_bandwidth_mbps", 0)) if limit_mbps is None else limit_mbps
+    new = sum(1 for _, _, listing in listings.values() for d in listing if not d.get("recording"))
+    print(f"Listed {new} finished demo(s) on {len(listings)} instance(s); downloading what is new "
+          f"({parallel} at a time{f', {limit_mbps:g} Mbit/s cap' if limit_mbps else ''})...")
+    out = demos.harvest(listings, DEMOS_DIR, priv, parallel, limit_mbps * 1e6 / 8)
+    out.update({name: {"errors": [why]} for name, why in errors.items()})
+    return dict(sorted(out.items()))
+
+def _print_harvest(out: Dict[str, Dict[str, Any]]):
+    for name, res in out.items():
+        if "listed" not in res:
+            print(f"{name}: {res['errors'][0]}")
+            continue
+        print(f"{name}: {res['fetched']} new ({res['bytes'] / 1e6:.1f} MB, {res['wire_bytes'] / 1e6:.1f} MB "
+              f"transferred), {res['present']} already here, {res['recording']} still recording")
+        for err in res["errors"]:
+            print(f"  ! {err}")
+    print(f"Demos are in {DEMOS_DIR}/<instance>/")
+
+def _container_health(reg: Dict[str, Any], names: list[str], priv: str) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    {name: {"running", "restart_count"}} for `names`: one agent status request per VM (in
+    parallel), `docker inspect` over SSH for VMs without one (in parallel too, one connection
+    attempt each, so dead VMs do not hold up a watchdog round); None where neither answered.
+    """
+    # pylint: disable=too-many-locals
+    by_host: Dict[str, list] = {}
+    for name in names:
+        if reg.get(name, {}).get("ip"):
+            by_host.setdefault(_host_of(name, reg[name]), []).append(name)
+    containers: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    targets = {h: (reg[ns[0]]["ip"], agent.endpoint(reg[ns[0]]), {}) for h, ns in by_host.items()
+               if agent.endpoint(reg[ns[0]])}
+    for host, reply in agent.fleet(targets, "status", priv).items():
+        if not isinstance(reply, agent.AgentError):
+            containers[host] = reply.get("containers", {})
+    inspect = ("docker inspect -f '{{.Name}} {{.State.Running}} {{.RestartCount}}' "
+               "$(docker ps -aq --filter label=tf2ctl.instance)")
+
+    def ssh_inspect(host: str) -> Tuple[str, int, str]:
+        return (host, *SSHOps.run_command(reg[by_host[host][0]]["ip"], "root", priv, inspect, get_pty=False,
+                                          attempts=1)[:2])
+
+    rest = sorted(set(by_host) - set(containers))
+    with ThreadPoolExecutor(max_workers=max(1, min(agent.MAX_PARALLEL, len(rest)))) as pool:
+        inspected = list(pool.map(ssh_inspect, rest))
+    for host, rc, out in inspected:
+        if rc == 0:
+            containers[host] = {}
+            for line in out.splitlines():
+                parts = line.split()
+                if len(parts) == 3 and parts[2].isdigit():
+                    containers[host][parts[0].lstrip("/")] = {"running": parts[1] == "true",
+                                                              "restart_count": int(parts[2])}
+    out: Dict[str, Optional[Dict[str, Any]]] = {}
+    for host, inames in by_host.items():
+        for name in inames:
+            if host in containers:
+                # A container the VM does not know at all is as good as stopped
+                out[name] = containers[host].get(_inst(reg[name])["container"]) or {"running": False,
+                                                                                   "restart_count": 0}
+            else:
+                out[name] = None
+    return out
+
+def _remediate(cfg: dict, priv: str, name: str, step: str) -> Tuple[bool, str]:
+    """One watchdog remediation step ("restart" / "reapply" / "reconfigure") for instance `name`."""
+    reg = load_registry()
+    if name not in reg:
+        return False, "no longer in the registry"
+    if step == "reconfigure":
+        tracing.start_run(TRACES_DIR, "watchdog")
+        try:
+            with tracing.tags(server=name), tracing.span("configure") as sp:
+                ok, _ = _configure_host(reg, [name], cfg, priv)
+                sp["ok"] = ok
+        finally:
+            tracing.end_run()
+        return ok, "setup.sh finished" if ok else f"setup.sh failed; see {LOGS_DIR}"
+    op, command = (("restart", lambda c: f"docker restart {c}") if step == "restart" else
+                   ("apply_includes", lambda c: f"bash /root/tf2-copy.sh {c}"))
+    host = _host_of(name, reg[name])
+    try:
+        res = _agent_instances(reg, [name], None, priv, op, command)[name]
+    except OSError as exc:
+        return False, f"{host} unreachable: {exc}"
+    if res["rc"] is None or res["stderr"].startswith("(failed to connect)"):
+        return False, f"{host} unreachable: {res['stderr']}"
+    return res["rc"] == 0, (res["stdout"] or res["stderr"] or f"exit {res['rc']}").strip()
+
+def _make_watchdog(cfg: dict, priv: str, dry_run: bool = False,
+                   lock: Optional[threading.Lock] = None) -> watchdog.Watchdog:
+    """A Watchdog over every registered instance with an IP; remediations hold `lock` when given."""
+    def targets() -> Dict[str, Tuple[str, int]]:
+        reg = load_registry()
+        return {n: (m["ip"], int(_inst(m)["game_port"])) for n, m in reg.items() if m.get("ip")}
+
+    def probe(endpoints: Dict[str, Tuple[str, int]]) -> Dict[str, Optional[Dict[str, Any]]]:
+        replies = a2s.info_many(endpoints.values(), watchdog.A2S_TIMEOUT)
+        return {n: replies.get(ep) for n, ep in endpoints.items()}
+
+    def remediate(name: str, step: str) -> Tuple[bool, str]:
+        with lock or contextlib.nullcontext():
+            return _remediate(cfg, priv, name, step)
+
+    return watchdog.Watchdog(WATCHDOG_DIR, targets, probe, lambda names: _container_health(load_registry(), names, priv),
+                             remediate, int(cfg.get("watchdog_fail_threshold", watchdog.DEFAULT_FAIL_THRESHOLD)),
+                             int(cfg.get("watchdog_max_actions_per_hour", watchdog.DEFAULT_MAX_ACTIONS_PER_HOUR)),
+                             dry_run)
+
+def _scaler_inventory(cfg: dict) -> Dict[str, Dict[str, Any]]:
+    """{VM: {"region", "managed", "endpoints"}} for the scaler; managed VMs carry the scaler_prefix."""
+    reg = load_registry()
+    prefix = cfg.get("scaler_prefix", "auto") + "-"
+    out: Dict[str, Dict[str, Any]] = {}
+    for name, m in reg.items():
+        host = _host_of(name, m)
+        vm = out.setdefault(host, {"region": m.get("region", ""), "managed": host.startswith(prefix), "endpoints": []})
+        if m.get("ip"):
+            vm["endpoints"].append((m["ip"], int(_inst(m)["game_port"])))
+    return out
+
+def _scale_provision(cfg: dict, region: str, count: int, window: Dict[str, Any]) -> Tuple[list, str]:
+    """Create `count` managed VMs in `region` through a regular create job; (ready VM names, detail)."""
+    # pylint: disable=too-many-locals
+    provider = window.get("provider") or cfg.get("provider", "digitalocean")
+    api = _api_for_provider(cfg, provider)
+    try:
+        remaining = api.capacity_remaining()
+    except _api_errors():
+        remaining = None
+    if remaining is not None and count > remaining:
+        if remaining <= 0:
+            return [], f"{provider} account limit reached"
+        print(f"[scaler] {region}: {provider} can create {remaining} more; asking for that many")
+        count = remaining
+    spare = max(0, int(window.get("spare", cfg.get("create_spare", 0))))
+    if remaining is not None:
+        spare = min(spare, remaining - count)
+    start_map = window.get("start_map") or map_store.DEFAULT_MAP
+    map_store.ensure_default(MAPS_DIR)
+    if not map_store.resolve(MAPS_DIR, start_map) and not window.get("stock_map"):
+        return [], f"{start_map} is not in the map store"
+    series = f"{cfg.get('scaler_prefix', 'auto')}-{region}"
+    taken = [int(m.group(1)) for m in (re.fullmatch(re.escape(series) + r"-(\d+)", _host_of(n, meta))
+                                       for n, meta in load_registry().items()) if m]
+    names = _name_series(series, max(taken, default=0) + 1, count + spare)
+    size = window.get("size") or cfg.get("scaler_size", "medium")
+    job = jobs.new_job(JOBS_DIR, names, {
+        "provider": provider,
+        "region": region,
+        "size": api.recommended_sizes().get(size, size),
+        "start_map": start_map,
+        "demos_tf_apikey": "",
+        "logs_tf_apikey": "",
+        "instances_per_vm": max(1, int(window.get("per_vm") or cfg.get("scaler_per_vm", 1))),
+        "tuning_profile": cfg.get("tuning_profile", "off"),
+        "target": count if spare else 0,
+        "stragglers": cfg.get("straggler_action", "delete"),
+    })
+    ready, unfinished = _run_create_job(job, api, cfg)
+    if not unfinished:
+        return ready, f"job {job['id']}"
+    return ready, f"job {job['id']}: " + "; ".join(
+        f"{n} {job['servers'][n]['state']} {job['servers'][n].get('error', '')}".strip() for n in unfinished)
+
+def _retire_host(cfg: dict, host: str) -> Tuple[bool, str]:
+    """Delete VM `host` with the provider it was created on and forget its instances."""
+    reg = load_registry()
+    inames = _instances_on(reg, host)
+    if not inames:
+        return True, "no longer in the registry"
+    meta = reg[inames[0]]
+    try:
+        _api_for_server(cfg, meta).delete_server(meta["id"])
+    except _api_errors() as exc:
+        return False, str(exc)
+    _forget_host(reg, host)
+    return True, f"deleted {meta.get('provider', '')} id={meta['id']}"
+
+def _make_scaler(cfg: dict, dry_run: bool = False, lock: Optional[threading.Lock] = None) -> scaler.Scaler:
+    """A Scaler over the registry driven by the scaler_* config; raises scaler.ScheduleError."""
+    schedule = scaler.parse_schedule(cfg.get("scaler_schedule") or [])
+    minimum = cfg.get("scaler_minimum") or {}
+    if not isinstance(minimum, dict):
+        raise scaler.ScheduleError("scaler_minimum must be an object of region -> server count")
+
+    def provision(region: str, count: int, window: Dict[str, Any]) -> Tuple[list, str]:
+        with lock or contextlib.nullcontext():
+            return _scale_provision(cfg, region, count, window)
+
+    def retire(host: str) -> Tuple[bool, str]:
+        with lock or contextlib.nullcontext():
+            return _retire_host(cfg, host)
+
+    return scaler.Scaler(SCALER_DIR, schedule, minimum,
+                         float(cfg.get("scaler_idle_minutes", scaler.DEFAULT_IDLE_MINUTES)) * 60,
+                         float(cfg.get("scaler_lead_minutes", scaler.DEFAULT_LEAD_MINUTES)) * 60,
+                         lambda: _scaler_inventory(cfg), lambda eps: a2s.info_many(eps, scaler.A2S_TIMEOUT),
+                         provision, retire, dry_run)
+
+def _container_logs(meta: Dict[str, Any], ip: str, priv: str, tail: int = 200) -> str:
+    """Last `tail` lines of an instance's container log, from the agent when its VM runs one."""
+    container = _inst(meta)["container"]
+    info = agent.endpoint(meta)
+    if info:
+        try:
+            return agent.request(ip, priv, info, "logs", container=container, tail=tail)["text"]
+        except agent.AgentError as exc:
+            print(f"(agent: {exc}; using SSH)")
+    return SSHOps.get_container_logs(host=ip, user="root", private_key=priv, container=container, tail=tail)
+
+def _follow_logs(reg: Dict[str, Any], names: list[str], api, priv: str, pattern: str = "",
+                 ignore_case: bool = False, tail: int = 20, duration: Optional[float] = None) -> Dict[str, Any]:
+    """Stream the container logs of `names` (filtered on the servers by `pattern`) until Ctrl-C."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    streams = _log_streams(reg, names, api)
+    if not streams:
+        return {}
+    print(f"Following {len(streams)} instance(s){f' (lines matching {pattern!r})' if pattern else ''}; "
+          "Ctrl-C to stop.")
+    return logtail.follow(streams, priv, pattern, ignore_case, tail, duration=duration)
+
+def _log_streams(reg: Dict[str, Any], names: list[str], api) -> Dict[str, Tuple[str, str]]:
+    streams = {}
+    for name in names:
+        ip = _ensure_ip_for(reg, name, api)
+        if ip:
+            streams[name] = (ip, _inst(reg[name])["container"])
+        else:
+            print(f"{name}: no IP yet, skipping.")
+    return streams
+
+def _watch_matches(reg: Dict[str, Any], names: list[str], api, priv: str, kinds, until: str = "",
+                   duration: Optional[float] = None, as_json: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Feed the live srcds log lines of `names` through a matchlog.Pipeline and print its
+    `kinds` events until Ctrl-C, `duration`, or every instance has emitted `until`.
+    Returns (per-instance match state, per-stream stats with "reached" when `until` is set).
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    streams = _log_streams(reg, names, api)
+    if not streams:
+        return {}, {}
+    pipeline = matchlog.Pipeline()
+    width = max(len(n) for n in streams)
+
+    def show(event: Dict[str, Any]):
+        if as_json:
+            print(json.dumps(event))
+        else:
+            stamp = time.strftime("%H:%M:%S", time.gmtime(event["time"]))
+            print(f"[{event['server']:<{width}}] {stamp} {matchlog.describe(event)}")
+
+    pipeline.subscribe(show, kinds)
+    stop = threading.Event()
+    waiting = set(streams)
+    if until:
+
+        def reached(event: Dict[str, Any]):
+            waiting.discard(event["server"])
+            if not waiting:
+                stop.set()
+
+        pipeline.subscribe(reached, [until])
+    print(f"Watching match events on {len(streams)} instance(s)"
+          f"{f' until each reports {until}' if until else ''}; Ctrl-C to stop.")
+    # Only srcds log lines (echoed to the console) cross the network, and only new ones
+    stats = logtail.follow(streams, priv, matchlog.LOG_LINE_PATTERN, tail=0, duration=duration, stop=stop,
+                           on_line=pipeline.feed_line)
+    if until:
+        for name, st in stats.items():
+            st["reached"] = name not in waiting
+    return pipeline.summary(), stats
+
+def _forget_host(reg: Dict[str, Any], host: str) -> list[str]:
+    """Drop every instance of VM `host` from the registry (and their config files); returns their names."""
+    inames = _instances_on(reg, host)
+    for name in inames:
+        meta_path = _server_config_path(reg.pop(name))
+        if meta_path.exists():
+            try:
+                meta_path.unlink()
+            except (OSError, PermissionError, FileNotFoundError) as exc:
+                print(f"Failed to delete config for {name}: {exc}")
+    save_registry(reg)
+    return inames
+
+
+def _print_trace_summary():
+    spans = tracing.load_spans(TRACES_DIR)
+    if not spans:
+        print(f"No traces recorded yet under {TRACES_DIR}")
+        return
+    runs = {s.get("run") for s in spans}
+    summary = tracing.summarize(TRACES_DIR)
+    print(f"\nPhase timings across {len(runs)} run(s) (seconds):\n")
+    print(f"{'phase':34s} {'count':>6s} {'failed':>6s} {'p50':>9s} {'p95':>9s} {'max':>9s}")
+    for phase in sorted(summary.keys()):
+        st = summary[phase]
+        print(f"{phase:34s} {st['count']:6d} {st['failed']:6d} {st['p50']:9.2f} {st['p95']:9.2f} {st['max']:9.2f}")
+
+def _history_ranking(provider: str = "") -> list[Tuple[str, Dict[str, Any]]]:
+    """Every (provider, region, size) with enough provisioning history, best first."""
+    table = history.stats(history.load(HISTORY_PATH))
+    candidates = [tuple(k.split("/", 2)) for k in table
+                  if not k.endswith("/*") and (not provider or k.startswith(f"{provider}/"))]
+    return [(history.key(*c), st) for c, st in history.rank(table, candidates, exact=True) if st]
+
+def _print_history_stats():
+    ranking = _history_ranking()
+    if not ranking:
+        return
+    print("\nCreation -> ready per provider/region/size, best first:\n")
+    print(f"{'provider/region/size':40s} {'runs':>5s} {'p50':>7s} {'p90':>7s} {'failed':>7s} {'strag':>6s} {'expect':>7s}")
+    def secs(v: Optional[float]) -> str:
+        return f"{v:7.0f}" if v is not None else f"{'-':>7s}"
+
+    for k, st in ranking:
+        print(f"{k:40s} {st['runs']:5d} {secs(st['p50'])} {secs(st['p90'])} {st['failure_rate']:7.0%} "
+              f"{st['straggler_rate']:6.0%} {secs(st['expected'])}")
+
+def _straggler_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Per "provider/region", over the recorded over-provisioned batches: VMs raced, how many
+    straggled and where they were stuck when the batch filled. `slow` counts stragglers that
+    were not yet configured (no IP, no SSH, or still pulling/configuring) or had failed;
+    `suggested_spare` is that share of the typical batch, rounded up.
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    try:
+        lines = STRAGGLERS_PATH.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return out
+    targets: Dict[str, list] = {}
+    for line in lines:
+        try:
+            rec = json.loads(line)
+        except JSONDecodeError:
+            continue
+        key = f"{rec.get('provider', '')}/{rec.get('region', '')}"
+        st = out.setdefault(key, {"batches": 0, "raced": 0, "stragglers": 0, "slow": 0, "stuck_at": {}})
+        st["batches"] += 1
+        st["raced"] += rec.get("target", 0) + rec.get("spare", 0)
+        targets.setdefault(key, []).append(rec.get("target", 0))
+        for straggler in rec.get("stragglers", []):
+            state = straggler.get("state", "")
+            st["stragglers"] += 1
+            st["stuck_at"][state] = st["stuck_at"].get(state, 0) + 1
+            if straggler.get("error") or state in jobs.STATES[:jobs.STATES.index("configured")]:
+                st["slow"] += 1
+    for key, st in out.items():
+        typical = sorted(targets[key])[len(targets[key]) // 2]
+        rate = st["slow"] / st["raced"] if st["raced"] else 0.0
+        st["slow_rate"] = round(rate, 3)
+        st["suggested_spare"] = math.ceil(typical * rate)
+    return dict(sorted(out.items()))
+
+def _print_straggler_stats():
+    stats = _straggler_stats()
+    if not stats:
+        return
+    print("\nStragglers in over-provisioned creates (per provider/region):\n")
+    print(f"{'provider/region':28s} {'batches':>7s} {'raced':>6s} {'strag':>6s} {'slow':>5s} {'spare':>6s}  stuck at")
+    for key, st in stats.items():
+        stuck = ", ".join(f"{k}={v}" for k, v in sorted(st["stuck_at"].items()))
+        print(f"{key:28s} {st['batches']:7d} {st['raced']:6d} {st['stragglers']:6d} {st['slow']:5d} "
+              f"{st['suggested_spare']:6d}  {stuck}")
+
+
+# ---------------------------
+# Create jobs (checkpointed, resumable)
+# ---------------------------
+
+def _server_substitutions(m: Dict[str, Any], fastdl_url: str = "") -> Dict[str, str]:
+    inst = _inst(m)
+    return {
+        "FASTDL_URL": fastdl_url,
+        "CONTAINER_NAME": inst["container"],
+        "INSTANCE_INDEX": str(inst["instance"]),
+        "INSTANCE_COUNT": str(m.get("instances_per_vm", 1)),
+        "TUNING_PROFILE": m.get("tuning_profile", "off"),
+        "GAME_PORT": str(inst["game_port"]),
+        "STV_PORT": str(inst["stv_port"]),
+        "CLIENT_PORT": str(inst["client_port"]),
+        "STEAM_PORT": str(inst["steam_port"]),
+        "SERVER_HOSTNAME": m["hostname"],
+        "RCON_PASSWORD": m["rcon_password"],
+        "SERVER_PASSWORD": m["sv_password"],
+        "START_MAP": m["start_map"],
+        "STV_PASSWORD": m["stv_password"],
+        "DEMOS_TF_APIKEY": m.get("demos_tf_apikey", ""),
+        "LOGS_TF_APIKEY": m.get("logs_tf_apikey", ""),
+        "FORCE_PHASES": "",
+    }
+
+def _new_server_meta(params: Dict[str, Any], host: str, name: str, index: int, sid) -> Dict[str, Any]:
+    meta = {
+        "provider": params["provider"],
+        "id": sid,
+        "ip": "",
+        "region": params["region"],
+        "size": params["size"],
+        "created_at": datetime.now(UTC).isoformat().replace("+00:00", "Z"),
+        "host": host,
+        "container": _container_name(index),
+        "instance": index,
+        "instances_per_vm": int(params.get("instances_per_vm", 1)),
+        **_instance_ports(index),
+        "tuning_profile": params.get("tuning_profile", "off"),
+        "hostname": name,
+        "rcon_password": SSHOps.random_password(16),
+        "sv_password": SSHOps.random_password(12),
+        "stv_password": "stv",
+        "start_map": params["start_map"],
+        "demos_tf_apikey": params.get("demos_tf_apikey", ""),
+        "logs_tf_apikey": params.get("logs_tf_apikey", ""),
+    }
+    _server_config_path(meta).write_text(json.dumps({
+        "hostname": meta["hostname"],
+        "rcon_password": meta["rcon_password"],
+        "sv_password": meta["sv_password"],
+        "stv_password": meta["stv_password"],
+        "start_map": meta["start_map"],
+        "demos_tf_apikey": meta["demos_tf_apikey"],
+        "logs_tf_apikey": meta["logs_tf_apikey"]
+    }, indent=2))
+    return meta
+
+def _ask_tuning_profile(default: str) -> str:
+    while True:
+        profile = ask(f"Host tuning profile ({'/'.join(TUNING_PROFILES)})", default).strip().lower()
+        if profile in TUNING_PROFILES:
+            return profile
+        print("Unknown profile.")
+
+# Serializes registry updates from configures that run in parallel (rolling updates)
+_REGISTRY_LOCK = threading.Lock()
+
+def _record_report(reg: Dict[str, Any], names: list[str], report: Dict[str, Any]):
+    """Store what a configure reported: applied tuning per instance, map inventory, image and agent per VM."""
+    tuning = report.get("tuning") or {}
+    with _REGISTRY_LOCK:
+        # A straggler may have been deleted (and forgotten) while it was still configuring
+        names = [n for n in names if n in reg]
+        for n in names:
+            applied = tuning.get(_inst(reg[n])["container"])
+            if applied:
+                reg[n]["tuning"] = applied
+        for key in ("maps", "image", "agent"):
+            if names and isinstance(report.get(key), dict) and report[key]:
+                for sibling in _instances_on(reg, _host_of(names[0], reg[names[0]])):
+                    reg[sibling][key] = report[key]
+        save_registry(reg)
+
+def _image_substitutions(cfg: dict, archive: str = "") -> Dict[str, str]:
+    pin = cfg.get("tf2_image_pin") or {}
+    return {
+        "TF2_IMAGE": pin.get("ref") or cfg.get("tf2_image", DEFAULT_TF2_IMAGE),
+        "TF2_IMAGE_ID": pin.get("id", ""),
+        "TF2_IMAGE_ARCHIVE": archive,
+    }
+
+def _pin_image(cfg: dict, report: Dict[str, Any]):
+    """Pin the fleet to the image the first configured server ended up with."""
+    image = report.get("image") or {}
+    if (cfg.get("tf2_image_pin") or {}).get("id") or not image.get("id"):
+        return
+    cfg["tf2_image_pin"] = {
+        "ref": image.get("repo_digest") or image.get("ref", ""),
+        "id": image["id"],
+        "pinned_at": datetime.now(UTC).isoformat().replace("+00:00", "Z"),
+    }
+    save_config(cfg)
+    print(f"Pinned TF2 image: {cfg['tf2_image_pin']['ref']} ({image['id'][:19]})")
+
+def _fan_out_image(reg: Dict[str, Any], seeds: list[str], peers: list[str], cfg: dict, priv: str) -> Dict[str, str]:
+    """
+    Save the pinned image on each region's (already configured) seed as a zstd'd archive and
+    relay it to the region's peers. Returns {peer: remote archive path}; peers left out pull.
+    """
+    # pylint: disable=too-many-locals
+    image_id = (cfg.get("tf2_image_pin") or {}).get("id")
+    if not image_id:
+        return {}
+    out: Dict[str, str] = {}
+    for seed in seeds:
+        seed_meta = reg[_instances_on(reg, seed)[0]]
+        region = seed_meta.get("region", "")
+        group = [p for p in peers if reg[_instances_on(reg, p)[0]].get("region", "") == region]
+        if not group:
+            continue
+        part = f"{distribute.SHARED_DIR}/image{IMAGE_ARCHIVE_SUFFIX}.part"
+        cmd = (f"set -o pipefail; mkdir -p {distribute.SHARED_DIR} && "
+               f"docker save {image_id} | zstd -T0 -3 -q -f -o {part} && "
+               f"sha=$(sha256sum {part} | cut -d' ' -f1) && "
+               f"mv {part} {distribute.SHARED_DIR}/$sha{IMAGE_ARCHIVE_SUFFIX} && echo $sha")
+        print(f"Saving the TF2 image on {seed} for {len(group)} peer(s) in {region}...")
+        with tracing.span("image.save", server=seed):
+            rc, stdout, err = SSHOps.run_command(seed_meta["ip"], "root", priv, f"bash -c {shlex.quote(cmd)}",
+                                                 get_pty=False)
+        sha = stdout.strip().split()[-1] if rc == 0 and stdout.strip() else ""
+        if not sha:
+            print(f"  -> could not save the image on {seed} (exit {rc}): {err.strip()[-200:]}; peers will pull.")
+            continue
+        nodes = [(seed, seed_meta["ip"])] + [(p, reg[_instances_on(reg, p)[0]]["ip"]) for p in group]
+        how = distribute.fan_out({region: nodes}, sha, None, priv, suffix=IMAGE_ARCHIVE_SUFFIX)
+        out.update({p: distribute.remote_path(sha, IMAGE_ARCHIVE_SUFFIX) for p in group if how.get(p) != "failed"})
+        SSHOps.run_command(seed_meta["ip"], "root", priv,
+                           f"rm -f {distribute.remote_path(sha, IMAGE_ARCHIVE_SUFFIX)}", get_pty=False)
+    return out
+
+def _wanted_maps(reg: Dict[str, Any], host: str) -> list[str]:
+    siblings = _instances_on(reg, host)
+    return map_store.wanted_for(MAPS_DIR, host, [reg[i].get("start_map", "") for i in siblings])
+
+def _missing_maps(reg: Dict[str, Any], name: str) -> list[str]:
+    """Store maps the VM of `name` wants but has not reported having."""
+    wanted = _wanted_maps(reg, _host_of(name, reg[name]))
+    return map_store.missing_names(MAPS_DIR, wanted, reg[name].get("maps") or {})
+
+def _fastdl_url(reg: Dict[str, Any], cfg: dict, host: str) -> str:
+    """sv_downloadurl for the instances on `host` ("" when FastDL is off)."""
+    if cfg.get("fastdl_url"):
+        return cfg["fastdl_url"]
+    mode = cfg.get("fastdl_mode", "off")
+    server = host if mode == "node" else cfg.get("fastdl_host", "") if mode == "host" else ""
+    names = _instances_on(reg, server) if server else []
+    ip = reg[names[0]].get("ip", "") if names else ""
+    return fastdl.download_url(ip, int(cfg.get("fastdl_port", fastdl.DEFAULT_PORT))) if ip else ""
+
+def _publish_fastdl(reg: Dict[str, Any], hosts: list[str], cfg: dict, priv: str):
+    """Publish bz2 content for `hosts` to their FastDL node(s); failures are only reported."""
+    # pylint: disable=too-many-locals
+    mode = cfg.get("fastdl_mode", "off")
+    if cfg.get("fastdl_url") or mode == "off" or not hosts:
+        return
+    port = int(cfg.get("fastdl_port", fastdl.DEFAULT_PORT))
+    if mode == "host":
+        # The designated node serves every map any server may load
+        all_hosts = sorted({_host_of(n, m) for n, m in reg.items()})
+        targets = {cfg.get("fastdl_host", ""): all_hosts}
+    else:
+        targets = {h: [h] for h in hosts}
+    for target, served in targets.items():
+        names = _instances_on(reg, target)
+        if not names or not reg[names[0]].get("ip"):
+            print(f"FastDL: {target or '(no fastdl_host set)'} is not a known server with an IP; skipping.")
+            continue
+        maps: list[str] = []
+        for h in served:
+            maps += [n for n in _wanted_maps(reg, h) if n not in maps]
+        files = fastdl.collect(FASTDL_CACHE_DIR, MAPS_DIR, maps, SERVER_RESOURCES_DIR / "includes")
+        ok, sent = fastdl.publish(target, reg[names[0]]["ip"], priv, files, port)
+        if ok:
+            print(f"FastDL: {target} serves {len(files)} file(s) ({sent} new) at {fastdl.download_url(reg[names[0]]['ip'], port)}")
+
+def _maps_to_ship(reg: Dict[str, Any], name: str) -> Dict[str, bytes]:
+    files = map_store.bundle_files(MAPS_DIR, _missing_maps(reg, name))
+    shipped = [f for f in files if f.endswith(".bsp")]
+    if shipped:
+        size = sum(len(files[f]) for f in shipped) / (1024 * 1024)
+        print(f"  [{_host_of(name, reg[name])}] shipping {len(shipped)} map(s) from the store ({size:.1f} MB)")
+    return files
+
+def _distribute_content(reg: Dict[str, Any], hosts: list[str], cfg: dict, priv: str) -> Dict[str, str]:
+    """
+    Fan the large content (includes/ + missing store maps) out to `hosts`, one upload per
+    region. Returns {host: payload sha} for the hosts that now hold it; hosts left out
+    (or every host, when fan-out does not apply) get the content in their own bundle.
+    """
+    if cfg.get("distribution", "auto") == "direct" or len(hosts) < 2:
+        return {}
+    groups: Dict[str, list] = {}
+    for h in hosts:
+        m = reg[_instances_on(reg, h)[0]]
+        groups.setdefault(m.get("region", ""), []).append((h, m["ip"]))
+    if all(len(nodes) < 2 for nodes in groups.values()):
+        return {}
+    names: list[str] = []
+    for h in hosts:
+        names += [n for n in _missing_maps(reg, _instances_on(reg, h)[0]) if n not in names]
+    tmp = DIST_DIR / "shared.tgz.part"
+    with tracing.span("distribute.build") as sp:
+        sha = bundle.build_shared(SERVER_RESOURCES_DIR, map_store.bundle_files(MAPS_DIR, names), tmp)
+        payload = DIST_DIR / f"{sha}.tgz"
+        os.replace(tmp, payload)
+        sp["bytes"] = payload.stat().st_size
+    for old in DIST_DIR.glob("*.tgz"):
+        if old != payload:
+            old.unlink()
+    how = distribute.fan_out(groups, sha, payload, priv)
+    return {h: sha for h, way in how.items() if way != "failed"}
+
+def _configure_host(reg: Dict[str, Any], names: list[str], cfg: dict, priv: str,
+                    force: bool = False, shared_sha: Optional[str] = None,
+                    wait_ready: bool = True, image_archive: str = "") -> Tuple[bool, Dict[str, Any]]:
+    """Run one bootstrap on the VM of `names` (instances on it) and record what it reports."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    m = reg[names[0]]
+    host = _host_of(names[0], m)
+    url = _fastdl_url(reg, cfg, host)
+    subs = []
+    for n in names:
+        entry = _server_substitutions(reg[n], url)
+        entry.update(_image_substitutions(cfg, image_archive))
+        if force:
+            entry["FORCE_PHASES"] = "all"
+        subs.append(entry)
+    report: Dict[str, Any] = {}
+    ok = SSHOps.configure_server(
+        host=m["ip"],
+        user="root",
+        private_key=priv,
+        server_resources=SERVER_RESOURCES_DIR,
+        substitutions=subs,
+        logs_dir=LOGS_DIR,
+        log_filename=f"{host if len(names) > 1 else names[0]}-{m['id']}.log",
+        label=host if len(names) > 1 else names[0],
+        stall_timeout=int(cfg.get("setup_stall_timeout", 600)),
+        wait_ready=wait_ready,
+        report=report,
+        extra_files=None if shared_sha else _maps_to_ship(reg, names[0]),
+        shared_sha=shared_sha,
+    )
+    _record_report(reg, names, report)
+    if ok:
+        _pin_image(cfg, report)
+    return ok, report
+
+def _image_seeds(reg: Dict[str, Any], hosts: list[str], cfg: dict) -> list[str]:
+    """First host per region when the image is fanned out ([] when every host pulls)."""
+    if cfg.get("image_distribution", "pull") != "fanout" or len(hosts) < 2:
+        return []
+    seeds: Dict[str, str] = {}
+    for h in hosts:
+        seeds.setdefault(reg[_instances_on(reg, h)[0]].get("region", ""), h)
+    return list(seeds.values())
+
+def _check_start_map(start_map: str) -> bool:
+    """Make sure the start map is in the store (or confirmed stock) before anything is created."""
+    map_store.ensure_default(MAPS_DIR)
+    if map_store.resolve(MAPS_DIR, start_map):
+        return True
+    print(f"\n{start_map} is not in the map store ({MAPS_DIR}).")
+    print("1) Import from a local .bsp file")
+    print("2) Download from a URL")
+    print("3) It is a stock map shipped with TF2")
+    print("4) Cancel")
+    pick = ask("Choose", "1")
+    try:
+        if pick == "1":
+            path = Path(ask("Path to .bsp", f"{start_map}.bsp")).expanduser()
+            map_store.add_file(MAPS_DIR, path, start_map)
+        elif pick == "2":
+            map_store.fetch(MAPS_DIR, ask("URL", ""), start_map)
+        elif pick == "3":
+            return True
+        else:
+            return False
+    except map_store.MapStoreError as exc:
+        print(f"Could not add {start_map}: {exc}")
+        return False
+    print(f"Added {start_map} to the map store.")
+    return True
+
+def _create_step(job: Dict[str, Any], name: str, api, pub: str, reg: Dict[str, Any], resuming: bool) -> str:
+    """
+    requested -> created. Returns "ok", "failed" or "limit".
+    When resuming, an instance that was created but never recorded is adopted instead of duplicated.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    params = jobs.params_for(job, name)
+    server = None
+    if resuming:
+        try:
+            server = api.find_server_by_name(name)
+        except _api_errors() as e:
+            print(f"  -> could not check for an existing instance: {e}")
+            jobs.fail(JOBS_DIR, job, name, str(e))
+            return "failed"
+        if server:
+            print(f"\n{name}: found existing instance id={server.get('id')}; adopting it.")
+    if server is None:
+        print(f"\nCreating server for {name}...")
+        try:
+            with tracing.tags(server=name, region=params["region"], size=params["size"]):
+                server = api.create_server(
+                    name=name,
+                    region=params["region"],
+                    size=params["size"],
+                    ssh_key_id=api.ensure_ssh_key(pub),
+                    public_key=pub,
+                    tags=[DEFAULT_TAG, f"tf2-{name}"]
+                )
+        except _api_errors() as e:
+            print(f"  -> create failed: {e}")
+            jobs.fail(JOBS_DIR, job, name, str(e))
+            msg = (str(e) or "").lower()
+            return "limit" if ("limit" in msg or "quota" in msg) else "failed"
+        print(f"  -> created id={server.get('id')} status={server.get('status', '')}")
+        time.sleep(1.0)
+
+    sid = server.get("id")
+    for index, iname in enumerate(_instance_names(name, int(params.get("instances_per_vm", 1)))):
+        known = reg.get(iname)
+        if not (known and known.get("id") == sid):
+            reg[iname] = _new_server_meta(params, name, iname, index, sid)
+    save_registry(reg)
+    jobs.advance(JOBS_DIR, job, name, "created")
+    return "ok"
+
+def _vm_api(cfg: dict, job: Dict[str, Any], n: str, api):
+    """Client VM `n` of `job` is created with: its own provider's in a split job, else the job's `api`."""
+    provider = jobs.params_for(job, n)["provider"]
+    return api if provider == job["params"]["provider"] else _api_for_provider(cfg, provider)
+
+def _vm_meta(reg: Dict[str, Any], n: str) -> Optional[Dict[str, Any]]:
+    """Registry entry of VM `n`'s first instance; None once it is forgotten (a straggler deleted mid-race)."""
+    with _REGISTRY_LOCK:
+        inames = _instances_on(reg, n)
+        return reg[inames[0]] if inames else None
+
+def _step_ip(job: Dict[str, Any], n: str, api, reg: Dict[str, Any], timeout: int = 900) -> str:
+    """created -> ip for VM `n`; returns its IP ("" while the provider has not assigned one)."""
+    params = jobs.params_for(job, n)
+    m = _vm_meta(reg, n)
+    if m is None:
+        return ""
+    try:
+        with tracing.tags(server=n, region=params["region"], size=params["size"]):
+            info = api.wait_for_active_ip(m["id"], timeout=timeout)
+    except _api_errors() as e:
+        info = {"ip": ""}
+        jobs.fail(JOBS_DIR, job, n, str(e))
+    ip = info.get("ip", "")
+    if ip:
+        with _REGISTRY_LOCK:
+            for iname in _instances_on(reg, n):
+                reg[iname]["ip"] = ip
+            save_registry(reg)
+        jobs.advance(JOBS_DIR, job, n, "ip")
+    return ip
+
+def _step_ssh(job: Dict[str, Any], n: str, reg: Dict[str, Any], priv: str, timeout: int = 900) -> bool:
+    """ip -> ssh_ready for VM `n`."""
+    params = jobs.params_for(job, n)
+    m = _vm_meta(reg, n)
+    with tracing.tags(server=n, region=params["region"], size=params["size"]):
+        if m is None or not SSHOps.wait_ssh_ready(m["ip"], "root", priv, timeout=timeout):
+            return False
+    jobs.advance(JOBS_DIR, job, n, "ssh_ready")
+    return True
+
+def _configure_and_verify(job: Dict[str, Any], n: str, reg: Dict[str, Any], cfg: dict, priv: str, label: str,
+                          shared_sha: Optional[str] = None, archive: str = ""):
+    """ssh_ready -> configured -> ready for VM `n` (one bootstrap for all its instances)."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    params = jobs.params_for(job, n)
+    inames = _instances_on(reg, n)
+    containers = [_inst(reg[i])["container"] for i in inames]
+    ip = reg[inames[0]]["ip"]
+    with tracing.tags(server=n, region=params["region"], size=params["size"]):
+        running = None
+        if not jobs.reached(job, n, "configured"):
+            print(f"{label} {n} ({ip}) configuring...")
+            with tracing.span("configure") as sp:
+                ok, report = _configure_host(reg, inames, cfg, priv, shared_sha=shared_sha,
+                                             wait_ready=False, image_archive=archive)
+                sp["ok"] = ok
+            print(f"  -> {n}: Success." if ok else f"  -> {n}: Failed. See log in .tf2ctl/logs/")
+            if not ok:
+                jobs.fail(JOBS_DIR, job, n, "configure failed")
+                return
+            jobs.advance(JOBS_DIR, job, n, "configured")
+            # The bootstrap result already lists running containers; no extra round trip
+            up = str(report.get("running", "")).split(",")
+            running = all(c in up for c in containers)
+
+        if running is None:
+            with tracing.span("verify"):
+                rc, out, _ = SSHOps.run_command(
+                    ip, "root", priv, "docker inspect -f '{{.State.Running}}' " + " ".join(containers))
+            running = rc == 0 and out.split().count("true") == len(containers)
+        if running:
+            jobs.advance(JOBS_DIR, job, n, "ready")
+        else:
+            jobs.fail(JOBS_DIR, job, n, "container not running after configure")
+            print(f"  -> {n}: not every container is running.")
+
+def _configure_in_stages(job: Dict[str, Any], api, cfg: dict, priv: str, reg: Dict[str, Any], in_flight: list[str]):
+    """Every created VM through each step in turn: IPs, then SSH, then content fan-out and configure."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    # 2) Wait for IPs
+    print("\nWaiting for servers to become active and get IPs...")
+    for n in in_flight:
+        if jobs.reached(job, n, "ip"):
+            continue
+        ip = _step_ip(job, n, _vm_api(cfg, job, n, api), reg)
+        print(f"{n} ({_vm_meta(reg, n)['id']}) -> IP: {ip or 'pending'}")
+
+    # 3) SSH readiness
+    ready_stage = [n for n in in_flight if jobs.reached(job, n, "ip")]
+    for n in ready_stage:
+        if jobs.reached(job, n, "ssh_ready"):
+            continue
+        if not _step_ssh(job, n, reg, priv):
+            jobs.fail(JOBS_DIR, job, n, "SSH not ready")
+            print(f"{n}: SSH not ready—will retry on resume.")
+    ready_stage = [n for n in ready_stage if jobs.reached(job, n, "ssh_ready")]
+
+    # 4) configure (one bootstrap per VM; large content fanned out per region first), 5) verify
+    to_configure = [n for n in ready_stage if not jobs.reached(job, n, "configured")]
+    shared = _distribute_content(reg, to_configure, cfg, priv) if to_configure else {}
+    print("\nConfiguring servers (uploading resources, running setup.sh, copying includes into container)...")
+
+    def configure_and_verify(n: str, archive: str = ""):
+        _configure_and_verify(job, n, reg, cfg, priv, f"[{ready_stage.index(n) + 1}/{len(ready_stage)}]",
+                              shared.get(n), archive)
+
+    # Image fan-out: seeds (one per region) pull and pin first, then relay the image to their peers
+    seeds = _image_seeds(reg, to_configure, cfg)
+    for n in seeds:
+        configure_and_verify(n)
+    archives = _fan_out_image(reg, [n for n in seeds if jobs.reached(job, n, "configured")],
+                              [n for n in to_configure if n not in seeds], cfg, priv)
+    for n in ready_stage:
+        if n not in seeds:
+            configure_and_verify(n, archives.get(n, ""))
+    _publish_fastdl(reg, [n for n in to_configure if jobs.reached(job, n, "configured")], cfg, priv)
+
+def _race_to_ready(job: Dict[str, Any], api, cfg: dict, priv: str, reg: Dict[str, Any], in_flight: list[str],
+                   target: int) -> Tuple[list[str], float]:
+    """
+    Drive every created VM through IP, SSH and configure at once (a thread each) until
+    `target` are ready; returns (the ready ones in finishing order, when the batch filled).
+    The waits block for at most RACE_POLL seconds at a time, so a VM that is still waiting
+    for its IP or SSH when the batch fills stops there; one in the middle of a configure
+    finishes it, and this returns only once it has, so no straggler is still being set up.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    done = threading.Event()
+    lock = threading.Lock()
+    winners = [n for n in in_flight if jobs.state_of(job, n) == jobs.FINAL_STATE]
+    print(f"\nRacing {len(in_flight)} servers; the first {target} to be ready make the batch...")
+
+    def stage(n: str, state: str, step: Callable[[], Any], error: str) -> bool:
+        deadline = time.time() + RACE_STEP_TIMEOUT
+        while not jobs.reached(job, n, state):
+            if done.is_set() or jobs.state_of(job, n) == jobs.DROPPED:
+                return False
+            if time.time() > deadline:
+                jobs.fail(JOBS_DIR, job, n, error)
+                print(f"{n}: {error}—will retry on resume.")
+                return False
+            step()
+        return True
+
+    def pipeline(n: str):
+        if not (stage(n, "ip", lambda: _step_ip(job, n, _vm_api(cfg, job, n, api), reg, timeout=RACE_POLL), "no IP")
+                and stage(n, "ssh_ready", lambda: _step_ssh(job, n, reg, priv, timeout=RACE_POLL), "SSH not ready")):
+            return
+        print(f"{n} ({(_vm_meta(reg, n) or {}).get('ip', '')}) is reachable")
+        if not done.is_set():
+            _configure_and_verify(job, n, reg, cfg, priv, "[race]")
+        if jobs.state_of(job, n) == jobs.FINAL_STATE:
+            with lock:
+                winners.append(n)
+                if len(winners) >= target:
+                    done.set()
+
+    if len(winners) >= target:
+        return winners[:target], time.time()
+    # Daemon threads, so Ctrl-C is not held up by a VM stuck in a wait
+    threads = [threading.Thread(target=pipeline, args=(n,), daemon=True) for n in in_flight if n not in winners]
+    for t in threads:
+        t.start()
+    while not done.wait(1.0):
+        if not any(t.is_alive() for t in threads):
+            break
+    filled = time.time()
+    done.set()
+    busy = [t for t in threads if t.is_alive()]
+    if busy:
+        print(f"Batch complete; waiting for {len(busy)} server(s) to leave IP/SSH waits or finish configuring...")
+    for t in busy:
+        t.join()
+    with lock:
+        return winners[:target], filled
+
+def _settle_stragglers(job: Dict[str, Any], api, cfg: dict, reg: Dict[str, Any], stragglers: list[str],
+                       batch: list[str], batch_seconds: float):
+    """
+    Delete (or keep as idle spares) the VMs that did not make an over-provisioned batch, and
+    record them; one record per provider/region/size when the job was split across providers.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    action = job["params"].get("stragglers", "delete")
+    records: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    for n in batch + stragglers:
+        params = jobs.params_for(job, n)
+        key = (params["provider"], params["region"], params["size"])
+        if key not in records:
+            records[key] = {"time": datetime.now(UTC).isoformat(timespec="seconds").replace("+00:00", "Z"),
+                            "job": job["id"], "provider": key[0], "region": key[1], "size": key[2],
+                            "target": 0, "spare": 0, "batch_seconds": round(batch_seconds, 1), "stragglers": []}
+        records[key]["target" if n in batch else "spare"] += 1
+    for n in stragglers:
+        entry = job["servers"][n]
+        info = {"name": n, "state": entry["state"], "error": entry.get("error", ""), "action": action}
+        if action == "pool":
+            with _REGISTRY_LOCK:
+                for iname in _instances_on(reg, n):
+                    reg[iname]["pool"] = True
+                save_registry(reg)
+            entry["straggler"] = "pooled"
+            jobs.save_job(JOBS_DIR, job)
+            print(f"{n}: straggler (at {info['state']}); kept as an idle spare.")
+        else:
+            try:
+                _vm_api(cfg, job, n, api).delete_server(reg[_instances_on(reg, n)[0]]["id"])
+            except _api_errors() as e:
+                info["action"] = "delete-failed"
+                print(f"{n}: straggler, but deleting it failed: {e}")
+            else:
+                with _REGISTRY_LOCK:
+                    _forget_host(reg, n)
+                entry["straggler"] = "deleted"
+                jobs.drop(JOBS_DIR, job, n, f"straggler (was at {info['state']}); deleted")
+                print(f"{n}: straggler (at {info['state']}); deleted.")
+        params = jobs.params_for(job, n)
+        records[(params["provider"], params["region"], params["size"])]["stragglers"].append(info)
+    STRAGGLERS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with STRAGGLERS_PATH.open("a", encoding="utf-8") as fp:
+        for record in records.values():
+            fp.write(json.dumps(record) + "\n")
+
+def _record_history(job: Dict[str, Any], names: list[str], resuming: bool):
+    """Append how each VM of this run turned out to the provisioning history (see history.py)."""
+    records = []
+    for n in names:
+        entry = job["servers"][n]
+        if entry["state"] == jobs.DROPPED and not entry.get("straggler"):
+            continue  # an account limit says nothing about the region
+        params = jobs.params_for(job, n)
+        outcome = ("straggler" if entry.get("straggler") else
+                   "ready" if entry["state"] == jobs.FINAL_STATE else "failed")
+        seconds = jobs.seconds_between(job, n, "created", "ready") if outcome == "ready" and not resuming else None
+        records.append({"job": job["id"], "provider": params["provider"], "region": params["region"],
+                        "size": params["size"], "outcome": outcome,
+                        "seconds": round(seconds, 1) if seconds is not None else None,
+                        "state": max(entry.get("reached_at", {}), key=jobs.STATES.index, default="requested")})
+    history.append(HISTORY_PATH, records)
+
+def _run_create_job(job: Dict[str, Any], api, cfg: dict, resuming: bool = False) -> Tuple[list, list]:
+    """
+    Drive every unfinished server (VM) in `job` through
+    requested -> created -> ip -> ssh_ready -> configured -> ready,
+    checkpointing after each step. All srcds instances on a VM are configured
+    by one bootstrap. Returns (ready_vm_names, unfinished_vm_names).
+    """
+    # pylint: disable=too-many-branches,too-many-statements,too-many-locals
+    priv, pub = ensure_ssh_key(cfg)
+    params = job["params"]
+    region, size = params["region"], params["size"]
+    names = jobs.pending(job)
+    # A batch that was already cut is not raced again; its pooled spares are now finished
+    # like any other VM and recorded by how that goes
+    settled = any(e.get("straggler") for e in job["servers"].values())
+    revived = [n for n in names if job["servers"][n].get("straggler") == "pooled"]
+    for n in revived:
+        del job["servers"][n]["straggler"]
+    if revived:
+        jobs.save_job(JOBS_DIR, job)
+    reg = load_registry()
+    tracer = tracing.start_run(TRACES_DIR, "resume" if resuming else "create")
+    batch_start = time.time()
+    try:
+        # 1) Create instances (1s delay between calls); an account limit stops creates on that provider only
+        limited = set()
+        for n in names:
+            if jobs.reached(job, n, "created"):
+                continue
+            provider = jobs.params_for(job, n)["provider"]
+            if provider not in limited and _create_step(job, n, _vm_api(cfg, job, n, api), pub, reg,
+                                                        resuming) == "limit":
+                print(f"It looks like you've reached an account limit on {provider}. "
+                      "Creating no more servers there.")
+                limited.add(provider)
+            if provider in limited:
+                jobs.drop(JOBS_DIR, job, n, "account limit reached")
+
+        in_flight = [n for n in names if jobs.reached(job, n, "created")]
+        if not in_flight:
+            print("\nNo servers were created.")
+            _record_history(job, names, resuming)
+            return [], names
+
+        target = int(params.get("target") or 0)
+        if 0 < target < len(in_flight) and not settled:
+            batch, filled = _race_to_ready(job, api, cfg, priv, reg, in_flight, target)
+            if len(batch) >= target:
+                _settle_stragglers(job, api, cfg, reg, [n for n in in_flight if n not in batch], batch,
+                                   filled - batch_start)
+            # After the cut: deleted stragglers are forgotten by now, configured spares kept in the pool are not
+            _publish_fastdl(reg, [n for n in in_flight if _vm_meta(reg, n) and jobs.reached(job, n, "configured")],
+                            cfg, priv)
+        else:
+            _configure_in_stages(job, api, cfg, priv, reg, in_flight)
+    finally:
+        tracing.record("create.batch", batch_start, time.time(), servers=len(names), region=region, size=size)
+        tracing.end_run()
+        print(f"(Timings written to {tracer.path})")
+
+    stragglers = [n for n in names if job["servers"][n].get("straggler")]
+    ready = [n for n in names if jobs.state_of(job, n) == jobs.FINAL_STATE and n not in stragglers]
+    unfinished = [n for n in names if n not in ready and n not in stragglers]
+    _record_history(job, names, resuming)
+    print("\nSummary:")
+    for n in ready:
+        for iname in _instances_on(reg, n):
+            m = reg[iname]
+            print(f"- {iname:16s} id={m['id']} ip={m.get('ip',''):15s} port={_inst(m)['game_port']} "
+                  f"rcon={m['rcon_password']} join={m['sv_password']} stv={m['stv_password']} "
+                  f"[{m.get('provider')}]")
+    if unfinished:
+        print("\nNot finished:")
+        for n in unfinished:
+            entry = job["servers"][n]
+            print(f"- {n:16s} state={entry['state']:10s} {entry.get('error', '')}")
+    if stragglers:
+        print("\nStragglers (not part of the batch):")
+        for n in stragglers:
+            print(f"- {n:16s} {job['servers'][n]['straggler']}")
+    if jobs.pending(job):
+        print(f"Resume job {job['id']} from the main menu to continue.")
+    print(f"\nPer-server configs saved under: {CONFIG_DIR}")
+    return ready, unfinished
+
+def _resume_jobs(cfg: dict):
+    todo = jobs.unfinished_jobs(JOBS_DIR)
+    if not todo:
+        print("No unfinished create jobs.")
+        return
+    print("\nUnfinished create jobs:")
+    for i, job in enumerate(todo, 1):
+        counts: Dict[str, int] = {}
+        for entry in job["servers"].values():
+            counts[entry["state"]] = counts.get(entry["state"], 0) + 1
+        detail = ", ".join(f"{k}={v}" for k, v in sorted(counts.items()))
+        p = job["params"]
+        per_vm = p.get("instances_per_vm", 1)
+        where = f"[{p['provider']}] {p['region']} {p['size']}"
+        if p.get("placement"):
+            where = "split " + " + ".join(sorted({f"[{v['provider']}] {v['region']}" for v in p["placement"].values()}))
+        print(f"{i}) {job['id']}  {where} x{per_vm}/VM  ({detail})")
+    pick = ask("Number to resume, or 'all'", "all")
+    if pick.lower() == "all":
+        chosen = todo
+    else:
+        try:
+            chosen = [todo[int(pick) - 1]]
+        except (ValueError, IndexError):
+            print("Invalid selection.")
+            return
+    for job in chosen:
+        print(f"\n=== Resuming job {job['id']} ===")
+        api = _api_for_provider(cfg, job["params"]["provider"])
+        _run_create_job(job, api, cfg, resuming=True)
+
+
+# ---------------------------
+# Map store
+# ---------------------------
+
+def _fastdl_settings(cfg: dict):
+    print("\nFastDL serves bz2'd maps/assets over HTTP so players download them at full speed.")
+    print("Modes: off | node (nginx on every server) | host (nginx on one designated server)")
+    mode = ask("Mode", cfg.get("fastdl_mode", "off")).strip().lower()
+    if mode not in fastdl.MODES:
+        print("Unknown mode.")
+        return
+    cfg["fastdl_mode"] = mode
+    if mode == "host":
+        cfg["fastdl_host"] = ask("Designated server (VM name)", cfg.get("fastdl_host", ""))
+    if mode != "off":
+        cfg["fastdl_port"] = int(ask("HTTP port", str(cfg.get("fastdl_port", fastdl.DEFAULT_PORT))))
+    cfg["fastdl_url"] = ask("External FastDL URL instead (blank to use the mode above)", cfg.get("fastdl_url", "")).strip()
+    save_config(cfg)
+    print("Saved; applied to servers on their next configure.")
+
+def _map_store_loop(cfg: dict):
+    # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+    map_store.ensure_default(MAPS_DIR)
+    while True:
+        os.system("cls" if os.name == "nt" else "clear")
+        print(f"=== Map store ({MAPS_DIR}) ===")
+        index = map_store.load_index(MAPS_DIR)
+        pool = map_store.load_pool(MAPS_DIR)
+        for name in sorted(index):
+            obj = map_store.object_path(MAPS_DIR, index[name])
+            size = obj.stat().st_size / (1024 * 1024) if obj.exists() else 0.0
+            flag = " (default pool)" if name in pool["default"] else ""
+            print(f"- {name:28s} {index[name][:12]}  {size:6.1f} MB{flag}")
+        print(f"\nDefault pool: {', '.join(pool['default']) or '(empty)'}")
+        for host, names in sorted(pool["hosts"].items()):
+            print(f"Pool for {host}: {', '.join(names) or '(empty)'}")
+        print("\n1) Import a local .bsp")
+        print("2) Download a .bsp from a URL")
+        print("3) Set the default pool")
+        print("4) Set the pool for one server (VM)")
+        print(f"5) FastDL settings (mode: {cfg.get('fastdl_url') or cfg.get('fastdl_mode', 'off')})")
+        print("6) Back")
+        sub = ask("Choose", "6")
+        try:
+            if sub == "1":
+                path = Path(ask("Path to .bsp", "")).expanduser()
+                sha = map_store.add_file(MAPS_DIR, path)
+                print(f"Stored {map_store.map_name(path.name)} as {sha[:12]}")
+            elif sub == "2":
+                url = ask("URL", "")
+                sha = map_store.fetch(MAPS_DIR, url)
+                print(f"Stored {map_store.map_name(url)} as {sha[:12]}")
+            elif sub in ("3", "4"):
+                host = ask("Server (VM) name", "") if sub == "4" else ""
+                current = pool["hosts"].get(host, pool["default"]) if host else pool["default"]
+                raw = ask("Maps (space-separated names; '-' to clear a server's own pool)", " ".join(current))
+                if host and raw.strip() == "-":
+                    pool["hosts"].pop(host, None)
+                else:
+                    names = [map_store.map_name(n) for n in raw.split()]
+                    unknown = [n for n in names if n not in index]
+                    if unknown:
+                        print(f"Not in the store (must be stock maps): {', '.join(unknown)}")
+                    if host:
+                        pool["hosts"][host] = names
+                    else:
+                        pool["default"] = names
+                map_store.save_pool(MAPS_DIR, pool)
+                print("Pool saved; servers receive missing maps on their next configure.")
+            elif sub == "5":
+                _fastdl_settings(cfg)
+            else:
+                return
+        except map_store.MapStoreError as exc:
+            print(f"Failed: {exc}")
+        pause()
+
+def _logs_loop(cfg: dict):
+    while True:
+        os.system("cls" if os.name == "nt" else "clear")
+        print(f"=== Fleet logs ({LOGSTORE_DIR}) ===")
+        print("1) Collect new log lines from all servers")
+        print("2) Search collected logs")
+        print("3) Back")
+        sub = ask("Choose", "2")
+        if sub == "1":
+            reg = load_registry()
+            priv, _ = ensure_ssh_key(cfg)
+            hosts = sorted({_host_of(n, m) for n, m in reg.items()})
+            for host, res in _collect_logs(reg, hosts, build_api(cfg), cfg, priv).items():
+                if "error" in res:
+                    print(f"{host}: {res['error']}")
+                else:
+                    print(f"{host}: {res['lines']} new line(s) from {res['sources']} source(s), "
+                          f"{res['bytes'] / 1024:.0f} KB{' (more next time)' if res['more'] else ''}")
+        elif sub == "2":
+            query = ask("Search for", "")
+            if not query:
+                continue
+            try:
+                since_raw = ask("Only the last (e.g. 30m, 1h, 2d; blank for all)", "1h").strip()
+                since = time.time() - logstore.parse_age(since_raw) if since_raw else None
+                found = logstore.search(LOGSTORE_DIR, query, since, limit=40)
+            except logstore.LogStoreError as exc:
+                print(f"Failed: {exc}")
+                pause()
+                continue
+            if not found["servers"]:
+                print("No matches.")
+            for host, count in found["servers"].items():
+                print(f"{host}: {count} line(s)")
+            for hit in found["matches"]:
+                print(f"  {hit['time']} [{hit['server']} {hit['source']}] {hit['text'][:160]}")
+        else:
+            return
+        pause()
+
 
 # ---------------------------
 # Bulk actions
 # ---------------------------
 
+def _running_pin(meta: Dict[str, Any]) -> Dict[str, str]:
+    """The image a VM last reported running, in tf2_image_pin form ({} if unknown)."""
+    image = meta.get("image") or {}
+    if not image.get("id"):
+        return {}
+    return {"ref": image.get("repo_digest") or image.get("ref", ""), "id": image["id"]}
+
+def _rolling_update(reg: Dict[str, Any], cfg: dict, priv: str, ref: str, wave_size: int,
+                    ready_timeout: int, skip_busy: bool = True) -> Dict[str, Tuple[str, str]]:
+    """Pre-pull `ref` everywhere, then swap VMs to it in waves (see rollout.py). Pins the fleet on success."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    hosts = sorted({_host_of(n, m) for n, m in reg.items() if m.get("ip")})
+    first = {h: reg[_instances_on(reg, h)[0]] for h in hosts}
+    tracing.start_run(TRACES_DIR, "rollout")
+    try:
+        print(f"Pre-pulling {ref} on {len(hosts)} server(s)...")
+        pin, errors = rollout.prepull([(h, first[h]["ip"]) for h in hosts], ref, priv)
+        for h, err in errors.items():
+            print(f"  {h}: pre-pull failed: {err}")
+        if not pin:
+            return {h: (rollout.PULL_FAILED, errors.get(h, "")) for h in hosts}
+        print(f"Target image: {pin['ref']} ({pin['id'][:19]})")
+
+        def swap(host: str, target: Dict[str, str]) -> bool:
+            run_cfg = dict(cfg, tf2_image_pin=target)
+            ok, _ = _configure_host(reg, _instances_on(reg, host), run_cfg, priv)
+            return ok
+
+        targets = [h for h in hosts if h not in errors]
+        endpoints = {h: [(reg[n]["ip"], int(_inst(reg[n])["game_port"])) for n in _instances_on(reg, h)]
+                     for h in targets}
+        old_pins = {h: _running_pin(first[h]) or dict(cfg.get("tf2_image_pin") or {}) for h in targets}
+        status = rollout.roll(targets, endpoints, swap, pin, old_pins, wave_size=wave_size,
+                              ready_timeout=ready_timeout, skip_busy=skip_busy)
+    finally:
+        tracing.end_run()
+    status.update({h: (rollout.PULL_FAILED, err) for h, err in errors.items()})
+
+    if all(st in (rollout.UPDATED, rollout.CURRENT, rollout.SKIPPED) for st, _ in status.values()):
+        cfg["tf2_image_pin"] = {**pin, "pinned_at": datetime.now(UTC).isoformat().replace("+00:00", "Z")}
+        save_config(cfg)
+        print(f"\nFleet pinned to {pin['ref']}; new servers will use it.")
+    skipped = [h for h, (st, _) in status.items() if st == rollout.SKIPPED]
+    if skipped:
+        print(f"Skipped (players online): {', '.join(skipped)}. Run the update again later to pick them up.")
+    return status
+
 def _bulk_loop(reg: Dict[str, Any], api, cfg: dict):
     # pylint: disable=too-many-branches,too-many-statements,too-many-locals,too-many-nested-blocks
     if not reg:
@@ -299,39 +1938,43 @@ def _bulk_loop(reg: Dict[str, Any], api, cfg: dict):
     while True:
         os.system("cls" if os.name == "nt" else "clear")
         print("=== Bulk actions ===")
-        print("1) Restart TF2 container on all servers")
-        print("2) Run a command on all servers")
+        print("1) Restart TF2 container on all instances")
+        print("2) Run a command for all instances ($TF2_CONTAINER is set)")
         print("3) Delete ALL servers (created by this tool)")
         print("4) Show ALL connection strings")
         print("5) Export ALL connection strings to file")
-        print("6) Reapply includes (fast) on all servers")
-        print("7) Back")
+        print("6) Reapply includes (fast) on all instances")
+        print("7) Re-configure all servers (fan-out content distribution)")
+        print("8) Rolling TF2 image update")
+        print("9) Follow logs on all instances (live)")
+        print("10) Watch match events on all instances (live)")
+        print("11) Harvest STV demos from all instances")
+        print("12) Back")
         sub = ask("Choose", "1")
 
         if sub == "1":
             priv, _ = ensure_ssh_key(cfg)
-            for name in sorted(reg.keys()):
-                ip = _ensure_ip_for(reg, name, api)
-                if not ip:
+            results = _agent_instances(reg, sorted(reg.keys()), api, priv, "restart", lambda c: f"docker restart {c}")
+            for name, res in results.items():
+                if res["rc"] is None:
                     print(f"{name}: no IP yet, skipping.")
                     continue
-                rc, _out, err = SSHOps.run_command(ip, "root", priv, "docker restart tf2")
-                print(f"{name}: {'ok' if rc == 0 else 'failed'}")
-                if rc != 0:
-                    print(err)
+                print(f"{name}: {'ok' if res['rc'] == 0 else 'failed'}")
+                if res["rc"] != 0:
+                    print(res["stderr"])
             pause()
 
         elif sub == "2":
             cmd = ask("Command to run", "docker ps")
             priv, _ = ensure_ssh_key(cfg)
-            for name in sorted(reg.keys()):
-                ip = _ensure_ip_for(reg, name, api)
-                if not ip:
+            results = _exec_instances(reg, sorted(reg.keys()), api, priv,
+                                      lambda c: f"export TF2_CONTAINER={c}; {cmd}")
+            for name, res in results.items():
+                if res["rc"] is None:
                     print(f"{name}: no IP yet, skipping.")
                     continue
-                rc, out, err = SSHOps.run_command(ip, "root", priv, cmd)
-                print(f"\n=== {name} ({ip}) exit {rc} ===")
-                print(out if out else err)
+                print(f"\n=== {name} ({res['ip']}, {res['container']}) exit {res['rc']} ===")
+                print(res["stdout"] if res["stdout"] else res["stderr"])
             pause()
 
         elif sub == "3":
@@ -340,22 +1983,15 @@ def _bulk_loop(reg: Dict[str, Any], api, cfg: dict):
                 print("Cancelled.")
                 pause()
                 continue
-            names = list(reg.keys())
-            for name in names:
-                meta = reg[name]
+            hosts = sorted({_host_of(n, m) for n, m in reg.items()})
+            for host in hosts:
+                inames = _instances_on(reg, host)
                 try:
-                    api.delete_server(meta["id"])
-                    print(f"Deleted {name}")
-                except (DOAPIError, LinodeAPIError, VultrAPIError) as exc:
-                    print(f"Failed to delete {name}: {exc}")
-                reg.pop(name, None)
-                meta_path = CONFIG_DIR / f"{meta.get('id','')}.json"
-                if meta_path.exists():
-                    try:
-                        meta_path.unlink()
-                    except (OSError, PermissionError, FileNotFoundError) as exc:
-                        print(f"Failed to delete config for {name}: {exc}")
-            save_registry(reg)
+                    api.for_server(reg[inames[0]]).delete_server(reg[inames[0]]["id"])
+                    print(f"Deleted {host} ({len(inames)} instance(s))")
+                except _api_errors() as exc:
+                    print(f"Failed to delete {host}: {exc}")
+                _forget_host(reg, host)
             pause()
 
         elif sub == "4":
@@ -365,7 +2001,7 @@ def _bulk_loop(reg: Dict[str, Any], api, cfg: dict):
                 if not ip:
                     print(f"{name}: no IP.")
                     continue
-                g, s, r = _build_conn_strings(ip, GAME_PORT, STV_PORT, m.get("sv_password",""), m.get("rcon_password",""))
+                g, s, r = _conn_strings_for(ip, m)
                 print(f"\n{name}")
                 print(f"  GAME: {g}")
                 print(f"  STV : {s}")
@@ -380,7 +2016,7 @@ def _bulk_loop(reg: Dict[str, Any], api, cfg: dict):
                 ip = _ensure_ip_for(reg, name, api)
                 if not ip:
                     continue
-                g, s, r = _build_conn_strings(ip, GAME_PORT, STV_PORT, m.get("sv_password",""), m.get("rcon_password",""))
+                g, s, r = _conn_strings_for(ip, m)
                 lines.append(f"[{name}]")
                 lines.append(f"GAME: {g}")
                 lines.append(f"STV : {s}")
@@ -392,18 +2028,83 @@ def _bulk_loop(reg: Dict[str, Any], api, cfg: dict):
 
         elif sub == "6":
             priv, _ = ensure_ssh_key(cfg)
-            for name in sorted(reg.keys()):
-                ip = _ensure_ip_for(reg, name, api)
-                if not ip:
+            results = _agent_instances(reg, sorted(reg.keys()), api, priv, "apply_includes",
+                                       lambda c: f"bash /root/tf2-copy.sh {c}")
+            for name, res in results.items():
+                if res["rc"] is None:
                     print(f"{name}: no IP yet, skipping.")
                     continue
-                rc, out, err = SSHOps.run_command(ip, "root", priv, "bash /root/tf2-copy.sh")
-                print(f"{name}: {'applied' if rc == 0 else 'failed'}")
-                if rc != 0:
-                    print(err)
+                print(f"{name}: {'applied' if res['rc'] == 0 else 'failed'}")
+                if res["rc"] != 0:
+                    print(res["stderr"])
             pause()
 
         elif sub == "7":
+            if not SERVER_RESOURCES_DIR.exists():
+                print(f"Expected server_resources at: {SERVER_RESOURCES_DIR}")
+                pause()
+                continue
+            priv, _ = ensure_ssh_key(cfg)
+            force = ask("Force all setup phases to re-run? (y/n)", "n").lower().startswith("y")
+            if ask("Re-pin the TF2 image to the newest upstream build? (y/n)", "n").lower().startswith("y"):
+                cfg["tf2_image_pin"] = {}
+                save_config(cfg)
+            hosts = sorted({_host_of(n, m) for n, m in reg.items() if m.get("ip")})
+            tracing.start_run(TRACES_DIR, "reconfigure")
+            try:
+                shared = _distribute_content(reg, hosts, cfg, priv)
+                # Image fan-out: seeds pull (and pin) first, peers then load the relayed archive
+                seeds = _image_seeds(reg, hosts, cfg)
+                peers = [h for h in hosts if h not in seeds]
+                archives: Dict[str, str] = {}
+                for host in seeds + peers:
+                    if seeds and host == (peers or [None])[0]:
+                        archives = _fan_out_image(reg, seeds, peers, cfg, priv)
+                    inames = _instances_on(reg, host)
+                    with tracing.tags(server=host), tracing.span("configure") as sp:
+                        ok, _ = _configure_host(reg, inames, cfg, priv, force=force, shared_sha=shared.get(host),
+                                                image_archive=archives.get(host, ""))
+                        sp["ok"] = ok
+                    print(f"{host}: {'ok' if ok else 'failed (see .tf2ctl/logs/)'}")
+                _publish_fastdl(reg, hosts, cfg, priv)
+            finally:
+                tracing.end_run()
+            pause()
+
+        elif sub == "8":
+            priv, _ = ensure_ssh_key(cfg)
+            ref = ask("Image to roll out", cfg.get("tf2_image", DEFAULT_TF2_IMAGE))
+            try:
+                wave_size = int(ask("Servers (VMs) per wave", str(cfg.get("rollout_wave_size", 1))))
+                ready_timeout = int(ask("Seconds to wait for each server to answer A2S",
+                                        str(cfg.get("rollout_ready_timeout", 300))))
+            except ValueError:
+                print("Not a number.")
+                pause()
+                continue
+            skip_busy = not ask("Update servers with players online too? (y/n)", "n").lower().startswith("y")
+            _rolling_update(reg, cfg, priv, ref, wave_size, ready_timeout, skip_busy)
+            pause()
+
+        elif sub == "9":
+            priv, _ = ensure_ssh_key(cfg)
+            pattern = ask("Only lines matching (regex, blank for all)", "")
+            _follow_logs(reg, sorted(reg.keys()), api, priv, pattern, ignore_case=True, tail=0)
+            pause()
+
+        elif sub == "10":
+            priv, _ = ensure_ssh_key(cfg)
+            kinds = matchlog.EVENTS if ask("Show every kill too? (y/n)", "n").lower().startswith("y") \
+                else matchlog.DEFAULT_EVENTS
+            _watch_matches(reg, sorted(reg.keys()), api, priv, kinds)
+            pause()
+
+        elif sub == "11":
+            priv, _ = ensure_ssh_key(cfg)
+            _print_harvest(_harvest_demos(reg, sorted(reg.keys()), api, cfg, priv))
+            pause()
+
+        elif sub == "12":
             break
         else:
             pause()
@@ -428,7 +2129,11 @@ def menu():
         print("3) Manage a server")
         print("4) List your servers")
         print("5) Bulk actions")
-        print("6) Quit")
+        print("6) Resume unfinished create jobs")
+        print("7) Provisioning timings (p50/p95 per phase)")
+        print("8) Map store / FastDL")
+        print("9) Fleet logs (collect / search)")
+        print("10) Quit")
         choice = ask("Choose", "4")
 
         if choice == "1":
@@ -439,7 +2144,7 @@ def menu():
             try:
                 key_id = api.ensure_ssh_key(pub)
                 print(f"SSH key registered with {SUPPORTED_PROVIDERS.get(prov)} (id: {key_id}).")
-            except (DOAPIError, LinodeAPIError, VultrAPIError) as e:
+            except _api_errors() as e:
                 print(f"(warning) could not register SSH key with provider: {e}")
             print(f"Config stored at: {CONFIG_PATH}")
             print(f"server_resources path: {SERVER_RESOURCES_DIR}")
@@ -448,7 +2153,7 @@ def menu():
         elif choice == "2":
             # Create MANY and auto-configure
             api = build_api(cfg)  # ensure token/provider are current
-            priv, pub = ensure_ssh_key(cfg)
+            ensure_ssh_key(cfg)
 
             if not SERVER_RESOURCES_DIR.exists():
                 print(f"Expected server_resources at: {SERVER_RESOURCES_DIR}")
@@ -458,11 +2163,25 @@ def menu():
 
             prefix = ask("Name prefix", "tf2")
             start_num = int(ask("Start number", "1"))
-            count_req = int(ask("How many servers to create?", "1"))
+            count_req = int(ask("How many servers (VMs) to create?", "1"))
+            per_vm = max(1, int(ask("TF2 instances per server (srcds containers per VM)", "1")))
+            print("Tuning 'performance': CPU governor, UDP buffers, apt deferred while live, per-instance CPU pinning.")
+            tuning_profile = _ask_tuning_profile(cfg.get("tuning_profile", "off"))
 
-            region = pick_region(api)
             size   = pick_size(api)
-            start_map = ask("Start map for all servers", "cp_badlands")
+            size_name = next((k for k, v in api.recommended_sizes().items() if v == size), size)
+            region = pick_region(api, cfg.get("provider", "digitalocean"), size)
+            regions = {cfg.get("provider", "digitalocean"): region}
+            others = ask("Also split the batch across other providers? (comma-separated, blank for no)", "")
+            for other in (o.strip() for o in others.split(",")):
+                if other in SUPPORTED_PROVIDERS and other not in regions:
+                    other_api = _api_for_provider(cfg, other)
+                    print(f"\nRegion on {SUPPORTED_PROVIDERS[other]}:")
+                    regions[other] = pick_region(other_api, other, other_api.recommended_sizes().get(size_name, size_name))
+            start_map = map_store.map_name(ask("Start map for all servers", map_store.DEFAULT_MAP))
+            if not _check_start_map(start_map):
+                pause()
+                continue
 
             # Ask for API keys for demos.tf and logs.tf
             print("\n--- Optional API Keys for Competitive Features ---")
@@ -471,11 +2190,13 @@ def menu():
             logs_tf_apikey = ask("logs.tf API key (optional)", "")
 
             # ---------- Provider capacity (may be None if provider doesn't expose it) ----------
+            # (a split batch is capped per provider by _split_placement below)
             remaining = None
-            try:
-                remaining = api.capacity_remaining()
-            except (DOAPIError, LinodeAPIError, VultrAPIError):
-                remaining = None
+            if len(regions) == 1:
+                try:
+                    remaining = api.capacity_remaining()
+                except _api_errors():
+                    remaining = None
 
             if remaining is not None and count_req > remaining:
                 if remaining <= 0:
@@ -493,129 +2214,58 @@ def menu():
             else:
                 count = count_req
 
-            names = _name_series(prefix, start_num, count)
+            spare = max(0, int(ask("Spare servers to race (the first to be ready are kept)",
+                                   str(cfg.get("create_spare", 0)))))
+            if remaining is not None:
+                spare = min(spare, remaining - count)
+            stragglers = cfg.get("straggler_action", "delete")
+            if spare:
+                stragglers = ask(f"Stragglers: {' or '.join(STRAGGLER_ACTIONS)} (keep as idle spares)", stragglers)
+                if stragglers not in STRAGGLER_ACTIONS:
+                    stragglers = "delete"
+
+            names = _name_series(prefix, start_num, count + spare)
+            placed: Dict[str, Dict[str, Any]] = {}
+            if len(regions) > 1:
+                plan = _split_placement(cfg, regions, size_name, len(names))
+                if len(plan) < len(names):
+                    print(f"\nThese accounts can create only {len(plan)} more servers right now.")
+                    count, spare = min(count, len(plan)), max(0, len(plan) - count)
+                    names = names[:len(plan)]
+                placed = dict(zip(names, plan))
+                if not placed:
+                    pause()
+                    continue
 
+            if spare:
+                print(f"\nThe first {count} of these to be ready make the batch; the other {spare} are "
+                      f"{'deleted' if stragglers == 'delete' else 'kept as idle spares'}.")
             print("\nWill create:")
             for n in names:
-                print(f"  - {n} ({region}, {size})")
+                where = placed.get(n, {"provider": cfg.get("provider", "digitalocean"), "region": region, "size": size})
+                print(f"  - {n} ({where['region']}, {where['size']}{', ' + where['provider'] if placed else ''})")
+                if per_vm > 1:
+                    for index, iname in enumerate(_instance_names(n, per_vm)):
+                        print(f"      {iname}: {_container_name(index)} game port {_instance_ports(index)['game_port']}")
             if ask("Type 'yes' to confirm", "yes").lower() != "yes":
                 pause()
                 continue
 
-            reg = load_registry()
-            created = []
-            failed = []
-
-            # 1) Create instances (1s delay between calls)
-            for n in names:
-                print(f"\nCreating server for {n}...")
-                try:
-                    server = api.create_server(
-                        name=n,
-                        region=region,
-                        size=size,
-                        ssh_key_id=api.ensure_ssh_key(pub),
-                        public_key=pub,
-                        tags=[DEFAULT_TAG, f"tf2-{n}"]
-                    )
-                except (DOAPIError, LinodeAPIError, VultrAPIError) as e:
-                    print(f"  -> create failed: {e}")
-                    # If message indicates limit/quota, stop bulk creation
-                    msg = (str(e) or "").lower()
-                    if "limit" in msg or "quota" in msg:
-                        print("It looks like you've reached an account limit. Stopping bulk create.")
-                        break
-                    failed.append(n)
-                    continue
-
-                sid = server.get("id")
-                status = server.get("status", "")
-                print(f"  -> created id={sid} status={status}")
-                meta = {
-                    "provider": cfg.get("provider", "digitalocean"),
-                    "id": sid,
-                    "ip": "",
-                    "region": region,
-                    "size": size,
-                    "created_at": datetime.now(UTC).isoformat().replace("+00:00", "Z"),
-                    "hostname": n,
-                    "rcon_password": SSHOps.random_password(16),
-                    "sv_password": SSHOps.random_password(12),
-                    "stv_password": "stv",
-                    "start_map": start_map,
-                    "demos_tf_apikey": demos_tf_apikey,
-                    "logs_tf_apikey": logs_tf_apikey
-                }
-                reg[n] = meta
-                (CONFIG_DIR / f"{sid}.json").write_text(json.dumps({
-                    "hostname": meta["hostname"],
-                    "rcon_password": meta["rcon_password"],
-                    "sv_password": meta["sv_password"],
-                    "stv_password": meta["stv_password"],
-                    "start_map": meta["start_map"],
-                    "demos_tf_apikey": meta["demos_tf_apikey"],
-                    "logs_tf_apikey": meta["logs_tf_apikey"]
-                }, indent=2))
-                save_registry(reg)
-                created.append(n)
-
-                time.sleep(1.0)
-
-            if not created:
-                print("\nNo servers were created.")
-                pause()
-                continue
-
-            # 2) Wait for IPs
-            print("\nWaiting for servers to become active and get IPs...")
-            for n in created:
-                m = reg[n]
-                info = api.wait_for_active_ip(m["id"])
-                ip = info.get("ip", "")
-                m["ip"] = ip
-                reg[n] = m
-                save_registry(reg)
-                print(f"{n} ({m['id']}) -> IP: {ip or 'pending'}")
-
-            # 3) Configure each (upload resources, run setup.sh, copy into container)
-            print("\nConfiguring servers (uploading resources, running setup.sh, copying includes into container)...")
-            for idx, n in enumerate(created, 1):
-                m = reg[n]
-                ip = m.get("ip")
-                if not ip:
-                    print(f"[{idx}/{len(created)}] {n}: No IP yet—skipping.")
-                    continue
-                print(f"[{idx}/{len(created)}] {n} ({ip}) configuring...")
-                ok = SSHOps.configure_server(
-                    host=ip,
-                    user="root",
-                    private_key=cfg["ssh_private_key"],
-                    server_resources=SERVER_RESOURCES_DIR,
-                    substitutions={
-                        "SERVER_HOSTNAME": m["hostname"],
-                        "RCON_PASSWORD": m["rcon_password"],
-                        "SERVER_PASSWORD": m["sv_password"],
-                        "START_MAP": m["start_map"],
-                        "STV_PASSWORD": m["stv_password"],
-                        "DEMOS_TF_APIKEY": m["demos_tf_apikey"],
-                        "LOGS_TF_APIKEY": m["logs_tf_apikey"],
-                    },
-                    logs_dir=LOGS_DIR,
-                    log_filename=f"{n}-{m['id']}.log"
-                )
-                print("  -> Success." if ok else "  -> Failed. See log in .tf2ctl/logs/")
-
-            print("\nSummary:")
-            for n in created:
-                m = reg[n]
-                print(f"- {n:16s} id={m['id']} ip={m.get('ip',''):15s} "
-                      f"rcon={m['rcon_password']} join={m['sv_password']} stv={m['stv_password']} "
-                      f"[{m.get('provider')}]")
-            if failed:
-                print("\nFailed to create:")
-                for n in failed:
-                    print(f"- {n}")
-            print(f"\nPer-server configs saved under: {CONFIG_DIR}")
+            job = jobs.new_job(JOBS_DIR, names, {
+                "provider": cfg.get("provider", "digitalocean"),
+                "region": region,
+                "size": size,
+                "start_map": start_map,
+                "demos_tf_apikey": demos_tf_apikey,
+                "logs_tf_apikey": logs_tf_apikey,
+                "instances_per_vm": per_vm,
+                "tuning_profile": tuning_profile,
+                "target": count if spare else 0,
+                "stragglers": stragglers,
+                **({"placement": placed} if placed else {}),
+            })
+            print(f"(Job {job['id']} saved; use 'Resume unfinished create jobs' if this run is interrupted)")
+            _run_create_job(job, api, cfg)
             pause()
 
         elif choice == "3":
@@ -635,7 +2285,15 @@ def menu():
             while True:
                 os.system("cls" if os.name == "nt" else "clear")
                 print(f"=== Manage: {name} ===")
+                inst = _inst(m)
                 print(f"ID: {m.get('id')}  IP: {ip}  Region: {m.get('region')}  Size: {m.get('size')}  Provider: {m.get('provider')}")
+                print(f"Host: {_host_of(name, m)}  Container: {inst['container']}  "
+                      f"Ports: game {inst['game_port']} / stv {inst['stv_port']} / client {inst['client_port']}")
+                applied = m.get("tuning") or {}
+                print(f"Tuning: {m.get('tuning_profile', 'off')}"
+                      + (f"  (applied {applied.get('applied_at', '?')}: cpuset {applied.get('cpuset')}, "
+                         f"governor {applied.get('governor')}, nice {applied.get('nice')})"
+                         if applied.get("profile") == "performance" else ""))
                 print("1) Show TF2 container logs")
                 print("2) Restart TF2 container")
                 print("3) Run a command (SSH)")
@@ -643,20 +2301,24 @@ def menu():
                 print("5) Open SSH session")
                 print("6) Show connection strings")
                 print("7) Reapply includes (fast)")
-                print("8) Delete this server")
+                print("8) Delete this server (VM and all its instances)")
                 print("9) Back")
                 sub = ask("Choose", "1")
 
                 if sub == "1":
                     priv, _ = ensure_ssh_key(cfg)
-                    print("\nLatest TF2 container logs (last 200 lines):\n")
-                    print(SSHOps.get_container_logs(host=ip, user="root", private_key=priv, container="tf2", tail=200))
+                    if ask("Follow live? (y/n)", "n").lower().startswith("y"):
+                        pattern = ask("Only lines matching (regex, blank for all)", "")
+                        _follow_logs(reg, [name], api, priv, pattern, ignore_case=True)
+                    else:
+                        print("\nLatest TF2 container logs (last 200 lines):\n")
+                        print(_container_logs(m, ip, priv, tail=200))
                     pause()
 
                 elif sub == "2":
                     priv, _ = ensure_ssh_key(cfg)
-                    rc, out, err = SSHOps.run_command(ip, "root", priv, "docker restart tf2")
-                    print(out or err or f"(exit {rc})")
+                    res = _agent_instances(reg, [name], api, priv, "restart", lambda c: f"docker restart {c}")[name]
+                    print(res["stdout"] or res["stderr"] or f"(exit {res['rc']})")
                     pause()
 
                 elif sub == "3":
@@ -674,23 +2336,24 @@ def menu():
                         pause()
                         continue
                     priv, _ = ensure_ssh_key(cfg)
-                    ok = SSHOps.configure_server(
-                        host=ip,
-                        user="root",
-                        private_key=priv,
-                        server_resources=SERVER_RESOURCES_DIR,
-                        substitutions={
-                            "SERVER_HOSTNAME": m["hostname"],
-                            "RCON_PASSWORD": m["rcon_password"],
-                            "SERVER_PASSWORD": m["sv_password"],
-                            "START_MAP": m["start_map"],
-                            "STV_PASSWORD": m["stv_password"],
-                            "DEMOS_TF_APIKEY": m.get("demos_tf_apikey", ""),
-                            "LOGS_TF_APIKEY": m.get("logs_tf_apikey", ""),
-                        },
-                        logs_dir=LOGS_DIR,
-                        log_filename=f"{name}-{m['id']}.log"
-                    )
+                    targets = [name]
+                    profile = _ask_tuning_profile(m.get("tuning_profile", "off"))
+                    if profile != m.get("tuning_profile", "off"):
+                        # Host-wide setting: every instance on the VM is re-configured with it
+                        targets = _instances_on(reg, _host_of(name, m))
+                        for t in targets:
+                            reg[t]["tuning_profile"] = profile
+                        save_registry(reg)
+                    force = ask("Force all setup phases to re-run? (y/n)", "n").lower().startswith("y")
+                    tracing.start_run(TRACES_DIR, "reconfigure")
+                    try:
+                        with tracing.tags(server=name, region=m.get("region"), size=m.get("size")), \
+                                tracing.span("configure") as sp:
+                            ok, _ = _configure_host(reg, targets, cfg, priv, force=force)
+                            sp["ok"] = ok
+                            _publish_fastdl(reg, [_host_of(name, m)], cfg, priv)
+                    finally:
+                        tracing.end_run()
                     print("Success." if ok else "Failed. See log in .tf2ctl/logs/")
                     pause()
 
@@ -700,7 +2363,7 @@ def menu():
                     SSHOps.open_ssh_session(host=ip, user="root", private_key_path=key_path)
 
                 elif sub == "6":
-                    g, s, r = _build_conn_strings(ip, GAME_PORT, STV_PORT, m.get("sv_password",""), m.get("rcon_password",""))
+                    g, s, r = _conn_strings_for(ip, m)
                     print("\nConnection strings:")
                     print("GAME:", g)
                     print("STV :", s)
@@ -709,21 +2372,19 @@ def menu():
 
                 elif sub == "7":
                     priv, _ = ensure_ssh_key(cfg)
-                    rc, out, err = SSHOps.run_command(ip, "root", priv, "bash /root/tf2-copy.sh")
-                    print(out if out else err or "(reapplied includes)")
+                    res = _agent_instances(reg, [name], api, priv, "apply_includes",
+                                           lambda c: f"bash /root/tf2-copy.sh {c}")[name]
+                    print(res["stdout"] or res["stderr"] or "(reapplied includes)")
                     pause()
 
                 elif sub == "8":
-                    if ask(f"Type 'yes' to delete {name}", "no").lower() == "yes":
-                        api.delete_server(m["id"])
-                        reg.pop(name, None)
-                        save_registry(reg)
-                        meta_path = CONFIG_DIR / f"{m['id']}.json"
-                        if meta_path.exists():
-                            try:
-                                meta_path.unlink()
-                            except (OSError, PermissionError, FileNotFoundError):
-                                pass
+                    host = _host_of(name, m)
+                    siblings = _instances_on(reg, host)
+                    if len(siblings) > 1:
+                        print(f"{name} runs on {host}; deleting the VM also removes: {', '.join(siblings)}")
+                    if ask(f"Type 'yes' to delete {host}", "no").lower() == "yes":
+                        api.for_server(m).delete_server(m["id"])
+                        _forget_host(reg, host)
                         print("Deleted.")
                         pause()
                         break
@@ -747,13 +2408,600 @@ def menu():
             _bulk_loop(load_registry(), build_api(cfg), cfg)
 
         elif choice == "6":
+            _resume_jobs(cfg)
+            pause()
+
+        elif choice == "7":
+            _print_trace_summary()
+            _print_history_stats()
+            _print_straggler_stats()
+            pause()
+
+        elif choice == "8":
+            _map_store_loop(cfg)
+
+        elif choice == "9":
+            _logs_loop(cfg)
+
+        elif choice == "10":
             print("Bye!")
             return
 
         else:
             pause()
 
+# ---------------------------
+# Headless CLI (python cli.py <command> ...)
+# ---------------------------
+# Each command takes flags instead of prompts, prints progress to stderr and one JSON
+# document to stdout, and exits with one of the EXIT_* codes.
+
+def _select_instances(reg: Dict[str, Any], selectors: Optional[list[str]]) -> list[str]:
+    """Instance names matching --server (instance or VM names); every instance when none are given."""
+    if not selectors:
+        return sorted(reg.keys())
+    out: list[str] = []
+    for sel in selectors:
+        matched = [sel] if sel in reg else _instances_on(reg, sel)
+        if not matched:
+            raise HeadlessError(EXIT_USAGE, f"unknown server {sel!r}")
+        out += [n for n in matched if n not in out]
+    return out
+
+def _exec_result(results: Dict[str, Dict[str, Any]]) -> Tuple[Dict[str, Any], int]:
+    failed = [n for n, r in results.items() if r["rc"] != 0]
+    return {"results": results, "failed": failed}, EXIT_FAILED if failed else EXIT_OK
+
+def _cmd_list(args, cfg: dict) -> Tuple[Any, int]:
+    # pylint: disable=unused-argument
+    reg = load_registry()
+    return {"servers": [_instance_record(n, reg[n]) for n in _select_instances(reg, args.server)]}, EXIT_OK
+
+def _cmd_conn_strings(args, cfg: dict) -> Tuple[Any, int]:
+    reg = load_registry()
+    api = build_api(cfg)
+    out = []
+    for name in _select_instances(reg, args.server):
+        ip = _ensure_ip_for(reg, name, api)
+        game, stv, rcon = _conn_strings_for(ip, reg[name]) if ip else ("", "", "")
+        out.append({"name": name, "ip": ip or "", "game": game, "stv": stv, "rcon": rcon})
+    return {"servers": out}, EXIT_OK if all(e["ip"] for e in out) else EXIT_FAILED
+
+def _cmd_exec(args, cfg: dict) -> Tuple[Any, int]:
+    reg = load_registry()
+    priv, _ = ensure_ssh_key(cfg)
+    results = _exec_instances(reg, _select_instances(reg, args.server), build_api(cfg), priv,
+                              lambda c: f"export TF2_CONTAINER={c}; {args.command}")
+    return _exec_result(results)
+
+def _cmd_restart(args, cfg: dict) -> Tuple[Any, int]:
+    reg = load_registry()
+    priv, _ = ensure_ssh_key(cfg)
+    results = _agent_instances(reg, _select_instances(reg, args.server), build_api(cfg), priv, "restart",
+                               lambda c: f"docker restart {c}")
+    return _exec_result(results)
+
+def _cmd_reapply(args, cfg: dict) -> Tuple[Any, int]:
+    reg = load_registry()
+    priv, _ = ensure_ssh_key(cfg)
+    results = _agent_instances(reg, _select_instances(reg, args.server), build_api(cfg), priv, "apply_includes",
+                               lambda c: f"bash /root/tf2-copy.sh {c}")
+    return _exec_result(results)
+
+def _cmd_logs(args, cfg: dict) -> Tuple[Any, int]:
+    reg = load_registry()
+    priv, _ = ensure_ssh_key(cfg)
+    api = build_api(cfg)
+    names = _select_instances(reg, args.server)
+    if args.follow:
+        # Lines stream to stderr as they arrive; stdout gets the per-instance summary
+        stats = _follow_logs(reg, names, api, priv, args.grep, args.ignore_case, args.tail, args.duration)
+        failed = [n for n in names if n not in stats or stats[n]["error"]]
+        return {"followed": stats, "failed": failed}, EXIT_FAILED if failed else EXIT_OK
+    try:
+        keep = re.compile(args.grep, re.IGNORECASE if args.ignore_case else 0) if args.grep else None
+    except re.error as exc:
+        raise HeadlessError(EXIT_USAGE, f"bad --grep pattern: {exc}") from exc
+    out: Dict[str, str] = {}
+    ok = True
+    for name in names:
+        ip = _ensure_ip_for(reg, name, api)
+        text = _container_logs(reg[name], ip, priv, args.tail) if ip else ""
+        ok = ok and bool(text)
+        if keep:
+            text = "".join(line for line in text.splitlines(keepends=True) if keep.search(line))
+        out[name] = text
+    return {"logs": out}, EXIT_OK if ok else EXIT_FAILED
+
+def _cmd_match_events(args, cfg: dict) -> Tuple[Any, int]:
+    if args.events == "all":
+        kinds = list(matchlog.EVENTS)
+    else:
+        kinds = [k.strip() for k in args.events.split(",") if k.strip()] if args.events else \
+            list(matchlog.DEFAULT_EVENTS)
+    unknown = sorted(set(kinds + ([args.until] if args.until else [])) - set(matchlog.EVENTS))
+    if unknown:
+        raise HeadlessError(EXIT_USAGE, f"unknown event(s) {', '.join(unknown)}; "
+                                        f"choose from {', '.join(matchlog.EVENTS)}")
+    reg = load_registry()
+    priv, _ = ensure_ssh_key(cfg)
+    names = _select_instances(reg, args.server)
+    # Events stream to stderr as JSON lines; stdout gets each instance's state at the end
+    states, stats = _watch_matches(reg, names, build_api(cfg), priv, kinds, args.until, args.duration, as_json=True)
+    failed = [n for n in names if n not in stats or stats[n]["error"]]
+    result: Dict[str, Any] = {"servers": states, "failed": failed}
+    if args.until:
+        # The caller is waiting on `until`; instances that never got there make this a failure
+        result["pending"] = [n for n in names if n not in failed and not stats[n]["reached"]]
+        failed = failed + result["pending"]
+    return result, EXIT_FAILED if failed else EXIT_OK
+
+def _cmd_harvest_demos(args, cfg: dict) -> Tuple[Any, int]:
+    if (args.parallel is not None and args.parallel < 1) or (args.limit_mbps is not None and args.limit_mbps < 0):
+        raise HeadlessError(EXIT_USAGE, "--parallel must be at least 1 and --limit-mbps not negative")
+    reg = load_registry()
+    priv, _ = ensure_ssh_key(cfg)
+    out = _harvest_demos(reg, _select_instances(reg, args.server), build_api(cfg), cfg, priv, args.parallel,
+                         args.limit_mbps)
+    failed = [n for n, r in out.items() if r["errors"]]
+    return {"servers": out, "dir": str(DEMOS_DIR), "failed": failed}, EXIT_FAILED if failed else EXIT_OK
+
+def _cmd_watchdog(args, cfg: dict) -> Tuple[Any, int]:
+    if args.status:
+        return {"servers": watchdog.summary(watchdog.load_state(WATCHDOG_DIR)),
+                "events": watchdog.recent_events(WATCHDOG_DIR, args.events)}, EXIT_OK
+    priv, _ = ensure_ssh_key(cfg)
+    dog = _make_watchdog(cfg, priv, args.dry_run)
+    interval = args.interval or float(cfg.get("watchdog_interval", watchdog.DEFAULT_INTERVAL))
+    if not args.once:
+        print(f"Watchdog probing every {interval:g}s{' (dry run)' if args.dry_run else ''}; Ctrl-C to stop.")
+    SSHOps.enable_pool()
+    try:
+        dog.run(interval, rounds=1 if args.once else None)
+    finally:
+        SSHOps.close_pool()
+    states = watchdog.summary(dog.states)
+    bad = [n for n, st in states.items() if st["health"] not in ("healthy", "unknown")]
+    return {"servers": states, "unhealthy": bad}, EXIT_FAILED if bad else EXIT_OK
+
+def _cmd_scale(args, cfg: dict) -> Tuple[Any, int]:
+    if args.status:
+        return {**scaler.summary(scaler.load_state(SCALER_DIR)),
+                "decisions": scaler.recent_decisions(SCALER_DIR, args.events)}, EXIT_OK
+    try:
+        scl = _make_scaler(cfg, args.dry_run)
+    except scaler.ScheduleError as exc:
+        raise HeadlessError(EXIT_CONFIG, f"scaler config: {exc}") from exc
+    if not args.dry_run and not SERVER_RESOURCES_DIR.exists():
+        raise HeadlessError(EXIT_CONFIG, f"expected server_resources at {SERVER_RESOURCES_DIR}")
+    ensure_ssh_key(cfg)
+    interval = args.interval or float(cfg.get("scaler_interval", scaler.DEFAULT_INTERVAL))
+    if not args.once:
+        print(f"Scaler checking every {interval:g}s{' (dry run)' if args.dry_run else ''}; Ctrl-C to stop.")
+    SSHOps.enable_pool()
+    try:
+        scl.run(interval, rounds=1 if args.once else None)
+    finally:
+        SSHOps.close_pool()
+    out = scaler.summary(scl.state)
+    # A region waiting out a failed provision is short of its target
+    return out, EXIT_FAILED if out["retry_after"] else EXIT_OK
+
+def _cmd_history(args, cfg: dict) -> Tuple[Any, int]:
+    # pylint: disable=unused-argument
+    return {"ranking": dict(_history_ranking(args.provider or "")), "path": str(HISTORY_PATH)}, EXIT_OK
+
+def _cmd_stragglers(args, cfg: dict) -> Tuple[Any, int]:
+    # pylint: disable=unused-argument
+    return {"stragglers": _straggler_stats(), "path": str(STRAGGLERS_PATH)}, EXIT_OK
+
+def _local_include_hashes() -> Dict[str, str]:
+    """{path: sha256} of includes/ as it ends up in /root/tf2-includes (tf2-copy.sh renames server.cfg)."""
+    out: Dict[str, str] = {}
+    for name, data in bundle.content_files(SERVER_RESOURCES_DIR, None).items():
+        rel = name[len("includes/"):]
+        top, _, rest = rel.partition("/")
+        if top in ("cfg", "cfgs", "configs") and rest == "server.cfg":
+            rel = f"{top}/tf2ctl.cfg"
+        out[rel] = hashlib.sha256(data).hexdigest()
+    return out
+
+def _cmd_status(args, cfg: dict) -> Tuple[Any, int]:
+    """Per-VM status from the agents (one request each); also refreshes the registry's map inventory."""
+    # pylint: disable=too-many-locals
+    reg = load_registry()
+    priv, _ = ensure_ssh_key(cfg)
+    api = build_api(cfg)
+    hosts = sorted({_host_of(n, reg[n]) for n in _select_instances(reg, args.server)})
+    targets, missing = _agent_targets(reg, hosts, api)
+    out: Dict[str, Any] = {h: {"agent": False, "error": why} for h, why in missing.items()}
+    local = _local_include_hashes()
+    status_requests = {h: (ip, info, {"hashes": ["includes", "maps"]}) for h, (ip, info) in targets.items()}
+    for host, reply in agent.fleet(status_requests, "status", priv).items():
+        if isinstance(reply, agent.AgentError):
+            out[host] = {"agent": False, "ip": targets[host][0], "error": str(reply)}
+            continue
+        hashes = reply.pop("hashes", {})
+        remote = hashes.get("includes", {})
+        maps = {f[:-len(".bsp")]: sha for f, sha in hashes.get("maps", {}).items() if f.endswith(".bsp")}
+        with _REGISTRY_LOCK:
+            for sibling in _instances_on(reg, host):
+                reg[sibling]["maps"] = maps
+        out[host] = {"agent": True, "ip": targets[host][0], **reply, "maps": len(maps),
+                     "includes_drift": sorted(p for p, sha in local.items() if remote.get(p) != sha)}
+    if targets:
+        save_registry(reg)
+    down = [h for h, st in out.items()
+            if not st["agent"] or not all(c.get("running") for c in st.get("containers", {}).values())]
+    return {"servers": dict(sorted(out.items())), "failed": down}, EXIT_FAILED if down else EXIT_OK
+
+def _cmd_collect_logs(args, cfg: dict) -> Tuple[Any, int]:
+    reg = load_registry()
+    priv, _ = ensure_ssh_key(cfg)
+    hosts = sorted({_host_of(n, reg[n]) for n in _select_instances(reg, args.server)})
+    out = _collect_logs(reg, hosts, build_api(cfg), cfg, priv)
+    failed = [h for h, r in out.items() if "error" in r]
+    return {"servers": out, "failed": failed}, EXIT_FAILED if failed else EXIT_OK
+
+def _cmd_search_logs(args, cfg: dict) -> Tuple[Any, int]:
+    # pylint: disable=unused-argument
+    reg = load_registry()
+    hosts = sorted({_host_of(n, reg[n]) for n in _select_instances(reg, args.server)}) if args.server else None
+    try:
+        since = time.time() - logstore.parse_age(args.since) if args.since else None
+        return logstore.search(LOGSTORE_DIR, args.query, since, hosts, args.limit, args.fts), EXIT_OK
+    except logstore.LogStoreError as exc:
+        raise HeadlessError(EXIT_USAGE, str(exc)) from exc
+
+def _cmd_delete(args, cfg: dict) -> Tuple[Any, int]:
+    if not args.server and not args.all:
+        raise HeadlessError(EXIT_USAGE, "pass --server NAME (repeatable) or --all")
+    if not args.yes:
+        raise HeadlessError(EXIT_USAGE, "deleting servers requires --yes")
+    reg = load_registry()
+    hosts = sorted({_host_of(n, reg[n]) for n in _select_instances(reg, None if args.all else args.server)})
+    deleted: Dict[str, list] = {}
+    failed: Dict[str, str] = {}
+    for host in hosts:
+        meta = reg[_instances_on(reg, host)[0]]
+        try:
+            _api_for_server(cfg, meta).delete_server(meta["id"])
+        except _api_errors() as exc:
+            failed[host] = str(exc)
+            continue
+        deleted[host] = _forget_host(reg, host)
+    return {"deleted": deleted, "failed": failed}, EXIT_FAILED if failed else EXIT_OK
+
+def _headless_start_map(args) -> str:
+    start_map = map_store.map_name(args.start_map)
+    if args.map_file:
+        map_store.add_file(MAPS_DIR, Path(args.map_file).expanduser(), start_map)
+    elif args.map_url:
+        map_store.fetch(MAPS_DIR, args.map_url, start_map)
+    else:
+        map_store.ensure_default(MAPS_DIR)
+    if not map_store.resolve(MAPS_DIR, start_map) and not args.stock_map:
+        raise HeadlessError(EXIT_USAGE, f"{start_map} is not in the map store; pass --map-file, --map-url "
+                                        "or --stock-map if it ships with TF2")
+    return start_map
+
+def _split_regions(specs: list[str]) -> Dict[str, str]:
+    """{provider: region} from --split PROVIDER=REGION flags."""
+    out: Dict[str, str] = {}
+    for spec in specs:
+        provider, _, region = spec.partition("=")
+        if provider not in SUPPORTED_PROVIDERS or not region:
+            raise HeadlessError(EXIT_USAGE, f"--split {spec!r}: expected PROVIDER=REGION with PROVIDER one of "
+                                            f"{', '.join(sorted(SUPPORTED_PROVIDERS))}")
+        out[provider] = region
+    return out
+
+def _auto_candidate(api, provider: str, region: str, size: str) -> Tuple[str, str]:
+    """
+    (region, size slug) with "auto" for either replaced by the best candidate in the
+    provisioning history: over every region the provider lists and/or every recommended size.
+    """
+    sizes = api.recommended_sizes()
+    regions = [r.get("slug") or r.get("id") or "" for r in api.list_regions()] if region == "auto" else [region]
+    candidates = [(provider, r, z) for r in regions for z in (sizes.values() if size == "auto" else [sizes.get(size, size)])]
+    table = history.stats(history.load(HISTORY_PATH))
+    picked = history.best(table, candidates, exact=size == "auto")
+    if picked is None:
+        raise HeadlessError(EXIT_USAGE, f"no provisioning history for {provider} to pick "
+                                        f"{'--size' if size == 'auto' else '--region'} from; pass it explicitly")
+    print(f"{provider}: picked {picked[1]} / {picked[2]} "
+          f"({history.describe(history.lookup(table, picked, exact=size == 'auto'))})")
+    return picked[1], picked[2]
+
+def _cmd_create(args, cfg: dict) -> Tuple[Any, int]:
+    # pylint: disable=too-many-locals,too-many-branches
+    if not SERVER_RESOURCES_DIR.exists():
+        raise HeadlessError(EXIT_CONFIG, f"expected server_resources at {SERVER_RESOURCES_DIR}")
+    regions = _split_regions(args.split or [])
+    if not regions and not args.region:
+        raise HeadlessError(EXIT_USAGE, "pass --region, or --split PROVIDER=REGION (repeatable)")
+    if regions and args.size == "auto":
+        raise HeadlessError(EXIT_USAGE, "--size auto picks for one provider; name a size with --split")
+    provider = next(iter(regions)) if regions else args.provider or cfg.get("provider", "digitalocean")
+    api = _api_for_provider(cfg, provider)
+    for p, region in regions.items():
+        if region == "auto":
+            p_api = _api_for_provider(cfg, p)
+            regions[p] = _auto_candidate(p_api, p, "auto", args.size)[0]
+    region, size = args.region, api.recommended_sizes().get(args.size, args.size)
+    if not regions and "auto" in (region, size):
+        region, size = _auto_candidate(api, provider, region, args.size)
+    ensure_ssh_key(cfg)
+    try:
+        start_map = _headless_start_map(args)
+    except map_store.MapStoreError as exc:
+        raise HeadlessError(EXIT_USAGE, str(exc)) from exc
+
+    count = args.count
+    spare = max(0, int(cfg.get("create_spare", 0) if args.spare is None else args.spare))
+    if regions:
+        # Capacity is checked per provider by the split; what does not fit goes elsewhere
+        plan = _split_placement(cfg, regions, args.size, count + spare)
+        remaining = len(plan)
+    else:
+        plan = []
+        try:
+            remaining = api.capacity_remaining()
+        except _api_errors():
+            remaining = None
+    if remaining is not None and count > remaining:
+        if not args.clamp or remaining <= 0:
+            raise HeadlessError(EXIT_PROVIDER, f"requested {count} servers but the account can create "
+                                               f"{max(remaining, 0)} more (pass --clamp to create that many)")
+        count = remaining
+    if remaining is not None:
+        spare = min(spare, remaining - count)
+
+    names = _name_series(args.prefix, args.start, count + spare)
+    params = {
+        "provider": provider,
+        "region": regions.get(provider, region),
+        "size": size,
+        "start_map": start_map,
+        "demos_tf_apikey": args.demos_tf_apikey,
+        "logs_tf_apikey": args.logs_tf_apikey,
+        "instances_per_vm": max(1, args.per_vm),
+        "tuning_profile": args.tuning_profile,
+        "target": count if spare else 0,
+        "stragglers": args.stragglers or cfg.get("straggler_action", "delete"),
+    }
+    if regions:
+        params["placement"] = dict(zip(names, plan))
+    job = jobs.new_job(JOBS_DIR, names, params)
+    ready, unfinished = _run_create_job(job, api, cfg)
+    reg = load_registry()
+    return {
+        "job": job["id"],
+        "servers": [_instance_record(i, reg[i]) for n in ready for i in _instances_on(reg, n)],
+        "unfinished": [{"name": n, **job["servers"][n]} for n in unfinished],
+        "stragglers": {n: e["straggler"] for n, e in job["servers"].items() if e.get("straggler")},
+    }, EXIT_FAILED if unfinished else EXIT_OK
+
+def _build_parser() -> argparse.ArgumentParser:
+    # pylint: disable=too-many-statements
+    parser = argparse.ArgumentParser(
+        prog="cli.py", description="TF2 server fleet control. Run without arguments for the interactive menu.")
+    cmds = parser.add_subparsers(dest="cmd", required=True)
+
+    def with_servers(p: argparse.ArgumentParser) -> argparse.ArgumentParser:
+        p.add_argument("--server", action="append", metavar="NAME",
+                       help="instance or VM name (repeatable; default: all)")
+        return p
+
+    with_servers(cmds.add_parser("list", help="list tracked instances")).set_defaults(func=_cmd_list)
+    with_servers(cmds.add_parser("conn-strings", help="connection strings")).set_defaults(func=_cmd_conn_strings)
+    p = with_servers(cmds.add_parser("exec", help="run a shell command on each instance's VM ($TF2_CONTAINER set)"))
+    p.add_argument("command")
+    p.set_defaults(func=_cmd_exec)
+    with_servers(cmds.add_parser("restart", help="restart TF2 containers")).set_defaults(func=_cmd_restart)
+    with_servers(cmds.add_parser("reapply", help="reapply includes (fast)")).set_defaults(func=_cmd_reapply)
+    with_servers(cmds.add_parser("status", help="containers, load, disk and include drift per VM (agent)")
+                 ).set_defaults(func=_cmd_status)
+    p = with_servers(cmds.add_parser("logs", help="TF2 container logs"))
+    p.add_argument("--tail", type=int, default=200, help="lines per instance")
+    p.add_argument("--follow", "-f", action="store_true",
+                   help="stream new lines from every selected instance (to stderr) until Ctrl-C / --duration")
+    p.add_argument("--grep", default="", metavar="REGEX", help="only lines matching (applied on the servers with -f)")
+    p.add_argument("--ignore-case", "-i", action="store_true")
+    p.add_argument("--duration", type=float, help="stop following after this many seconds")
+    p.set_defaults(func=_cmd_logs)
+    with_servers(cmds.add_parser("collect-logs", help="fetch new container/srcds/setup log lines into the local index")
+                 ).set_defaults(func=_cmd_collect_logs)
+    p = with_servers(cmds.add_parser("search-logs", help="search collected logs (no server is contacted)"))
+    p.add_argument("query", help="phrase to look for (FTS syntax with --fts)")
+    p.add_argument("--since", help="only lines logged in the last 30m / 1h / 2d ...")
+    p.add_argument("--limit", type=int, default=100, help="matching lines to return")
+    p.add_argument("--fts", action="store_true", help="pass the query to SQLite FTS as is (AND, OR, NEAR, prefix*)")
+    p.set_defaults(func=_cmd_search_logs)
+    p = with_servers(cmds.add_parser("match-events", help="stream match events (round wins, match end, ...) "
+                                                          "parsed from live srcds logs"))
+    p.add_argument("--events", default="", metavar="KIND,...",
+                   help=f"events to print (default: all but kill; 'all' for every one of {', '.join(matchlog.EVENTS)})")
+    p.add_argument("--until", default="", metavar="KIND",
+                   help="exit once every selected instance has emitted this event (e.g. match_end)")
+    p.add_argument("--duration", type=float, help="stop after this many seconds")
+    p.set_defaults(func=_cmd_match_events)
+    p = with_servers(cmds.add_parser("harvest-demos", help="download new SourceTV demos into .tf2ctl/demos/<instance>/"))
+    p.add_argument("--parallel", type=int, help="concurrent downloads (default: config demo_parallel)")
+    p.add_argument("--limit-mbps", type=float, help="combined bandwidth cap in Mbit/s, 0 = none "
+                                                    "(default: config demo_bandwidth_mbps)")
+    p.set_defaults(func=_cmd_harvest_demos)
+    p = cmds.add_parser("watchdog", help="probe every instance and repair the broken ones (restart, reapply, "
+                                         "reconfigure)")
+    p.add_argument("--once", action="store_true", help="one probe round (for cron), then report")
+    p.add_argument("--interval", type=float, help="seconds between rounds (default: config watchdog_interval)")
+    p.add_argument("--dry-run", action="store_true", help="log what would be done without touching servers")
+    p.add_argument("--status", action="store_true", help="show the recorded health states and recent events")
+    p.add_argument("--events", type=int, default=20, help="recent events to show with --status")
+    p.set_defaults(func=_cmd_watchdog)
+    p = cmds.add_parser("scale", help="create and delete servers to follow scaler_schedule, deleting idle ones")
+    p.add_argument("--once", action="store_true", help="one round (for cron), then report")
+    p.add_argument("--interval", type=float, help="seconds between rounds (default: config scaler_interval)")
+    p.add_argument("--dry-run", action="store_true", help="log the decisions without creating or deleting anything")
+    p.add_argument("--status", action="store_true", help="show targets, idle/drain state and recent decisions")
+    p.add_argument("--events", type=int, default=20, help="recent decisions to show with --status")
+    p.set_defaults(func=_cmd_scale)
+    p = with_servers(cmds.add_parser("delete", help="delete VMs (and every instance on them)"))
+    p.add_argument("--all", action="store_true", help="delete every tracked VM")
+    p.add_argument("--yes", action="store_true", help="confirm deletion")
+    p.set_defaults(func=_cmd_delete)
+
+    p = cmds.add_parser("create", help="create and configure servers")
+    p.add_argument("--region", help="required unless --split is given; 'auto' picks the region that provisioned "
+                                    "fastest and most reliably before (see `history`)")
+    p.add_argument("--split", action="append", metavar="PROVIDER=REGION",
+                   help="spread the batch over these providers (repeatable), weighted by their remaining "
+                        "capacity and recent time to ready; --size should then be a recommended size name. "
+                        "REGION may be 'auto'")
+    p.add_argument("--size", required=True, help="provider size slug or a recommended size name; 'auto' picks "
+                                                 "by provisioning history")
+    p.add_argument("--count", type=int, default=1, help="VMs to create")
+    p.add_argument("--prefix", default="tf2")
+    p.add_argument("--start", type=int, default=1, help="first number of the name series")
+    p.add_argument("--per-vm", type=int, default=1, help="srcds instances per VM")
+    p.add_argument("--provider", choices=sorted(SUPPORTED_PROVIDERS))
+    p.add_argument("--tuning-profile", choices=TUNING_PROFILES, default=None)
+    p.add_argument("--start-map", default=map_store.DEFAULT_MAP)
+    p.add_argument("--map-file", help="import the start map from this .bsp first")
+    p.add_argument("--map-url", help="download the start map into the store first")
+    p.add_argument("--stock-map", action="store_true", help="the start map ships with TF2")
+    p.add_argument("--demos-tf-apikey", default="")
+    p.add_argument("--logs-tf-apikey", default="")
+    p.add_argument("--clamp", action="store_true", help="create fewer servers if the account limit is lower")
+    p.add_argument("--spare", type=int, help="create this many extra VMs and keep the first --count to be ready "
+                                             "(default: config create_spare)")
+    p.add_argument("--stragglers", choices=STRAGGLER_ACTIONS,
+                   help="what happens to the slowest --spare VMs (default: config straggler_action)")
+    p.set_defaults(func=_cmd_create)
+
+    cmds.add_parser("stragglers", help="straggler counts per provider/region from over-provisioned creates "
+                                       "(to tune --spare)").set_defaults(func=_cmd_stragglers)
+    p = cmds.add_parser("history", help="creation -> ready time, failure and straggler rates per "
+                                        "provider/region/size, best first")
+    p.add_argument("--provider", choices=sorted(SUPPORTED_PROVIDERS))
+    p.set_defaults(func=_cmd_history)
+
+    p = cmds.add_parser("daemon", help="run the controller daemon (other commands are then forwarded to it)")
+    p.add_argument("--status", action="store_true", help="report whether a daemon is running")
+    p.add_argument("--stop", action="store_true", help="stop the running daemon")
+    p.add_argument("--watchdog", action="store_true", help="also run the watchdog; its repairs queue behind "
+                                                           "other commands that change servers")
+    p.add_argument("--scaler", action="store_true", help="also run the scaler; it creates and deletes servers "
+                                                         "between other commands that change servers")
+    return parser
+
+def _execute(args, cfg: dict) -> Tuple[Any, int]:
+    """Run a parsed headless command; errors become ({"error": ...}, exit code)."""
+    try:
+        if getattr(args, "tuning_profile", "") is None:
+            args.tuning_profile = cfg.get("tuning_profile", "off")
+        return args.func(args, cfg)
+    except HeadlessError as exc:
+        return {"error": str(exc)}, exc.code
+    except _api_errors() as exc:
+        return {"error": f"provider API: {exc}"}, EXIT_PROVIDER
+
+def _serve_daemon(with_watchdog: bool = False, with_scaler: bool = False) -> Tuple[Any, int]:
+    """Run headless commands for clients until stopped, keeping config, API clients and SSH warm."""
+    global _NONINTERACTIVE  # pylint: disable=global-statement
+    _NONINTERACTIVE = True
+    warm: Dict[str, Any] = {"mtime": None, "cfg": None}
+    # Commands that change the registry or servers run one at a time; read-only ones never wait
+    serial = threading.Lock()
+
+    def config() -> dict:
+        mtime = CONFIG_PATH.stat().st_mtime_ns if CONFIG_PATH.exists() else None
+        if warm["cfg"] is None or mtime != warm["mtime"]:
+            warm["cfg"] = load_config()
+            warm["mtime"] = CONFIG_PATH.stat().st_mtime_ns
+        return warm["cfg"]
+
+    def handle(argv: list[str]) -> Tuple[Any, int]:
+        try:
+            args = _build_parser().parse_args(argv)
+        except SystemExit:
+            return {"error": f"bad arguments: {argv}"}, EXIT_USAGE
+        if args.cmd == "daemon":
+            return {"error": "daemon commands are not forwarded"}, EXIT_USAGE
+        if args.cmd in ("list", "logs", "search-logs", "stragglers", "history"):
+            return _execute(args, config())
+        with serial:
+            return _execute(args, config())
+
+    scl = None
+    if with_scaler:
+        ensure_ssh_key(config())
+        try:
+            scl = _make_scaler(config(), lock=serial)
+        except scaler.ScheduleError as exc:
+            _NONINTERACTIVE = False
+            return {"error": f"scaler config: {exc}"}, EXIT_CONFIG
+    SSHOps.enable_pool()
+    stop_background = threading.Event()
+    if with_watchdog:
+        cfg = config()
+        priv, _ = ensure_ssh_key(cfg)
+        dog = _make_watchdog(cfg, priv, lock=serial)
+        threading.Thread(target=dog.run, args=(float(cfg.get("watchdog_interval", watchdog.DEFAULT_INTERVAL)),
+                                               stop_background), daemon=True).start()
+    if scl is not None:
+        threading.Thread(target=scl.run, args=(float(config().get("scaler_interval", scaler.DEFAULT_INTERVAL)),
+                                               stop_background), daemon=True).start()
+    try:
+        daemon.serve(DAEMON_SOCKET, handle)
+    except daemon.DaemonError as exc:
+        return {"error": str(exc)}, EXIT_CONFIG
+    finally:
+        stop_background.set()
+        SSHOps.close_pool()
+        _NONINTERACTIVE = False
+    return {"stopped": True}, EXIT_OK
+
+def _daemon_command(args) -> Tuple[Any, int]:
+    if args.status:
+        info = daemon.ping(DAEMON_SOCKET)
+        return {"running": info is not None, **(info or {})}, EXIT_OK if info else EXIT_FAILED
+    if args.stop:
+        return {"stopped": daemon.stop(DAEMON_SOCKET)}, EXIT_OK
+    return _serve_daemon(args.watchdog, args.scaler)
+
+def headless(argv: list[str]) -> int:
+    """
+    Run one headless command; progress goes to stderr, the JSON result to stdout. While a
+    daemon is running (and TF2CTL_NO_DAEMON is unset) the command runs there instead.
+    """
+    global _NONINTERACTIVE  # pylint: disable=global-statement
+    args = _build_parser().parse_args(argv)
+    forwarded = None
+    if args.cmd == "daemon":
+        forwarded = _daemon_command(args)
+    elif not os.environ.get("TF2CTL_NO_DAEMON") and not getattr(args, "follow", False) \
+            and args.cmd not in ("match-events", "watchdog", "scale"):
+        # Streams, the watchdog and the scaler run until the caller's Ctrl-C, which the daemon would never see
+        try:
+            forwarded = daemon.call(DAEMON_SOCKET, argv, sys.stderr.write)
+        except (daemon.DaemonError, OSError) as exc:
+            forwarded = {"error": f"daemon: {exc}"}, EXIT_FAILED
+    if forwarded is not None:
+        result, code = forwarded
+    else:
+        _NONINTERACTIVE = True
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                result, code = _execute(args, load_config())
+        finally:
+            _NONINTERACTIVE = False
+    print(json.dumps(result, indent=2))
+    return code
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(headless(sys.argv[1:]))
     try:
         menu()
     except KeyboardInterrupt:
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Controller daemon: one long-running process that keeps provider HTTP
+sessions, pooled SSH transports and the loaded config warm, and runs headless
+CLI commands sent to it over a local Unix socket.
+
+    python cli.py daemon             # serve in the foreground (.tf2ctl/daemon.sock)
+    python cli.py list               # forwarded to the daemon while it runs
+    python cli.py daemon --status | --stop
+
+Protocol, one request per connection: the client sends a JSON line
+{"op": "run", "argv": [...]} ("ping" and "stop" take no argv). For "run"
+the daemon streams {"out": "<text>"} lines with the command's progress output
+and ends with {"code": <exit code>, "result": <JSON result>}.
+
+This module is only the transport; the CLI supplies the command handler.
+"""
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# argv -> (JSON-serializable result, exit code)
+Handler = Callable[[List[str]], Tuple[Any, int]]
+
+
+class DaemonError(Exception):
+    pass
+
+
+def supported() -> bool:
+    return hasattr(socket, "AF_UNIX")
+
+
+class _ThreadOutput:
+    """sys.stdout/sys.stderr stand-in: text written on a request's thread goes to that request's client."""
+    def __init__(self, fallback):
+        self._fallback = fallback
+        self._local = threading.local()
+
+    def bind(self, send: Optional[Callable[[str], None]]):
+        self._local.send = send
+
+    def write(self, text: str) -> int:
+        send = getattr(self._local, "send", None)
+        if send is not None:
+            send(text)
+        else:
+            self._fallback.write(text)
+        return len(text)
+
+    def flush(self):
+        self._fallback.flush()
+
+    def isatty(self) -> bool:
+        return False
+
+
+def _connect(sock_path: Path, timeout: Optional[float]) -> Optional[socket.socket]:
+    if not supported() or not sock_path.exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)  # pylint: disable=no-member
+    sock.settimeout(timeout)
+    try:
+        sock.connect(str(sock_path))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def _request(sock_path: Path, payload: Dict[str, Any], on_output: Optional[Callable[[str], None]] = None,
+             timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """Send one request; returns the final message, or None when no daemon is listening."""
+    sock = _connect(sock_path, timeout)
+    if sock is None:
+        return None
+    with sock, sock.makefile("rb") as rfile:
+        sock.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        for raw in rfile:
+            try:
+                msg = json.loads(raw)
+            except JSONDecodeError as exc:
+                raise DaemonError(f"bad reply from daemon: {exc}") from exc
+            if "out" in msg:
+                if on_output is not None:
+                    on_output(msg["out"])
+                continue
+            return msg
+    raise DaemonError("daemon closed the connection before the command finished")
+
+
+def call(sock_path: Path, argv: List[str], on_output: Callable[[str], None]) -> Optional[Tuple[Any, int]]:
+    """Run a CLI command in the daemon: (result, exit code), or None when no daemon is listening."""
+    msg = _request(sock_path, {"op": "run", "argv": list(argv)}, on_output)
+    if msg is None:
+        return None
+    return msg.get("result"), int(msg.get("code", 1))
+
+
+def ping(sock_path: Path) -> Optional[Dict[str, Any]]:
+    msg = _request(sock_path, {"op": "ping"}, timeout=5.0)
+    return None if msg is None else msg.get("result")
+
+
+def stop(sock_path: Path) -> bool:
+    return _request(sock_path, {"op": "stop"}, timeout=5.0) is not None
+
+
+# Unix-socket server where available; serve() refuses to run elsewhere
+_BaseServer = getattr(socketserver, "ThreadingUnixStreamServer", socketserver.ThreadingTCPServer)
+
+
+class _Request(socketserver.StreamRequestHandler):
+    server: "_Server"
+
+    def setup(self):
+        super().setup()
+        self._gone = False
+
+    def _send(self, msg: Dict[str, Any]):
+        if self._gone:
+            return
+        try:
+            self.wfile.write((json.dumps(msg) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        except OSError:
+            self._gone = True  # client went away; finish the command anyway
+
+    def _run(self, argv: List[str]):
+        srv = self.server
+        srv.requests += 1
+
+        def send(text: str):
+            self._send({"out": text})
+
+        srv.out.bind(send)
+        srv.err.bind(send)
+        try:
+            result, code = srv.handler(argv)
+        finally:
+            srv.out.bind(None)
+            srv.err.bind(None)
+        self._send({"code": code, "result": result})
+
+    def handle(self):
+        try:
+            req = json.loads(self.rfile.readline() or b"{}")
+        except JSONDecodeError:
+            req = {}
+        op = req.get("op")
+        if op == "ping":
+            self._send({"result": {"pid": os.getpid(), "uptime": round(time.time() - self.server.started, 1),
+                                   "requests": self.server.requests}})
+        elif op == "stop":
+            self._send({"result": {"stopping": True}})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        elif op == "run" and isinstance(req.get("argv"), list):
+            self._run(req["argv"])
+        else:
+            self._send({"code": 2, "result": {"error": f"unknown request {req!r}"}})
+
+
+class _Server(_BaseServer):
+    daemon_threads = True
+
+    def __init__(self, sock_path: Path, handler: Handler):
+        super().__init__(str(sock_path), _Request)
+        self.handler = handler
+        self.started = time.time()
+        self.requests = 0
+        self.out = _ThreadOutput(sys.stdout)
+        self.err = _ThreadOutput(sys.stderr)
+
+
+def serve(sock_path: Path, handler: Handler):
+    """Serve requests on `sock_path` until a "stop" request or Ctrl-C."""
+    if not supported():
+        raise DaemonError("this platform has no Unix sockets")
+    if ping(sock_path) is not None:
+        raise DaemonError(f"a daemon is already listening on {sock_path}")
+    sock_path.unlink(missing_ok=True)
+    old_umask = os.umask(0o077)  # the socket is as private as the keys behind it
+    try:
+        server = _Server(sock_path, handler)
+    finally:
+        os.umask(old_umask)
+    old_out, old_err = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = server.out, server.err
+    try:
+        print(f"tf2ctl daemon listening on {sock_path} (pid {os.getpid()})", file=old_err)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout, sys.stderr = old_out, old_err
+        server.server_close()
+        sock_path.unlink(missing_ok=True)
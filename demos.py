@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+SourceTV demo harvest.
+
+Every instance records demos inside its container (tf/*.dem, tf/demos/...). harvest()
+takes each instance's listing (from the agent, with sha256s, or from `find` over SSH)
+and downloads what is missing into
+
+    .tf2ctl/demos/<instance>/<path>.dem
+    .tf2ctl/demos/<instance>/.index.json      {path: {"size", "mtime", "sha256"}}
+
+A demo is skipped when a local file of the same name and size is already indexed with
+the same sha256 (or, for listings without hashes, the same mtime). Demos still being
+recorded are left for the next run. Each download is `cat | gzip -1` on the server,
+decompressed and hashed locally while it streams, and renamed into place only once
+complete and verified. Downloads run in parallel and share one bandwidth cap.
+"""
+import hashlib
+import json
+import posixpath
+import shlex
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+    from tf2ctl.ssh_ops import SSHOps
+    from tf2ctl import tracing
+except ImportError:
+    from ssh_ops import SSHOps
+    import tracing
+
+GAME_DIR = "/home/tf2/server/tf"
+INDEX_NAME = ".index.json"
+MAX_PARALLEL = 4
+LIST_PARALLEL = 16
+# A listing without mtimes this recent is assumed to still be recording (see the agent)
+RECORDING_GRACE = 60
+
+_CHUNK = 1024 * 1024
+
+
+class Bandwidth:
+    """Token bucket shared by every download; rate 0 means unlimited."""
+
+    def __init__(self, bytes_per_sec: float):
+        self.rate = bytes_per_sec
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, n: int):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            # At most a quarter second of burst
+            self._tokens = min(self.rate / 4, self._tokens + (now - self._last) * self.rate) - n
+            self._last = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+def listing_command(container: str) -> str:
+    """Fallback listing over SSH for VMs without the agent: "<size> <mtime> <path>" lines."""
+    inner = (f"cd {GAME_DIR} && find . -maxdepth 1 -name '*.dem' -printf '%s %T@ %P\\n'; "
+             f"[ -d demos ] && find demos -name '*.dem' -printf '%s %T@ %p\\n'; true")
+    return f"docker exec {shlex.quote(container)} sh -c {shlex.quote(inner)}"
+
+
+def parse_listing(text: str, now: Optional[float] = None) -> List[Dict[str, Any]]:
+    now = time.time() if now is None else now
+    out = []
+    for line in text.splitlines():
+        parts = line.strip().split(" ", 2)
+        if len(parts) != 3 or not parts[0].isdigit():
+            continue
+        try:
+            mtime = int(float(parts[1]))
+        except ValueError:
+            continue
+        out.append({"path": parts[2], "size": int(parts[0]), "mtime": mtime, "sha256": "",
+                    "recording": now - mtime < RECORDING_GRACE})
+    return out
+
+
+def list_over_ssh(targets: Dict[str, Tuple[str, str]], private_key: str) -> Dict[str, Union[List[Dict[str, Any]], str]]:
+    """Listings for {instance: (ip, container)} via listing_command(), in parallel; an error string on failure."""
+    def one(item):
+        name, (ip, container) = item
+        rc, out, err = SSHOps.run_command(ip, "root", private_key, listing_command(container), get_pty=False)
+        return name, parse_listing(out) if rc == 0 else (err or out).strip()[-300:] or f"exit {rc}"
+
+    if not targets:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(LIST_PARALLEL, len(targets))) as pool:
+        return dict(pool.map(one, targets.items()))
+
+
+def _safe_path(rel: str) -> bool:
+    norm = posixpath.normpath(rel)
+    return rel.endswith(".dem") and not norm.startswith(("/", "..")) and norm == rel
+
+
+def load_index(dest_dir: Path) -> Dict[str, Dict[str, Any]]:
+    try:
+        return json.loads((dest_dir / INDEX_NAME).read_text(encoding="utf-8"))
+    except (OSError, JSONDecodeError):
+        return {}
+
+
+def save_index(dest_dir: Path, index: Dict[str, Dict[str, Any]]):
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    tmp = dest_dir / (INDEX_NAME + ".tmp")
+    tmp.write_text(json.dumps(index, indent=2, sort_keys=True), encoding="utf-8")
+    tmp.replace(dest_dir / INDEX_NAME)
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as fp:
+        for chunk in iter(lambda: fp.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _have(dest_dir: Path, index: Dict[str, Dict[str, Any]], demo: Dict[str, Any]) -> bool:
+    path = dest_dir / demo["path"]
+    try:
+        if path.stat().st_size != demo["size"]:
+            return False
+    except OSError:
+        return False
+    known = index.get(demo["path"])
+    if known is None or known.get("size") != demo["size"]:
+        # A file the index does not know (copied in by hand, or an interrupted run): hash it once
+        known = index[demo["path"]] = {"size": demo["size"], "mtime": demo["mtime"], "sha256": _sha256_file(path)}
+    if demo["sha256"]:
+        return known.get("sha256") == demo["sha256"]
+    return known.get("mtime") == demo["mtime"]
+
+
+def plan(dest_dir: Path, listing: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """(demos to download, {"listed", "present", "recording", "rejected"}); refreshes the index."""
+    index = load_index(dest_dir)
+    counts = {"listed": len(listing), "present": 0, "recording": 0, "rejected": 0}
+    todo = []
+    for demo in listing:
+        if not _safe_path(demo["path"]):
+            counts["rejected"] += 1
+        elif demo.get("recording"):
+            counts["recording"] += 1
+        elif _have(dest_dir, index, demo):
+            counts["present"] += 1
+        else:
+            todo.append(demo)
+    if index:
+        save_index(dest_dir, index)
+    return todo, counts
+
+
+def fetch(ip: str, private_key: str, container: str, demo: Dict[str, Any], dest_dir: Path,
+          bandwidth: Bandwidth) -> Dict[str, Any]:
+    """Download one demo; returns its index entry plus "wire_bytes". Raises ConnectionError."""
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    dest = dest_dir / demo["path"]
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    part = dest.with_name(dest.name + ".part")
+    source = posixpath.join(GAME_DIR, demo["path"])
+    command = ("bash -o pipefail -c " +
+               shlex.quote(f"docker exec {shlex.quote(container)} cat -- {shlex.quote(source)} | gzip -1 -c"))
+    inflate = zlib.decompressobj(wbits=31)
+    h = hashlib.sha256()
+    wire = size = 0
+    with tracing.span("demos.fetch", container=container, bytes=demo["size"]) as sp, part.open("wb") as fp:
+        def on_chunk(data: bytes):
+            nonlocal wire, size
+            bandwidth.take(len(data))
+            wire += len(data)
+            raw = inflate.decompress(data)
+            h.update(raw)
+            size += len(raw)
+            fp.write(raw)
+
+        try:
+            rc, err = SSHOps.read_command(ip, "root", private_key, command, on_chunk)
+        except (ConnectionError, zlib.error) as exc:
+            part.unlink(missing_ok=True)
+            raise ConnectionError(f"{demo['path']}: {exc}") from exc
+        sp["wire_bytes"] = wire
+    sha = h.hexdigest()
+    problem = (f"exit {rc}: {err.strip()[-200:]}" if rc != 0 else
+               "truncated transfer" if not inflate.eof else
+               f"size {size} != {demo['size']}" if size != demo["size"] else
+               "sha256 mismatch" if demo["sha256"] and sha != demo["sha256"] else "")
+    if problem:
+        part.unlink(missing_ok=True)
+        raise ConnectionError(f"{demo['path']}: {problem}")
+    part.replace(dest)
+    return {"size": size, "mtime": demo["mtime"], "sha256": sha, "wire_bytes": wire}
+
+
+def harvest(instances: Dict[str, Tuple[str, str, List[Dict[str, Any]]]], demos_dir: Path, private_key: str,
+            parallel: int = MAX_PARALLEL, limit_bytes_per_sec: float = 0) -> Dict[str, Dict[str, Any]]:
+    """
+    Download the new demos of `instances` ({instance: (ip, container, listing)}) into
+    demos_dir/<instance>/. Returns {instance: {"listed", "present", "recording", "rejected",
+    "fetched", "bytes", "wire_bytes", "errors"}}.
+    """
+    # pylint: disable=too-many-locals
+    bandwidth = Bandwidth(limit_bytes_per_sec)
+    out: Dict[str, Dict[str, Any]] = {}
+    work = []
+    for name, (ip, container, listing) in instances.items():
+        todo, counts = plan(demos_dir / name, listing)
+        out[name] = {**counts, "fetched": 0, "bytes": 0, "wire_bytes": 0, "errors": []}
+        work += [(name, ip, container, demo) for demo in todo]
+
+    def one(item):
+        name, ip, container, demo = item
+        with tracing.tags(server=name):
+            try:
+                return item, fetch(ip, private_key, container, demo, demos_dir / name, bandwidth)
+            except ConnectionError as exc:
+                return item, exc
+
+    # Largest first, so one big demo does not start last and hold up the whole run
+    work.sort(key=lambda item: -item[3]["size"])
+    fetched: Dict[str, Dict[str, Any]] = {}
+    if work:
+        with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(work)))) as pool:
+            for (name, _, _, demo), result in pool.map(one, work):
+                if isinstance(result, ConnectionError):
+                    out[name]["errors"].append(str(result))
+                    continue
+                wire_bytes = result.pop("wire_bytes")
+                fetched.setdefault(name, {})[demo["path"]] = result
+                out[name]["fetched"] += 1
+                out[name]["bytes"] += result["size"]
+                out[name]["wire_bytes"] += wire_bytes
+    for name, entries in fetched.items():
+        index = load_index(demos_dir / name)
+        index.update(entries)
+        save_index(demos_dir / name, index)
+    return out
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Tree fan-out distribution of large content (maps, includes, a saved Docker
+image) to many servers.
+
+Instead of uploading the same payload from the controller to every server,
+the controller uploads it once per region to a seed server. Servers that
+hold it then relay it to their peers over SSH, doubling the number of
+holders every round (a binomial tree), so N servers in a region are covered
+in about log2(N) rounds and controller egress is one copy per region.
+
+Relays authenticate with an ephemeral Ed25519 key that is installed on the
+region's servers for the duration of the distribution and removed afterwards.
+A relay that fails falls back to a direct upload from the controller (when
+the controller has a copy; content produced on a seed, like a `docker save`
+archive, can only be relayed).
+"""
+import shlex
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from tf2ctl.ssh_ops import SSHOps
+    from tf2ctl import tracing
+except ImportError:
+    from ssh_ops import SSHOps
+    import tracing
+
+SHARED_DIR = "/root/tf2ctl-shared"
+RELAY_KEY = "/root/.ssh/tf2ctl-relay"
+RELAY_TAG = "tf2ctl-relay"
+MAX_PARALLEL = 16
+
+# (name, ip) of one server
+Node = Tuple[str, str]
+
+
+def remote_path(sha: str, suffix: str = ".tgz") -> str:
+    return f"{SHARED_DIR}/{sha}{suffix}"
+
+
+def _receive_command(sha: str, suffix: str) -> str:
+    """Write stdin to the shared dir, keeping it only if the checksum matches."""
+    path = remote_path(sha, suffix)
+    return (f"mkdir -p {SHARED_DIR} && cat > {path}.part && "
+            f"echo '{sha}  {path}.part' | sha256sum -c --quiet && mv {path}.part {path}")
+
+
+def _relay_command(sha: str, suffix: str, dst_ip: str) -> str:
+    ssh = (f"ssh -i {RELAY_KEY} -o BatchMode=yes -o StrictHostKeyChecking=no "
+           f"-o UserKnownHostsFile=/dev/null -o ConnectTimeout=15 root@{dst_ip}")
+    return f"{ssh} {shlex.quote(_receive_command(sha, suffix))} < {remote_path(sha, suffix)}"
+
+
+def binomial_rounds(holders: List[Node], pending: List[Node]) -> List[List[Tuple[Node, Node]]]:
+    """
+    The (src, dst) pairs of each round if every relay succeeds: each holder sends to
+    one pending node per round. Used for display; fan_out() re-pairs after failures.
+    """
+    holders, pending = list(holders), list(pending)
+    rounds = []
+    while pending and holders:
+        pairs = list(zip(holders, pending))
+        rounds.append(pairs)
+        pending = pending[len(pairs):]
+        holders += [dst for _, dst in pairs]
+    return rounds
+
+
+def _has_payload(node: Node, sha: str, suffix: str, private_key: str) -> bool:
+    rc, out, _ = SSHOps.run_command(node[1], "root", private_key,
+                                    f"sha256sum {remote_path(sha, suffix)} 2>/dev/null | cut -d' ' -f1", get_pty=False)
+    return rc == 0 and out.strip() == sha
+
+
+def _upload(node: Node, sha: str, suffix: str, payload: Optional[Path], private_key: str) -> bool:
+    if payload is None:
+        return False
+    with tracing.span("distribute.upload", server=node[0], bytes=payload.stat().st_size) as sp:
+        rc, out = SSHOps.pipe_command(node[1], "root", private_key, _receive_command(sha, suffix), payload)
+        sp["rc"] = rc
+    if rc != 0:
+        print(f"  [{node[0]}] upload failed (exit {rc}): {out.strip()[-200:]}")
+    return rc == 0
+
+
+def _install_relay_key(node: Node, relay_priv: str, relay_pub: str, private_key: str) -> bool:
+    cmd = (f"umask 077 && mkdir -p /root/.ssh && cat > {RELAY_KEY} && "
+           f"echo '{relay_pub.strip()}' >> /root/.ssh/authorized_keys")
+    rc, _ = SSHOps.pipe_command(node[1], "root", private_key, cmd, relay_priv.encode("utf-8"))
+    return rc == 0
+
+
+def _remove_relay_key(node: Node, comment: str, private_key: str):
+    SSHOps.run_command(node[1], "root", private_key,
+                       f"rm -f {RELAY_KEY}; sed -i '/ {comment}$/d' /root/.ssh/authorized_keys", get_pty=False)
+
+
+def _relay(src: Node, dst: Node, sha: str, suffix: str, private_key: str) -> bool:
+    with tracing.span("distribute.relay", server=dst[0], source=src[0]) as sp:
+        rc, out, err = SSHOps.run_command(src[1], "root", private_key, _relay_command(sha, suffix, dst[1]),
+                                          get_pty=False)
+        sp["rc"] = rc
+    if rc != 0:
+        print(f"  [{dst[0]}] relay from {src[0]} failed (exit {rc}): {(err or out).strip()[-200:]}")
+    return rc == 0
+
+
+def _fan_out_region(region: str, nodes: List[Node], sha: str, suffix: str,
+                    payload: Optional[Path], private_key: str) -> Dict[str, str]:
+    # pylint: disable=too-many-locals,too-many-branches,too-many-arguments,too-many-positional-arguments
+    how: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as pool:
+        present = list(pool.map(lambda n: _has_payload(n, sha, suffix, private_key), nodes))
+    holders = [n for n, has in zip(nodes, present) if has]
+    pending = [n for n, has in zip(nodes, present) if not has]
+    for n in holders:
+        how[n[0]] = "present"
+    if not pending:
+        return how
+
+    if not holders:
+        if payload is None:
+            print(f"  [{region}] no server holds {remote_path(sha, suffix)}; nothing to relay from.")
+            return {**how, **{n[0]: "failed" for n in pending}}
+        seed = pending.pop(0)
+        print(f"  [{region}] uploading seed copy to {seed[0]}...")
+        if not _upload(seed, sha, suffix, payload, private_key):
+            how[seed[0]] = "failed"
+            # Try the next server as the seed; with none left there is nothing to relay from
+            return {**how, **_fan_out_region(region, pending, sha, suffix, payload, private_key)} if pending else how
+        how[seed[0]] = "seed"
+        holders.append(seed)
+    if not pending:
+        return how
+
+    relay_priv, relay_pub = SSHOps.generate_ed25519_keypair(comment=f"{RELAY_TAG}-{uuid.uuid4().hex[:8]}")
+    comment = relay_pub.split()[-1]
+    everyone = holders + pending
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as pool:
+        keyed = dict(zip([n[0] for n in everyone],
+                         pool.map(lambda n: _install_relay_key(n, relay_priv, relay_pub, private_key), everyone)))
+    relays = [n for n in holders if keyed[n[0]]]
+    direct = [n for n in pending if not keyed[n[0]]]
+    pending = [n for n in pending if keyed[n[0]]]
+    try:
+        rnd = 0
+        while pending and relays:
+            rnd += 1
+            pairs = list(zip(relays, pending))
+            pending = pending[len(pairs):]
+            print(f"  [{region}] round {rnd}: {len(pairs)} relay(s)")
+            with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as pool:
+                results = list(pool.map(lambda p: _relay(p[0], p[1], sha, suffix, private_key), pairs))
+            for (src, dst), ok in zip(pairs, results):
+                if ok:
+                    how[dst[0]] = f"relay:{src[0]}"
+                    relays.append(dst)
+                else:
+                    direct.append(dst)
+        direct += pending
+    finally:
+        with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as pool:
+            list(pool.map(lambda n: _remove_relay_key(n, comment, private_key), everyone))
+
+    for n in direct:
+        if payload is None:
+            how[n[0]] = "failed"
+            continue
+        print(f"  [{region}] {n[0]}: falling back to a direct upload")
+        how[n[0]] = "direct" if _upload(n, sha, suffix, payload, private_key) else "failed"
+    return how
+
+
+def fan_out(groups: Dict[str, List[Node]], sha: str, payload: Optional[Path], private_key: str,
+            suffix: str = ".tgz") -> Dict[str, str]:
+    """
+    Place `payload` (sha256 `sha`) at remote_path(sha, suffix) on every node, one seed upload
+    per group (region). With payload=None the content must already be on a node of each
+    group (e.g. produced there). Returns {name: how} with how one of "present", "seed",
+    "relay:<src>", "direct" or "failed".
+    """
+    how: Dict[str, str] = {}
+    for region, nodes in sorted(groups.items()):
+        if not nodes:
+            continue
+        rounds = binomial_rounds(nodes[:1], nodes[1:])
+        size = f"{payload.stat().st_size / (1024 * 1024):.1f} MB" if payload else remote_path(sha, suffix)
+        print(f"Distributing {size} to {len(nodes)} server(s) in {region} ({len(rounds)} relay round(s))...")
+        with tracing.span("distribute.region", region=region, servers=len(nodes)):
+            how.update(_fan_out_region(region, nodes, sha, suffix, payload, private_key))
+    uploads = sum(1 for v in how.values() if v in ("seed", "direct"))
+    print(f"Distribution done: {uploads} upload(s) from this machine for {len(how)} server(s).")
+    return how
@@ -4,6 +4,11 @@ import time
 from typing import Dict, Any, List, Optional
 import requests
 
+try:
+    from tf2ctl.tracing import traced
+except ImportError:
+    from tracing import traced
+
 API = "https://api.digitalocean.com/v2"
 
 class DOAPIError(Exception):
@@ -16,6 +21,8 @@ class DigitalOceanAPI:
     # pylint: disable=too-many-branches,too-many-statements,too-many-locals,too-many-nested-blocks,too-many-arguments,too-many-positional-arguments
     def __init__(self, token: str):
         self.token = token.strip()
+        # One keep-alive session per client: repeated calls reuse the TLS connection
+        self.session = requests.Session()
 
     def _headers(self) -> Dict[str, str]:
         return {
@@ -45,7 +52,7 @@ class DigitalOceanAPI:
         }
 
     def get_account_info(self) -> Dict[str, Any]:
-        r = requests.get(f"{API}/account", headers=self._headers(), timeout=30)
+        r = self.session.get(f"{API}/account", headers=self._headers(), timeout=30)
         if not r.ok:
             self._handle_error(r)
         return r.json().get("account", {})
@@ -54,7 +61,7 @@ class DigitalOceanAPI:
         droplets: List[Dict[str, Any]] = []
         page = 1
         while True:
-            r = requests.get(
+            r = self.session.get(
                 f"{API}/droplets",
                 headers=self._headers(),
                 params={"page": page, "per_page": 200},
@@ -70,6 +77,7 @@ class DigitalOceanAPI:
             page += 1
         return droplets
 
+    @traced("provider.capacity_remaining", provider="digitalocean")
     def capacity_remaining(self) -> Optional[int]:
         """
         Returns remaining droplet capacity for this account.
@@ -80,7 +88,7 @@ class DigitalOceanAPI:
         return max(0, limit - cur)
 
     def list_regions(self) -> List[Dict[str, Any]]:
-        r = requests.get(f"{API}/regions", headers=self._headers(), timeout=30)
+        r = self.session.get(f"{API}/regions", headers=self._headers(), timeout=30)
         if not r.ok:
             self._handle_error(r)
         regions = []
@@ -96,7 +104,7 @@ class DigitalOceanAPI:
         out = []
         page = 1
         while True:
-            r = requests.get(f"{API}/account/keys", headers=self._headers(), params={"page": page, "per_page": 200}, timeout=30)
+            r = self.session.get(f"{API}/account/keys", headers=self._headers(), params={"page": page, "per_page": 200}, timeout=30)
             if not r.ok:
                 self._handle_error(r)
             data = r.json()
@@ -107,11 +115,12 @@ class DigitalOceanAPI:
             page += 1
         return out
 
+    @traced("provider.ensure_ssh_key", provider="digitalocean")
     def ensure_ssh_key(self, pub_key: str) -> str:
         for k in self.list_ssh_keys():
             if k.get("public_key", "").strip() == pub_key.strip():
                 return str(k["id"])
-        r = requests.post(
+        r = self.session.post(
             f"{API}/account/keys",
             headers=self._headers(),
             json={"name": "tf2ctl", "public_key": pub_key},
@@ -124,6 +133,7 @@ class DigitalOceanAPI:
     # --------------------------
     # Droplets
     # --------------------------
+    @traced("provider.create_server", provider="digitalocean")
     def create_server(self, name: str, region: str, size: str, ssh_key_id: str, public_key: str, tags: List[str]) -> Dict[str, Any]:
         # public_key unused on DO; keep signature consistent with other providers
         # pylint: disable=unused-argument
@@ -140,16 +150,24 @@ class DigitalOceanAPI:
             "volumes": None,
             "tags": tags,
         }
-        r = requests.post(f"{API}/droplets", headers=self._headers(), json=payload, timeout=60)
+        r = self.session.post(f"{API}/droplets", headers=self._headers(), json=payload, timeout=60)
         if r.status_code >= 400:
             self._handle_error(r)
         return r.json()["droplet"]
 
+    def find_server_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """Look up a droplet by exact name (used to re-adopt instances after an interrupted create)."""
+        for d in self.list_all_droplets():
+            if d.get("name") == name:
+                return {"id": d.get("id"), "status": d.get("status", "")}
+        return None
+
+    @traced("provider.wait_for_active_ip", provider="digitalocean")
     def wait_for_active_ip(self, droplet_id: int, timeout: int = 900, poll: int = 8) -> Dict[str, Any]:
         deadline = time.time() + timeout
         last = {}
         while time.time() < deadline:
-            r = requests.get(f"{API}/droplets/{droplet_id}", headers=self._headers(), timeout=30)
+            r = self.session.get(f"{API}/droplets/{droplet_id}", headers=self._headers(), timeout=30)
             if not r.ok:
                 self._handle_error(r)
             data = r.json().get("droplet", {})
@@ -161,7 +179,8 @@ class DigitalOceanAPI:
             time.sleep(poll)
         return {"ip": "", "last": last}
 
+    @traced("provider.delete_server", provider="digitalocean")
     def delete_server(self, droplet_id: int):
-        r = requests.delete(f"{API}/droplets/{droplet_id}", headers=self._headers(), timeout=60)
+        r = self.session.delete(f"{API}/droplets/{droplet_id}", headers=self._headers(), timeout=60)
         if r.status_code not in (204, 404):
             self._handle_error(r)
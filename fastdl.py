@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+FastDL: serve bzip2'd custom content to players over HTTP.
+
+srcds sends custom maps/materials to joining players at in-game rates unless
+`sv_downloadurl` points at an HTTP host holding `<path>.bz2` copies. The
+controller compresses each downloadable file once, cached by the sha256 of
+its source under .tf2ctl/fastdl/, and publishes them to a small nginx
+container (tf2ctl-fastdl) on each node ("node" mode) or on one designated
+node ("host" mode). Only files the target does not already hold are sent.
+setup.sh writes the resulting URL into tf2ctl.cfg.
+"""
+import bz2
+import hashlib
+import os
+import shlex
+import tarfile
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, Tuple
+
+try:
+    from tf2ctl.ssh_ops import SSHOps
+    from tf2ctl import map_store
+    from tf2ctl import tracing
+except ImportError:
+    from ssh_ops import SSHOps
+    import map_store
+    import tracing
+
+MODES = ("off", "node", "host")
+DEFAULT_PORT = 8080
+REMOTE_DIR = "/srv/tf2ctl-fastdl"
+CONTAINER = "tf2ctl-fastdl"
+IMAGE = "nginx:alpine"
+
+# includes/ subdirectories whose files players may need to download
+ASSET_DIRS = ("maps", "materials", "models", "sound", "resource", "particles")
+
+_CHUNK = 1024 * 1024
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as fp:
+        for chunk in iter(lambda: fp.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def compressed(cache_dir: Path, source: Path, sha: str = "") -> Path:
+    """The .bz2 of `source`, compressed once per content hash."""
+    sha = sha or _sha256_file(source)
+    dest = cache_dir / f"{sha}.bz2"
+    if dest.exists():
+        return dest
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".part")
+    with tracing.span("fastdl.compress", bytes=source.stat().st_size):
+        comp = bz2.BZ2Compressor(9)
+        with os.fdopen(fd, "wb") as out, source.open("rb") as src:
+            for chunk in iter(lambda: src.read(_CHUNK), b""):
+                out.write(comp.compress(chunk))
+            out.write(comp.flush())
+    os.replace(tmp, dest)
+    return dest
+
+
+def collect(cache_dir: Path, store_dir: Path, map_names: Iterable[str], includes_dir: Path) -> Dict[str, Path]:
+    """
+    {url-relative path (e.g. "maps/cp_x.bsp.bz2"): local .bz2} for the store maps
+    `map_names` plus every downloadable asset under includes/.
+    """
+    files: Dict[str, Path] = {}
+    index = map_store.load_index(store_dir)
+    for name in map_names:
+        sha = index.get(map_store.map_name(name))
+        if sha and map_store.object_path(store_dir, sha).exists():
+            files[f"maps/{map_store.map_name(name)}.bsp.bz2"] = compressed(
+                cache_dir, map_store.object_path(store_dir, sha), sha)
+    for sub in ASSET_DIRS:
+        root = includes_dir / sub
+        if not root.is_dir():
+            continue
+        for path in sorted(root.rglob("*")):
+            if path.is_file() and not path.name.startswith("."):
+                files[f"{path.relative_to(includes_dir).as_posix()}.bz2"] = compressed(cache_dir, path)
+    return files
+
+
+def download_url(ip: str, port: int) -> str:
+    return f"http://{ip}:{port}/"
+
+
+def _serve_command(port: int) -> str:
+    """(Re)start the nginx container if it is not running on `port`; open the port."""
+    running = f"docker ps -q -f name='^{CONTAINER}$' -f label=tf2ctl.fastdl.port={port}"
+    start = (f"docker rm -f {CONTAINER} >/dev/null 2>&1; "
+             f"docker run -d --name {CONTAINER} --restart unless-stopped --label tf2ctl.fastdl.port={port} "
+             f"-p {port}:80 -v {REMOTE_DIR}:/usr/share/nginx/html:ro {IMAGE}")
+    return f"{{ [ -n \"$({running})\" ] || {{ {start}; }}; }} && (ufw allow {port}/tcp >/dev/null 2>&1 || true)"
+
+
+def _tar_file(files: Dict[str, Path]) -> Path:
+    """`files` as a tar in a temp file, streamed from disk like distribute's uploads."""
+    fd, tmp = tempfile.mkstemp(suffix=".tar")
+    with os.fdopen(fd, "wb") as fp, tarfile.open(fileobj=fp, mode="w") as tar:
+        for rel, path in sorted(files.items()):
+            tar.add(str(path), arcname=rel)
+    return Path(tmp)
+
+
+def publish(name: str, ip: str, private_key: str, files: Dict[str, Path], port: int) -> Tuple[bool, int]:
+    """
+    Make sure `ip` serves `files` on `port`: list what it already has, send the rest as
+    one tar stream and (re)start the nginx container. Returns (ok, files_sent).
+    """
+    rc, out, err = SSHOps.run_command(ip, "root", private_key,
+                                      f"mkdir -p {REMOTE_DIR} && cd {REMOTE_DIR} && find . -type f -printf '%P\\0'",
+                                      get_pty=False)
+    if rc != 0:
+        print(f"  [{name}] FastDL: could not list content: {(err or out).strip()[-200:]}")
+        return False, 0
+    # NUL-separated: asset paths may contain spaces
+    have = set(out.split("\0"))
+    missing = {rel: path for rel, path in files.items() if rel not in have}
+    payload = _tar_file(missing)
+    try:
+        with tracing.span("fastdl.publish", server=name, files=len(missing), bytes=payload.stat().st_size) as sp:
+            rc, out = SSHOps.pipe_command(ip, "root", private_key,
+                                          f"tar -xf - -C {shlex.quote(REMOTE_DIR)} && {_serve_command(port)}",
+                                          payload)
+            sp["rc"] = rc
+    finally:
+        payload.unlink()
+    if rc != 0:
+        print(f"  [{name}] FastDL: publish failed (exit {rc}): {out.strip()[-200:]}")
+    return rc == 0, len(missing)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Provisioning history: how each (provider, region, size) did in past creates.
+
+Every create run appends one line per VM it handled to .tf2ctl/history.jsonl:
+
+    {"time": "...Z", "job": "...", "provider": "vultr", "region": "fra", "size": "vc2-2c-4gb",
+     "outcome": "ready", "seconds": 212.4, "state": "ready"}
+
+`outcome` is "ready" (`seconds` is creation -> ready, when the run saw both), "failed"
+(the run ended with the VM short of ready) or "straggler" (cut from an over-provisioned
+batch); `state` is the last state the VM reached. stats() folds the last RECENT outcomes
+of each key into time-to-ready percentiles and failure / straggler rates. rank() orders
+candidates by the expected time to a VM that is ready in time: p50 / the share of creates
+that got there, so a region that fails one create in four pays for the retry, and a
+straggler counts against it like a failure. Keys with fewer than MIN_SAMPLES outcomes are
+not ranked.
+"""
+import json
+from datetime import datetime, UTC
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+MIN_SAMPLES = 3
+RECENT = 50
+OUTCOMES = ("ready", "failed", "straggler")
+
+# (provider, region, size)
+Candidate = Tuple[str, str, str]
+
+
+def key(provider: str, region: str, size: str = "*") -> str:
+    """Stats key; size "*" is the region over every size."""
+    return f"{provider}/{region}/{size}"
+
+
+def append(path: Path, records: List[Dict[str, Any]]):
+    if not records:
+        return
+    stamp = datetime.now(UTC).isoformat(timespec="seconds").replace("+00:00", "Z")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as fp:
+        for record in records:
+            fp.write(json.dumps({"time": stamp, **record}) + "\n")
+
+
+def load(path: Path) -> List[Dict[str, Any]]:
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    out = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except JSONDecodeError:
+            continue
+        if record.get("outcome") in OUTCOMES:
+            out.append(record)
+    return out
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+def stats(records: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    {"provider/region/size": {"runs", "ready", "failed", "stragglers", "p50", "p90",
+    "failure_rate", "straggler_rate", "expected"}}, plus "provider/region/*" over all sizes.
+    p50 / p90 / expected are seconds (None without a timed ready VM).
+    """
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        for size in (record.get("size", ""), "*"):
+            grouped.setdefault(key(record.get("provider", ""), record.get("region", ""), size), []).append(record)
+    out: Dict[str, Dict[str, Any]] = {}
+    for k, recs in sorted(grouped.items()):
+        recs = recs[-RECENT:]
+        counts = {o: sum(1 for r in recs if r["outcome"] == o) for o in OUTCOMES}
+        seconds = sorted(r["seconds"] for r in recs if r["outcome"] == "ready" and r.get("seconds") is not None)
+        p50 = _percentile(seconds, 0.5) if seconds else None
+        made_it = counts["ready"] / len(recs)
+        out[k] = {
+            "runs": len(recs), "ready": counts["ready"], "failed": counts["failed"],
+            "stragglers": counts["straggler"],
+            "p50": round(p50, 1) if p50 is not None else None,
+            "p90": round(_percentile(seconds, 0.9), 1) if seconds else None,
+            "failure_rate": round(counts["failed"] / len(recs), 3),
+            "straggler_rate": round(counts["straggler"] / len(recs), 3),
+            "expected": round(p50 / made_it, 1) if p50 is not None and made_it else None,
+        }
+    return out
+
+
+def lookup(table: Dict[str, Dict[str, Any]], candidate: Candidate, exact: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    History of `candidate` with at least MIN_SAMPLES outcomes: its size's, else (unless
+    `exact`) its region's over all sizes.
+    """
+    for k in (key(*candidate),) if exact else (key(*candidate), key(candidate[0], candidate[1])):
+        st = table.get(k)
+        if st and st["runs"] >= MIN_SAMPLES:
+            return st
+    return None
+
+
+def rank(table: Dict[str, Dict[str, Any]], candidates: List[Candidate],
+         exact: bool = False) -> List[Tuple[Candidate, Optional[Dict[str, Any]]]]:
+    """
+    `candidates` best first: those with history by expected time to ready (then straggler
+    rate), the rest after them in their given order. Pass `exact` when comparing sizes.
+    """
+    known = [(c, lookup(table, c, exact)) for c in candidates]
+    ranked = sorted(((c, st) for c, st in known if st),
+                    key=lambda item: (item[1]["expected"] is None, item[1]["expected"] or 0.0,
+                                      item[1]["straggler_rate"]))
+    return ranked + [(c, st) for c, st in known if st is None]
+
+
+def best(table: Dict[str, Dict[str, Any]], candidates: List[Candidate], exact: bool = False) -> Optional[Candidate]:
+    """The top-ranked candidate that has history and got VMs ready; None when there is none."""
+    for candidate, st in rank(table, candidates, exact):
+        if st and st["expected"] is not None:
+            return candidate
+    return None
+
+
+def describe(st: Optional[Dict[str, Any]]) -> str:
+    if not st:
+        return "no history"
+    expected = f"~{st['expected']:.0f}s to ready" if st["expected"] is not None else "never ready"
+    return (f"{expected}, {st['failure_rate']:.0%} failed, {st['straggler_rate']:.0%} straggled "
+            f"({st['runs']} creates)")
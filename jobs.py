@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Persistent bulk-create jobs.
+
+Each bulk create is written to .tf2ctl/jobs/<job_id>.json before any
+provider call is made, and every server in it advances through a fixed
+state machine:
+
+    requested -> created -> ip -> ssh_ready -> configured -> ready
+
+The file is rewritten (atomically) after every transition, so a crash or
+Ctrl-C loses at most the step that was in flight and `resume` can pick each
+server up at its last completed step. A job split across providers keeps each
+server's provider, region and size under params["placement"]. A dropped server (account limit, or a
+straggler cut from an over-provisioned batch) stays dropped.
+"""
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, UTC
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+STATES = ["requested", "created", "ip", "ssh_ready", "configured", "ready"]
+FINAL_STATE = STATES[-1]
+DROPPED = "dropped"
+
+# Servers of one job may advance from several threads (over-provisioned creates)
+_SAVE_LOCK = threading.Lock()
+
+
+def _now() -> str:
+    return datetime.now(UTC).isoformat().replace("+00:00", "Z")
+
+
+def new_job(jobs_dir: Path, names: List[str], params: Dict[str, Any]) -> Dict[str, Any]:
+    stamp = datetime.now(UTC).strftime("%Y%m%dT%H%M%SZ")
+    job = {
+        "id": f"{stamp}-{uuid.uuid4().hex[:6]}",
+        "created_at": _now(),
+        "updated_at": _now(),
+        "params": dict(params),
+        "order": list(names),
+        "servers": {n: {"state": "requested", "error": "", "updated_at": _now()} for n in names},
+    }
+    save_job(jobs_dir, job)
+    return job
+
+
+def save_job(jobs_dir: Path, job: Dict[str, Any]):
+    jobs_dir.mkdir(parents=True, exist_ok=True)
+    with _SAVE_LOCK:
+        job["updated_at"] = _now()
+        path = jobs_dir / f"{job['id']}.json"
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(job, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+def load_job(jobs_dir: Path, job_id: str) -> Optional[Dict[str, Any]]:
+    path = jobs_dir / f"{job_id}.json"
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, JSONDecodeError) as exc:
+        print(f"(warning) could not read job {job_id}: {exc}")
+        return None
+
+
+def list_jobs(jobs_dir: Path) -> List[Dict[str, Any]]:
+    if not jobs_dir.exists():
+        return []
+    out = []
+    for path in sorted(jobs_dir.glob("*.json")):
+        job = load_job(jobs_dir, path.stem)
+        if job:
+            out.append(job)
+    return out
+
+
+def state_of(job: Dict[str, Any], name: str) -> str:
+    return job["servers"][name]["state"]
+
+
+def params_for(job: Dict[str, Any], name: str) -> Dict[str, Any]:
+    """The job's params for one server, with its own provider/region/size in a split job (params["placement"])."""
+    return {**job["params"], **job["params"].get("placement", {}).get(name, {})}
+
+
+def reached(job: Dict[str, Any], name: str, state: str) -> bool:
+    """True if `name` has completed `state` (or a later one)."""
+    cur = state_of(job, name)
+    return cur in STATES and STATES.index(cur) >= STATES.index(state)
+
+
+def advance(jobs_dir: Path, job: Dict[str, Any], name: str, state: str):
+    entry = job["servers"][name]
+    if entry["state"] == DROPPED:
+        return
+    entry["state"] = state
+    entry["error"] = ""
+    entry["updated_at"] = _now()
+    entry.setdefault("reached_at", {})[state] = entry["updated_at"]
+    save_job(jobs_dir, job)
+
+
+def seconds_between(job: Dict[str, Any], name: str, first: str, last: str) -> Optional[float]:
+    """Seconds from `name` reaching state `first` to reaching `last`; None unless both were recorded."""
+    stamps = job["servers"][name].get("reached_at", {})
+    if first not in stamps or last not in stamps:
+        return None
+    start, end = (datetime.fromisoformat(stamps[s].replace("Z", "+00:00")) for s in (first, last))
+    return max(0.0, (end - start).total_seconds())
+
+
+def fail(jobs_dir: Path, job: Dict[str, Any], name: str, error: str):
+    """Record an error without moving the server; a resume retries the same step."""
+    entry = job["servers"][name]
+    if entry["state"] == DROPPED:
+        return
+    entry["error"] = error
+    entry["updated_at"] = _now()
+    save_job(jobs_dir, job)
+
+
+def drop(jobs_dir: Path, job: Dict[str, Any], name: str, reason: str):
+    """Give up on a server (it never reached the provider, or was deleted as a straggler)."""
+    entry = job["servers"][name]
+    entry["state"] = DROPPED
+    entry["error"] = reason
+    entry["updated_at"] = _now()
+    save_job(jobs_dir, job)
+
+
+def pending(job: Dict[str, Any]) -> List[str]:
+    return [n for n in job["order"] if job["servers"][n]["state"] in STATES[:-1]]
+
+
+def is_finished(job: Dict[str, Any]) -> bool:
+    return not pending(job)
+
+
+def unfinished_jobs(jobs_dir: Path) -> List[Dict[str, Any]]:
+    return [j for j in list_jobs(jobs_dir) if not is_finished(j)]
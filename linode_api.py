@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 # pylint: disable=duplicate-code
+import json
 import time
 import secrets
 import string
 from typing import Dict, Any, List, Optional
 import requests
 
+try:
+    from tf2ctl.tracing import traced
+except ImportError:
+    from tracing import traced
+
 API = "https://api.linode.com/v4"
 
 class LinodeAPIError(Exception):
@@ -35,6 +41,8 @@ class LinodeAPI:
     """
     def __init__(self, token: str):
         self.token = token.strip()
+        # One keep-alive session per client: repeated calls reuse the TLS connection
+        self.session = requests.Session()
 
     def _headers(self) -> Dict[str, str]:
         return {
@@ -68,7 +76,7 @@ class LinodeAPI:
         }
 
     def list_regions(self) -> List[Dict[str, Any]]:
-        r = requests.get(f"{API}/regions", headers=self._headers(), timeout=30)
+        r = self.session.get(f"{API}/regions", headers=self._headers(), timeout=30)
         if not r.ok:
             self._handle_error(r)
         out = []
@@ -76,6 +84,7 @@ class LinodeAPI:
             out.append({"id": reg.get("id"), "label": reg.get("label")})
         return out
 
+    @traced("provider.capacity_remaining", provider="linode")
     def capacity_remaining(self) -> Optional[int]:
         """
         Linode does NOT expose per-account instance limits via API;
@@ -87,18 +96,19 @@ class LinodeAPI:
     # SSH Keys (Profile)
     # --------------------------
     def list_profile_keys(self) -> List[Dict[str, Any]]:
-        r = requests.get(f"{API}/profile/sshkeys", headers=self._headers(), timeout=30)
+        r = self.session.get(f"{API}/profile/sshkeys", headers=self._headers(), timeout=30)
         if not r.ok:
             self._handle_error(r)
         return r.json().get("data", [])
 
+    @traced("provider.ensure_ssh_key", provider="linode")
     def ensure_ssh_key(self, pub_key: str) -> str:
         # Try to find an exact match
         for k in self.list_profile_keys():
             if k.get("ssh_key", "").strip() == pub_key.strip():
                 return str(k.get("id"))
         # Create new
-        r = requests.post(
+        r = self.session.post(
             f"{API}/profile/sshkeys",
             headers=self._headers(),
             json={"label": "tf2ctl", "ssh_key": pub_key},
@@ -116,6 +126,7 @@ class LinodeAPI:
         alphabet = string.ascii_letters + string.digits + "!@#$%^&*()-_=+"
         return "".join(secrets.choice(alphabet) for _ in range(length))
 
+    @traced("provider.create_server", provider="linode")
     def create_server(self, name: str, region: str, size: str, ssh_key_id: str, public_key: str, tags: List[str]) -> Dict[str, Any]:
         """
         Creates a Linode instance with Ubuntu 22.04 image.
@@ -133,11 +144,24 @@ class LinodeAPI:
             "tags": tags or [],
             # network defaults to public; ipv4 assigned automatically
         }
-        r = requests.post(f"{API}/linode/instances", headers=self._headers(), json=payload, timeout=60)
+        r = self.session.post(f"{API}/linode/instances", headers=self._headers(), json=payload, timeout=60)
         if not r.ok:
             self._handle_error(r)
         return r.json()
 
+    def find_server_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """Look up an instance by exact label (used to re-adopt instances after an interrupted create)."""
+        headers = self._headers()
+        headers["X-Filter"] = json.dumps({"label": name})
+        r = self.session.get(f"{API}/linode/instances", headers=headers, timeout=30)
+        if not r.ok:
+            self._handle_error(r)
+        for inst in r.json().get("data", []):
+            if inst.get("label") == name:
+                return {"id": inst.get("id"), "status": inst.get("status", "")}
+        return None
+
+    @traced("provider.wait_for_active_ip", provider="linode")
     def wait_for_active_ip(self, linode_id: int, timeout: int = 900, poll: int = 8) -> Dict[str, Any]:
         """
         Wait until instance is 'running' and an IPv4 address is present.
@@ -145,7 +169,7 @@ class LinodeAPI:
         deadline = time.time() + timeout
         last = {}
         while time.time() < deadline:
-            r = requests.get(f"{API}/linode/instances/{linode_id}", headers=self._headers(), timeout=30)
+            r = self.session.get(f"{API}/linode/instances/{linode_id}", headers=self._headers(), timeout=30)
             if not r.ok:
                 self._handle_error(r)
             data = r.json()
@@ -159,7 +183,8 @@ class LinodeAPI:
             time.sleep(poll)
         return {"ip": "", "last": last}
 
+    @traced("provider.delete_server", provider="linode")
     def delete_server(self, linode_id: int):
-        r = requests.delete(f"{API}/linode/instances/{linode_id}", headers=self._headers(), timeout=60)
+        r = self.session.delete(f"{API}/linode/instances/{linode_id}", headers=self._headers(), timeout=60)
         if r.status_code not in (200, 204, 404):
             self._handle_error(r)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Fleet log collector and local search index.
+
+collect() asks each VM's agent for what its logs gained since the last collection
+(container logs, srcds logs and the setup log, tracked per source by inode + byte
+offset), appends the new text gzip'd to .tf2ctl/logstore/<server>/<source>.log.gz
+and indexes every line in SQLite FTS:
+
+    .tf2ctl/logstore/index.sqlite3
+        offsets(server, source, inode, pos)             where to resume
+        lines  (text, server, source, ts)               full-text index
+
+so a search across the fleet ("which servers logged SV_Netchan in the last hour")
+never touches the servers. Lines carry the time they were logged when the format
+has one (docker, srcds `L mm/dd/yyyy - hh:mm:ss:`), else the time of collection.
+"""
+import gzip
+import re
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime, UTC
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from tf2ctl import agent
+except ImportError:
+    import agent
+
+INDEX_NAME = "index.sqlite3"
+# Read rounds per collect(); a VM with more backlog than this continues next time
+MAX_ROUNDS = 8
+DEFAULT_RETENTION_DAYS = 14
+
+_DOCKER_TS = re.compile(r"^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.\d+)?Z ")
+_SRCDS_TS = re.compile(r"^L (\d\d/\d\d/\d{4} - \d\d:\d\d:\d\d):")
+_AGE = re.compile(r"^(\d+(?:\.\d+)?)\s*([smhd]?)$")
+_AGE_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class LogStoreError(Exception):
+    pass
+
+
+def open_index(store_dir: Path) -> sqlite3.Connection:
+    """Open (creating if needed) the index. FTS5 is used when SQLite has it, else FTS4."""
+    store_dir.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(store_dir / INDEX_NAME)
+    db.execute("CREATE TABLE IF NOT EXISTS offsets (server TEXT, source TEXT, inode INTEGER, "
+               "pos INTEGER, PRIMARY KEY (server, source))")
+    if db.execute("SELECT 1 FROM sqlite_master WHERE name = 'lines'").fetchone() is None:
+        try:
+            db.execute("CREATE VIRTUAL TABLE lines USING fts5(text, server UNINDEXED, source UNINDEXED, "
+                       "ts UNINDEXED)")
+        except sqlite3.OperationalError:
+            db.execute("CREATE VIRTUAL TABLE lines USING fts4(text, server, source, ts, notindexed=server, "
+                       "notindexed=source, notindexed=ts)")
+    db.commit()
+    return db
+
+
+def parse_age(text: str) -> float:
+    """"90s", "30m", "1h", "2d" (or plain seconds) -> seconds."""
+    m = _AGE.match(text.strip().lower())
+    if not m:
+        raise LogStoreError(f"bad duration {text!r} (use e.g. 30m, 1h, 2d)")
+    return float(m.group(1)) * _AGE_UNITS[m.group(2)]
+
+
+def _line_time(source: str, line: str, default: float) -> float:
+    m, fmt = None, ""
+    if source.startswith("container/"):
+        m, fmt = _DOCKER_TS.match(line), "%Y-%m-%dT%H:%M:%S"
+    elif source.startswith("srcds/"):
+        m, fmt = _SRCDS_TS.match(line), "%m/%d/%Y - %H:%M:%S"
+    if m is None:
+        return default
+    try:
+        return datetime.strptime(m.group(1), fmt).replace(tzinfo=UTC).timestamp()
+    except ValueError:
+        return default
+
+
+def _archive_path(store_dir: Path, server: str, source: str) -> Path:
+    return store_dir / server / (source.replace("/", "__") + ".log.gz")
+
+
+def offsets(db: sqlite3.Connection, server: str) -> Dict[str, List[int]]:
+    rows = db.execute("SELECT source, inode, pos FROM offsets WHERE server = ?", (server,))
+    return {source: [inode, offset] for source, inode, offset in rows}
+
+
+def ingest(db: sqlite3.Connection, store_dir: Path, server: str, sources: Dict[str, Any],
+           collected_at: Optional[float] = None) -> Tuple[int, int]:
+    """Store one read_logs reply for `server`; returns (bytes, lines) added."""
+    now = collected_at if collected_at is not None else time.time()
+    added_bytes = added_lines = 0
+    with db:
+        for source, entry in sources.items():
+            text = entry.get("text") or ""
+            if text:
+                path = _archive_path(store_dir, server, source)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                data = text.encode("utf-8")
+                # One gzip member per chunk; `zcat` reads the concatenation as one file
+                with gzip.open(path, "ab") as fp:
+                    fp.write(data)
+                lines = [ln for ln in text.splitlines() if ln.strip()]
+                db.executemany("INSERT INTO lines (text, server, source, ts) VALUES (?, ?, ?, ?)",
+                               [(ln, server, source, _line_time(source, ln, now)) for ln in lines])
+                added_bytes += len(data)
+                added_lines += len(lines)
+            db.execute("INSERT OR REPLACE INTO offsets (server, source, inode, pos) VALUES (?, ?, ?, ?)",
+                       (server, source, int(entry.get("inode") or 0), int(entry.get("offset") or 0)))
+    return added_bytes, added_lines
+
+
+def collect(store_dir: Path, targets: Dict[str, Tuple[str, Dict[str, Any]]], private_key: str,
+            retention_days: float = DEFAULT_RETENTION_DAYS) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch new log bytes from every VM in `targets` ({server: (ip, agent endpoint)}), one
+    agent request per VM per round, in parallel. Returns {server: {"bytes", "lines",
+    "sources", "more"}} or {server: {"error"}}.
+    """
+    out: Dict[str, Dict[str, Any]] = {s: {"bytes": 0, "lines": 0, "sources": 0, "more": False} for s in targets}
+    with closing(open_index(store_dir)) as db:
+        pending = dict(targets)
+        for _ in range(MAX_ROUNDS):
+            if not pending:
+                break
+            replies = agent.fleet({s: (ip, info, {"offsets": offsets(db, s)}) for s, (ip, info) in pending.items()},
+                                  "read_logs", private_key)
+            more = {}
+            for server, reply in replies.items():
+                if isinstance(reply, agent.AgentError):
+                    out[server] = {"error": str(reply)}
+                    continue
+                sources = reply.get("sources") or {}
+                added_bytes, added_lines = ingest(db, store_dir, server, sources)
+                out[server]["bytes"] += added_bytes
+                out[server]["lines"] += added_lines
+                out[server]["sources"] = len(sources)
+                out[server]["more"] = any(e.get("more") for e in sources.values())
+                if out[server]["more"]:
+                    more[server] = pending[server]
+            pending = more
+        prune(db, retention_days)
+    return out
+
+
+def prune(db: sqlite3.Connection, retention_days: float) -> int:
+    """Drop indexed lines older than `retention_days` (the .log.gz archives are kept)."""
+    if retention_days <= 0:
+        return 0
+    with db:
+        cur = db.execute("DELETE FROM lines WHERE ts < ?", (time.time() - retention_days * 86400,))
+    return cur.rowcount
+
+
+def _match_expr(query: str, raw: bool) -> str:
+    # By default the query is one phrase, so "connect failed:" needs no FTS quoting
+    return query if raw else '"' + query.replace('"', '""') + '"'
+
+
+def search(store_dir: Path, query: str, since: Optional[float] = None, servers: Optional[List[str]] = None,
+           limit: int = 100, raw: bool = False) -> Dict[str, Any]:
+    """
+    Lines matching `query` (a phrase, or FTS syntax with raw=True), newest first, logged
+    after the epoch time `since`. Returns {"servers": {server: matches}, "matches": [...]}.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    where = ["lines MATCH ?"]
+    params: List[Any] = [_match_expr(query, raw)]
+    if since is not None:
+        where.append("ts >= ?")
+        params.append(since)
+    if servers:
+        where.append(f"server IN ({', '.join('?' for _ in servers)})")
+        params += servers
+    cond = " AND ".join(where)
+    with closing(open_index(store_dir)) as db:
+        try:
+            counts = db.execute(f"SELECT server, count(*) FROM lines WHERE {cond} GROUP BY server "
+                                "ORDER BY count(*) DESC", params).fetchall()
+            rows = db.execute(f"SELECT server, source, ts, text FROM lines WHERE {cond} ORDER BY ts DESC LIMIT ?",
+                              params + [limit]).fetchall()
+        except sqlite3.OperationalError as exc:
+            raise LogStoreError(f"bad search {query!r}: {exc}") from exc
+    return {
+        "servers": dict(counts),
+        "matches": [{
+            "server": server,
+            "source": source,
+            "time": datetime.fromtimestamp(ts, UTC).isoformat().replace("+00:00", "Z"),
+            "text": text,
+        } for server, source, ts, text in rows],
+    }
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Live log tail across many servers.
+
+Every followed instance gets its own channel running
+
+    docker logs -f --tail N <container> 2>&1 | grep --line-buffered -E <pattern>
+
+so only matching lines cross the network. One reader thread per channel feeds a
+bounded queue, and the caller's thread prints from it with a per-server prefix.
+When output arrives faster than it is printed, readers block, the SSH window
+fills and the servers pause, so memory stays bounded and no line is dropped.
+"""
+import queue
+import shlex
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    from tf2ctl.ssh_ops import SSHOps
+except ImportError:
+    from ssh_ops import SSHOps
+
+# Lines buffered between the readers and the printer
+MAX_QUEUE = 1000
+# Longer lines are cut
+MAX_LINE = 4096
+
+
+def remote_command(container: str, pattern: str = "", ignore_case: bool = False, tail: int = 20) -> str:
+    cmd = f"docker logs -f --tail {max(0, int(tail))} {shlex.quote(container)} 2>&1"
+    if pattern:
+        cmd += f" | grep --line-buffered -E {'-i ' if ignore_case else ''}-- {shlex.quote(pattern)}"
+    return cmd
+
+
+def _put(q: "queue.Queue", item, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def follow(streams: Dict[str, Tuple[str, str]], private_key: str, pattern: str = "", ignore_case: bool = False,
+           tail: int = 20, emit: Callable[[str], None] = print, duration: Optional[float] = None,
+           stop: Optional[threading.Event] = None,
+           on_line: Optional[Callable[[str, str], None]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Follow the container logs of `streams` ({label: (ip, container)}) until every stream
+    ends, `duration` seconds pass, `stop` is set or Ctrl-C. Lines go to emit() as
+    "[label] line", or to on_line(label, line) when given (always on the calling thread).
+    Returns {label: {"lines": n, "error": "..."}}.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    stop = stop or threading.Event()
+    lines: "queue.Queue[Tuple[str, Optional[str]]]" = queue.Queue(maxsize=MAX_QUEUE)
+    stats: Dict[str, Dict[str, Any]] = {label: {"lines": 0, "error": ""} for label in streams}
+    width = max((len(label) for label in streams), default=0)
+
+    def reader(label: str, ip: str, container: str):
+        try:
+            rc = SSHOps.follow_command(ip, "root", private_key, remote_command(container, pattern, ignore_case, tail),
+                                       lambda line: _put(lines, (label, line), stop), stop, MAX_LINE)
+            # grep exits 1 when nothing matched before the stream ended
+            if rc not in (None, 0, 1):
+                stats[label]["error"] = f"exit {rc}"
+        except ConnectionError as exc:
+            stats[label]["error"] = str(exc)
+        finally:
+            _put(lines, (label, None), stop)
+
+    threads = [threading.Thread(target=reader, args=(label, ip, container), daemon=True)
+               for label, (ip, container) in streams.items()]
+    for t in threads:
+        t.start()
+    deadline = time.time() + duration if duration else None
+    alive = len(threads)
+    try:
+        while alive and not stop.is_set() and (deadline is None or time.time() < deadline):
+            try:
+                label, line = lines.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if line is None:
+                alive -= 1
+                error = stats[label]["error"]
+                emit(f"[{label:<{width}}] -- stream ended{': ' + error if error else ''}")
+                continue
+            stats[label]["lines"] += 1
+            if on_line is not None:
+                on_line(label, line)
+            else:
+                emit(f"[{label:<{width}}] {line}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for t in threads:
+            t.join(timeout=5)
+    return stats
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Content-addressed map store on the controller.
+
+    .tf2ctl/maps/
+        objects/<sha256>.bsp   each map's bytes, stored once
+        index.json             {"cp_badlands": "<sha256>", ...}
+        pool.json              {"default": ["cp_badlands"], "hosts": {"tf2-01": [...]}}
+
+The pool manifest names the maps each VM should have (a host without its own
+list gets "default"). At configure time the controller compares a VM's wanted
+maps with the inventory it last reported and ships only the missing hashes
+inside the bootstrap bundle.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+# Seed for the store; setup.sh used to download this on every server
+DEFAULT_MAP = "cp_badlands"
+DEFAULT_MAP_URL = "https://fastdl.fullbuff.gg/tf/maps/cp_badlands.bsp"
+
+# Bundle-relative directory the bootstrap installs maps from
+BUNDLE_MAPS_DIR = "maps"
+
+_CHUNK = 1024 * 1024
+
+
+class MapStoreError(Exception):
+    pass
+
+
+def map_name(value: str) -> str:
+    """'maps/cp_process_final.bsp' -> 'cp_process_final'."""
+    name = Path(value).name
+    return name[:-4] if name.endswith(".bsp") else name
+
+
+def _read_json(path: Path, default: Any) -> Any:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return default
+    except (OSError, JSONDecodeError) as exc:
+        print(f"(warning) could not read {path}: {exc}")
+        return default
+
+
+def _write_json(path: Path, data: Any):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(data, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def object_path(store_dir: Path, sha: str) -> Path:
+    return store_dir / "objects" / f"{sha}.bsp"
+
+
+def load_index(store_dir: Path) -> Dict[str, str]:
+    return _read_json(store_dir / "index.json", {})
+
+
+def load_pool(store_dir: Path) -> Dict[str, Any]:
+    pool = _read_json(store_dir / "pool.json", {})
+    pool.setdefault("default", [DEFAULT_MAP])
+    pool.setdefault("hosts", {})
+    return pool
+
+
+def save_pool(store_dir: Path, pool: Dict[str, Any]):
+    _write_json(store_dir / "pool.json", pool)
+
+
+def resolve(store_dir: Path, name: str) -> Optional[str]:
+    """Hash of map `name` if it is in the store (and its object is present)."""
+    sha = load_index(store_dir).get(map_name(name))
+    if sha and object_path(store_dir, sha).exists():
+        return sha
+    return None
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as fp:
+        for chunk in iter(lambda: fp.read(_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _commit_object(store_dir: Path, tmp: Path, name: str) -> str:
+    sha = _sha256_file(tmp)
+    dest = object_path(store_dir, sha)
+    if dest.exists():
+        tmp.unlink()
+    else:
+        os.replace(tmp, dest)
+    index = load_index(store_dir)
+    index[map_name(name)] = sha
+    _write_json(store_dir / "index.json", index)
+    return sha
+
+
+def add_file(store_dir: Path, path: Path, name: Optional[str] = None) -> str:
+    """Import a local .bsp; returns its hash. Re-importing identical bytes is a no-op."""
+    if not path.is_file():
+        raise MapStoreError(f"not a file: {path}")
+    objects = store_dir / "objects"
+    objects.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=objects, suffix=".part")
+    os.close(fd)
+    shutil.copyfile(path, tmp)
+    return _commit_object(store_dir, Path(tmp), name or path.name)
+
+
+def fetch(store_dir: Path, url: str, name: Optional[str] = None, timeout: int = 60) -> str:
+    """Download a .bsp into the store (streamed to disk); returns its hash."""
+    import requests  # pylint: disable=import-outside-toplevel  # only needed here; slow to import
+    objects = store_dir / "objects"
+    objects.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=objects, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as fp, requests.get(url, stream=True, timeout=timeout) as r:
+            if r.status_code != 200:
+                raise MapStoreError(f"GET {url} -> {r.status_code}")
+            for chunk in r.iter_content(_CHUNK):
+                fp.write(chunk)
+    except requests.RequestException as exc:
+        Path(tmp).unlink(missing_ok=True)
+        raise MapStoreError(f"GET {url} failed: {exc}") from exc
+    except MapStoreError:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return _commit_object(store_dir, Path(tmp), name or url.rsplit("/", 1)[-1])
+
+
+def ensure_default(store_dir: Path) -> Optional[str]:
+    """Seed the store with the default map on first use."""
+    sha = resolve(store_dir, DEFAULT_MAP)
+    if sha:
+        return sha
+    print(f"Seeding map store with {DEFAULT_MAP} from {DEFAULT_MAP_URL} ...")
+    try:
+        return fetch(store_dir, DEFAULT_MAP_URL, DEFAULT_MAP)
+    except MapStoreError as exc:
+        print(f"(warning) could not seed {DEFAULT_MAP}: {exc}")
+        return None
+
+
+def wanted_for(store_dir: Path, host: str, extra: Iterable[str] = ()) -> List[str]:
+    """Map names `host` should have: its pool (or the default pool) plus `extra` (e.g. start maps)."""
+    pool = load_pool(store_dir)
+    names = list(pool["hosts"].get(host, pool["default"]))
+    for n in extra:
+        if map_name(n) not in names:
+            names.append(map_name(n))
+    return names
+
+
+def missing_names(store_dir: Path, wanted: Iterable[str], have: Dict[str, str]) -> List[str]:
+    """
+    Wanted maps whose hash is not in the server's inventory `have` ({name: sha}). Maps
+    that are not in the store (e.g. stock maps shipped with the game) are skipped.
+    """
+    index = load_index(store_dir)
+    present = set(have.values())
+    out: List[str] = []
+    for name in wanted:
+        sha = index.get(map_name(name))
+        if sha and sha not in present and object_path(store_dir, sha).exists() and map_name(name) not in out:
+            out.append(map_name(name))
+    return out
+
+
+def bundle_files(store_dir: Path, names: Iterable[str]) -> Dict[str, bytes]:
+    """Bundle entries maps/<name>.bsp plus maps/SHA256SUMS for store maps `names`."""
+    index = load_index(store_dir)
+    files: Dict[str, bytes] = {}
+    sums: List[str] = []
+    for name in names:
+        sha = index[map_name(name)]
+        files[f"{BUNDLE_MAPS_DIR}/{map_name(name)}.bsp"] = object_path(store_dir, sha).read_bytes()
+        sums.append(f"{sha}  {map_name(name)}.bsp")
+    if files:
+        files[f"{BUNDLE_MAPS_DIR}/SHA256SUMS"] = ("\n".join(sums) + "\n").encode("utf-8")
+    return files
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Streaming parser for srcds match logs.
+
+srcds writes (and, with sv_logecho, echoes to the container's console) lines like
+
+    L 10/18/2026 - 20:15:03: World triggered "Round_Win" (winner "Red")
+    L 10/18/2026 - 20:15:03: "A<12><[U:1:123]><Red>" killed "B<13><[U:1:456]><Blue>" with "scattergun"
+
+A Pipeline is fed those lines one server at a time, keeps a small state model per
+server (map, match running, round, score, players on the server) and emits events
+to its subscribers:
+
+    map_start      new map loaded                        map
+    match_start    first round of a match started        map
+    round_win      a round ended                         winner ("" on a stalemate), round, score
+    match_end      Game_Over, or a map change mid-match  map, reason, rounds, score, kills, duration
+    kill           one player killed another             attacker, victim, weapon, customkill
+    connect        a player connected                    player, steamid
+    disconnect     a player left                         player, steamid, reason
+
+Each event is a dict {"event", "server", "time", ...fields}. Memory per server is
+constant: the state holds at most MAX_PLAYERS players and feed() buffers at most one
+partial line of MAX_LINE characters. A Pipeline is not thread-safe; feed it from one
+thread (logtail.follow calls its line callback from the caller's thread).
+"""
+import calendar
+import gzip
+import re
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+EVENTS = ("map_start", "match_start", "round_win", "match_end", "kill", "connect", "disconnect")
+# What `match-events` shows unless asked otherwise; kills are too chatty for a default
+DEFAULT_EVENTS = ("map_start", "match_start", "round_win", "match_end", "connect", "disconnect")
+
+# srcds' own limit is 101 slots; beyond this the oldest entries are forgotten
+MAX_PLAYERS = 128
+MAX_LINE = 4096
+
+# Server-side filter (logtail / grep -E) that passes only srcds log lines
+LOG_LINE_PATTERN = r"^L [0-9]{2}/[0-9]{2}/[0-9]{4} - "
+
+# "L mm/dd/yyyy - hh:mm:ss: " is always 25 characters
+_PREFIX_LEN = 25
+_STAMP = re.compile(r"^L \d\d/\d\d/\d{4} - \d\d:\d\d:\d\d: ")
+
+
+def _player(p: str) -> str:
+    return rf'"(?P<{p}name>.*?)<(?P<{p}uid>\d+)><(?P<{p}id>[^>]*)><(?P<{p}team>[^>]*)>"'
+
+
+_KILL = re.compile(_player("a") + " killed " + _player("v") +
+                   r' with "(?P<weapon>[^"]*)"(?: \(customkill "(?P<custom>[^"]*)"\))?')
+_CONNECT = re.compile(_player("p") + " connected, address ")
+_DISCONNECT = re.compile(_player("p") + r' disconnected(?: \(reason "(?P<reason>.*)"\))?')
+_JOINED = re.compile(_player("p") + r' joined team "(?P<team>[^"]*)"')
+_TEAM_SCORE = re.compile(r'^Team "(?P<team>Red|Blue)" (?:current|final) score "(?P<score>\d+)"')
+_QUOTED = re.compile(r'"([^"]*)"')
+
+
+class Pipeline:
+    """Per-server match state plus event fan-out; see the module docstring."""
+
+    def __init__(self):
+        self.states: Dict[str, Dict[str, Any]] = {}
+        self._subscribers: List[tuple] = []
+        self._wanted: set = set()
+        self._partial: Dict[str, str] = {}
+        self._days: Dict[str, int] = {}
+
+    def subscribe(self, callback: Callable[[Dict[str, Any]], None], kinds: Optional[Iterable[str]] = None,
+                  servers: Optional[Iterable[str]] = None):
+        """Call `callback(event)` for events of `kinds` (default all) on `servers` (default all)."""
+        kinds = frozenset(kinds or EVENTS)
+        unknown = kinds - set(EVENTS)
+        if unknown:
+            raise ValueError(f"unknown event(s): {', '.join(sorted(unknown))}")
+        self._subscribers.append((callback, kinds, frozenset(servers) if servers else None))
+        self._wanted |= kinds
+
+    def state(self, server: str) -> Dict[str, Any]:
+        st = self.states.get(server)
+        if st is None:
+            st = self.states[server] = {
+                "map": "", "in_match": False, "round": 0, "score": {"Red": 0, "Blue": 0},
+                "kills": 0, "match_started": None, "last_seen": None, "lines": 0, "players": {},
+            }
+        return st
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """JSON-friendly copy of every server's state (players as a count)."""
+        return {server: {**st, "score": dict(st["score"]), "players": len(st["players"]),
+                         "last_seen": self._time(st["last_seen"]) if st["last_seen"] else None}
+                for server, st in self.states.items()}
+
+    def feed(self, server: str, chunk: str):
+        """Feed arbitrary text; a trailing partial line is kept until the next chunk completes it."""
+        text = self._partial.pop(server, "") + chunk
+        lines = text.split("\n")
+        tail = lines.pop()
+        if len(tail) <= MAX_LINE:
+            self._partial[server] = tail
+        for line in lines:
+            self.feed_line(server, line)
+
+    def flush(self, server: str):
+        """The stream ended: parse whatever partial line is left."""
+        rest = self._partial.pop(server, "")
+        if rest:
+            self.feed_line(server, rest)
+
+    def _time(self, line: str) -> float:
+        day = line[2:12]
+        base = self._days.get(day)
+        if base is None:
+            if len(self._days) > 8:
+                self._days.clear()
+            base = self._days[day] = calendar.timegm((int(day[6:10]), int(day[0:2]), int(day[3:5]), 0, 0, 0))
+        return base + int(line[15:17]) * 3600 + int(line[18:20]) * 60 + int(line[21:23])
+
+    def _emit(self, server: str, line: str, kind: str, **fields):
+        event = {"event": kind, "server": server, "time": self._time(line), **fields}
+        for callback, kinds, servers in self._subscribers:
+            if kind in kinds and (servers is None or server in servers):
+                callback(event)
+
+    def feed_line(self, server: str, line: str):
+        """Parse one complete log line (anything that is not an srcds log line is ignored)."""
+        line = line.rstrip("\r\n")
+        if not line.startswith("L ") or not _STAMP.match(line):
+            return
+        st = self.state(server)
+        st["lines"] += 1
+        st["last_seen"] = line[:23]
+        body = line[_PREFIX_LEN:]
+        if body.startswith('"'):
+            self._player_line(server, st, line, body)
+        elif body.startswith('World triggered "'):
+            self._world_line(server, st, line, body)
+        elif body.startswith('Team "'):
+            m = _TEAM_SCORE.match(body)
+            if m:
+                st["score"][m.group("team")] = int(m.group("score"))
+        elif body.startswith('Loading map "'):
+            if st["in_match"]:
+                self._end_match(server, st, line, "map change")
+            m = _QUOTED.search(body)
+            st.update(map=m.group(1) if m else "", round=0, score={"Red": 0, "Blue": 0}, kills=0)
+            if "map_start" in self._wanted:
+                self._emit(server, line, "map_start", map=st["map"])
+
+    def _player_line(self, server: str, st: Dict[str, Any], line: str, body: str):
+        # pylint: disable=too-many-branches
+        if '" killed "' in body:
+            m = _KILL.match(body)
+            if m is None:
+                return
+            if st["in_match"]:
+                st["kills"] += 1
+            if "kill" in self._wanted:
+                self._emit(server, line, "kill", attacker=m.group("aname"), attacker_team=m.group("ateam"),
+                           victim=m.group("vname"), victim_team=m.group("vteam"), weapon=m.group("weapon"),
+                           customkill=m.group("custom") or "")
+        elif '" connected, address "' in body:
+            m = _CONNECT.match(body)
+            if m is None:
+                return
+            players = st["players"]
+            if len(players) >= MAX_PLAYERS:
+                players.pop(next(iter(players)))
+            players[m.group("pid")] = {"name": m.group("pname"), "team": ""}
+            if "connect" in self._wanted:
+                self._emit(server, line, "connect", player=m.group("pname"), steamid=m.group("pid"))
+        elif '" disconnected' in body:
+            m = _DISCONNECT.match(body)
+            if m is None:
+                return
+            st["players"].pop(m.group("pid"), None)
+            if "disconnect" in self._wanted:
+                self._emit(server, line, "disconnect", player=m.group("pname"), steamid=m.group("pid"),
+                           reason=m.group("reason") or "")
+        elif '" joined team "' in body:
+            m = _JOINED.match(body)
+            if m and m.group("pid") in st["players"]:
+                st["players"][m.group("pid")]["team"] = m.group("team")
+
+    def _world_line(self, server: str, st: Dict[str, Any], line: str, body: str):
+        trigger = body[17:body.find('"', 17)]
+        if trigger == "Round_Start":
+            if not st["in_match"]:
+                st.update(in_match=True, round=0, score={"Red": 0, "Blue": 0}, kills=0,
+                          match_started=self._time(line))
+                if "match_start" in self._wanted:
+                    self._emit(server, line, "match_start", map=st["map"])
+        elif trigger in ("Round_Win", "Round_Stalemate"):
+            m = _QUOTED.search(body, 17 + len(trigger) + 1)
+            winner = m.group(1) if m and trigger == "Round_Win" else ""
+            st["round"] += 1
+            if winner in st["score"]:
+                st["score"][winner] += 1
+            if "round_win" in self._wanted:
+                self._emit(server, line, "round_win", winner=winner, round=st["round"], score=dict(st["score"]))
+        elif trigger == "Game_Over":
+            m = _QUOTED.search(body, 17 + len(trigger) + 1)
+            # The final "Team ... final score" lines follow Game_Over; the running score is already right
+            self._end_match(server, st, line, m.group(1) if m else "")
+
+    def _end_match(self, server: str, st: Dict[str, Any], line: str, reason: str):
+        started = st["match_started"]
+        st.update(in_match=False, match_started=None)
+        if "match_end" in self._wanted:
+            self._emit(server, line, "match_end", map=st["map"], reason=reason, rounds=st["round"],
+                       score=dict(st["score"]), kills=st["kills"],
+                       duration=None if started is None else self._time(line) - started)
+
+
+def read_lines(path: Path) -> Iterator[str]:
+    """Lines of a recorded log (a srcds .log, or a logstore .log.gz archive), read incrementally."""
+    if path.suffix == ".gz":
+        with gzip.open(path, "rt", encoding="utf-8", errors="replace") as fp:
+            yield from fp
+    else:
+        with path.open(encoding="utf-8", errors="replace") as fp:
+            yield from fp
+
+
+def describe(event: Dict[str, Any]) -> str:
+    """One human-readable line for an event (the server prefix is up to the caller)."""
+    # pylint: disable=too-many-return-statements
+    kind = event["event"]
+    score = event.get("score") or {}
+    tally = f"Red {score.get('Red', 0)} - {score.get('Blue', 0)} Blue"
+    if kind == "map_start":
+        return f"map {event['map']}"
+    if kind == "match_start":
+        return f"match started on {event['map'] or 'unknown map'}"
+    if kind == "round_win":
+        return f"round {event['round']} won by {event['winner'] or 'nobody (stalemate)'}; {tally}"
+    if kind == "match_end":
+        minutes = "" if event["duration"] is None else f", {event['duration'] / 60:.0f} min"
+        return (f"match ended on {event['map'] or 'unknown map'} ({event['reason'] or 'game over'}): "
+                f"{tally}, {event['rounds']} rounds, {event['kills']} kills{minutes}")
+    if kind == "kill":
+        extra = f" ({event['customkill']})" if event["customkill"] else ""
+        return f"{event['attacker']} killed {event['victim']} with {event['weapon']}{extra}"
+    if kind == "connect":
+        return f"{event['player']} connected ({event['steamid']})"
+    return f"{event['player']} disconnected ({event['reason'] or 'no reason'})"
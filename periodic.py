@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Plumbing shared by the controller's interval loops (watchdog, scaler): run a round
+every so often, keep state in a JSON file replaced atomically, and append each
+decision to a JSONL log.
+"""
+import json
+import threading
+import time
+from datetime import datetime, UTC
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+
+def stamp(t: float) -> str:
+    return datetime.fromtimestamp(t, UTC).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+
+def load_json(path: Path) -> Dict[str, Any]:
+    """The JSON object in `path`; {} when it is missing or unreadable."""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, JSONDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_json(path: Path, data: Any):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(data, indent=2, sort_keys=True), encoding="utf-8")
+    tmp.replace(path)
+
+
+def append_jsonl(path: Path, entry: Dict[str, Any]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as fp:
+        fp.write(json.dumps(entry) + "\n")
+
+
+def tail_jsonl(path: Path, limit: int = 50) -> List[Dict[str, Any]]:
+    """The last `limit` lines of a JSONL log, skipping any that do not parse."""
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    out = []
+    for line in lines[-limit:]:
+        try:
+            out.append(json.loads(line))
+        except JSONDecodeError:
+            continue
+    return out
+
+
+def run(round_fn: Callable[[], Any], interval: float, stop: Optional[threading.Event] = None,
+        rounds: Optional[int] = None, clock: Callable[[], float] = time.time):
+    """
+    round_fn() every `interval` seconds (start to start) until `stop` is set, `rounds`
+    ran, or Ctrl-C. Returns right after the last round instead of waiting out its interval.
+    """
+    stop = stop or threading.Event()
+    done = 0
+    try:
+        while not stop.is_set() and (rounds is None or done < rounds):
+            started = clock()
+            round_fn()
+            done += 1
+            if rounds is not None and done >= rounds:
+                break
+            stop.wait(max(0.0, interval - (clock() - started)))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Split one bulk create across several providers.
+
+Each candidate provider gets a share of the batch in proportion to how fast it
+provisions (1 / its expected seconds to a ready VM, which the caller takes from
+history.stats), capped by the servers its account can still create. A provider with
+no history counts as the median of the ones that have some (all weigh the same when
+none has). Shares are whole servers (largest remainder); what
+a capped provider cannot take goes to the others.
+
+    split(10, {"digitalocean": {"capacity": 3, "seconds": 240},
+               "linode": {"capacity": None, "seconds": 360},
+               "vultr": {"capacity": 8, "seconds": None}})
+    -> {"digitalocean": 3, "linode": 4, "vultr": 3}
+"""
+import math
+from typing import Any, Dict
+
+
+def split(count: int, candidates: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    """
+    {provider: servers} for `count` servers over `candidates` ({provider: {"capacity": int
+    or None for unknown, "seconds": typical seconds to ready or None}}). Adds up to less
+    than `count` only when the capacities do.
+    """
+    known = sorted(c["seconds"] for c in candidates.values() if c.get("seconds"))
+    fallback = known[len(known) // 2] if known else 1.0
+    weight = {p: 1.0 / (c.get("seconds") or fallback) for p, c in candidates.items()}
+    room = {p: count if c.get("capacity") is None else max(0, int(c["capacity"])) for p, c in candidates.items()}
+    shares = {p: 0 for p in candidates}
+    left = count
+    while left > 0:
+        open_ = [p for p in candidates if shares[p] < room[p]]
+        if not open_:
+            break
+        total = sum(weight[p] for p in open_)
+        ideal = {p: left * weight[p] / total for p in open_}
+        give = {p: min(room[p] - shares[p], math.floor(ideal[p])) for p in open_}
+        rest = left - sum(give.values())
+        for p in sorted(open_, key=lambda p: (math.floor(ideal[p]) - ideal[p], p)):
+            if rest > 0 and shares[p] + give[p] < room[p]:
+                give[p] += 1
+                rest -= 1
+        for p, n in give.items():
+            shares[p] += n
+        left -= sum(give.values())
+    return shares
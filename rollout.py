@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Rolling TF2 image updates across the fleet.
+
+    1. pre-pull   the new image is pulled on every VM at once while the old
+                  containers keep serving (the first VM resolves the tag to a
+                  digest, the rest pull that exact digest)
+    2. waves      VMs are swapped `wave_size` at a time; a VM with human
+                  players on any instance (A2S_INFO) is skipped
+    3. gate       every swapped instance that answered A2S before the swap
+                  must answer again within `ready_timeout`
+    4. rollback   a VM that fails its swap or gate is put back on the image it
+                  ran before, and no further waves are started
+
+The swap itself is a callable supplied by the caller (the CLI re-runs the
+bootstrap with the new pin; setup.sh's container phase is keyed on the image
+id, so only the containers are recreated).
+"""
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    from tf2ctl.ssh_ops import SSHOps
+    from tf2ctl import a2s
+    from tf2ctl import tracing
+except ImportError:
+    from ssh_ops import SSHOps
+    import a2s
+    import tracing
+
+MAX_PARALLEL = 16
+
+# (name, ip) of one VM and (ip, game port) of one instance
+Node = Tuple[str, str]
+Endpoint = Tuple[str, int]
+
+UPDATED = "updated"
+CURRENT = "current"
+SKIPPED = "skipped"
+PULL_FAILED = "pull-failed"
+ROLLED_BACK = "rolled-back"
+FAILED = "failed"
+NOT_REACHED = "not-reached"
+
+
+def _pull_command(ref: str) -> str:
+    q = shlex.quote(ref)
+    return (f"docker pull -q {q} >/dev/null && "
+            f"docker image inspect --format '{{{{.Id}}}} {{{{if .RepoDigests}}}}{{{{index .RepoDigests 0}}}}{{{{end}}}}' {q}")
+
+
+def _pull(node: Node, ref: str, private_key: str) -> Tuple[str, str, str]:
+    """Pull `ref` on one VM; returns (image id, repo digest, error)."""
+    with tracing.span("rollout.prepull", server=node[0]) as sp:
+        try:
+            rc, out, err = SSHOps.run_command(node[1], "root", private_key, _pull_command(ref), get_pty=False)
+        except OSError as exc:
+            # One unreachable VM is recorded as its pull error, not raised out of the whole prepull
+            sp["ok"] = False
+            return "", "", f"unreachable: {exc}"
+        sp["rc"] = rc
+        sp["ok"] = rc == 0
+    fields = out.split()
+    if rc != 0 or not fields:
+        return "", "", (err or out).strip()[-200:] or f"exit {rc}"
+    return fields[0], fields[1] if len(fields) > 1 else "", ""
+
+
+def prepull(nodes: List[Node], ref: str, private_key: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    Pull `ref` on every node. Returns (pin, {name: error}) where pin is
+    {"ref": <repo@sha256:...>, "id": <image id>}, or {} when the first pull failed.
+    """
+    if not nodes:
+        return {}, {}
+    image_id, digest, error = _pull(nodes[0], ref, private_key)
+    if error:
+        return {}, {nodes[0][0]: error}
+    pin = {"ref": digest or ref, "id": image_id}
+    errors: Dict[str, str] = {}
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as pool:
+        results = list(pool.map(lambda n: _pull(n, pin["ref"], private_key), nodes[1:]))
+    for node, (got_id, _, err) in zip(nodes[1:], results):
+        if err or got_id != image_id:
+            errors[node[0]] = err or f"pulled {got_id[:19]}, expected {image_id[:19]}"
+    return pin, errors
+
+
+def waves(hosts: List[str], size: int) -> List[List[str]]:
+    size = max(1, size)
+    return [hosts[i:i + size] for i in range(0, len(hosts), size)]
+
+
+def wait_ready(endpoints: List[Endpoint], timeout: float, poll: float = 5.0) -> List[Endpoint]:
+    """Poll A2S until every endpoint answers; returns the ones that never did."""
+    deadline = time.time() + timeout
+    pending = list(endpoints)
+    while pending:
+        pending = [ep for ep in pending if a2s.try_info(*ep) is None]
+        if not pending or time.time() >= deadline:
+            break
+        time.sleep(poll)
+    return pending
+
+
+def _roll_host(host: str, endpoints: List[Endpoint], swap: Callable[[str, Dict[str, str]], bool],
+               new_pin: Dict[str, str], old_pin: Dict[str, str], ready_timeout: float,
+               skip_busy: bool) -> Tuple[str, str]:
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    with tracing.tags(server=host):
+        before = {ep: a2s.try_info(*ep) for ep in endpoints}
+        players = sum(a2s.humans(r) for r in before.values())
+        if skip_busy and players:
+            return SKIPPED, f"{players} player(s) online"
+
+        with tracing.span("rollout.swap") as sp:
+            ok = swap(host, new_pin)
+            sp["ok"] = ok
+        why = "" if ok else "swap failed"
+        if ok:
+            # Instances that did not answer before the swap are covered by the bootstrap's container check
+            with tracing.span("rollout.gate") as sp:
+                silent = wait_ready([ep for ep, r in before.items() if r is not None], ready_timeout)
+                sp["ok"] = not silent
+            if silent:
+                why = "no A2S reply from " + ", ".join(f"{ip}:{port}" for ip, port in silent)
+        if not why:
+            return UPDATED, ""
+
+        if not old_pin.get("id"):
+            return FAILED, f"{why}; no previous image recorded to roll back to"
+        with tracing.span("rollout.rollback") as sp:
+            back = swap(host, old_pin)
+            sp["ok"] = back
+        return (ROLLED_BACK, why) if back else (FAILED, f"{why}; rollback failed")
+
+
+def roll(hosts: List[str], endpoints: Dict[str, List[Endpoint]], swap: Callable[[str, Dict[str, str]], bool],
+         new_pin: Dict[str, str], old_pins: Dict[str, Dict[str, str]], wave_size: int = 1,
+         ready_timeout: float = 300, skip_busy: bool = True) -> Dict[str, Tuple[str, str]]:
+    """
+    Swap `hosts` to `new_pin` in waves. `old_pins` is each host's current image
+    ({"ref", "id"}), used to skip hosts already on the new image and to roll back.
+    Returns {host: (status, detail)}.
+    """
+    # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+    status: Dict[str, Tuple[str, str]] = {}
+    todo = []
+    for h in hosts:
+        if old_pins.get(h, {}).get("id") == new_pin["id"]:
+            status[h] = (CURRENT, "")
+        else:
+            todo.append(h)
+    plan = waves(todo, wave_size)
+    halted: Optional[int] = None
+    for i, wave in enumerate(plan, 1):
+        if halted is not None:
+            status.update({h: (NOT_REACHED, f"wave {halted} failed") for h in wave})
+            continue
+        print(f"\nWave {i}/{len(plan)}: {', '.join(wave)}")
+        with tracing.span("rollout.wave", wave=i, servers=len(wave)):
+            with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as pool:
+                results = list(pool.map(
+                    lambda h: _roll_host(h, endpoints.get(h, []), swap, new_pin, old_pins.get(h, {}),
+                                         ready_timeout, skip_busy), wave))
+        for h, (st, detail) in zip(wave, results):
+            status[h] = (st, detail)
+            print(f"  {h}: {st}{' (' + detail + ')' if detail else ''}")
+            if st in (ROLLED_BACK, FAILED):
+                halted = i
+    if halted is not None:
+        print(f"\nRollout stopped after wave {halted}.")
+    return status
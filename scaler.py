@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Schedule-driven fleet scaling.
+
+A schedule is a list of windows, each asking for a number of servers (VMs) per region:
+
+    {"name": "evenings", "days": "mon-fri", "start": "18:00", "end": "23:30", "tz": "Europe/Berlin",
+     "regions": {"fra1": 6, "ams3": 2}, "size": "medium", "per_vm": 2}
+
+`days` (names, ranges like "fri-sun", or a list) and `tz` (default UTC) are optional;
+a window whose end is not after its start runs past midnight. At any moment a region's
+target is the largest count of its windows that are open or start within `lead`
+seconds, and never less than its `minimum`.
+
+Every round the scaler
+  * probes every instance with A2S (a2s.info_many) and notes when each VM became empty
+    (no human players on any of its instances; a VM that does not answer keeps its state)
+  * provisions what a region is short through the caller's create path, reviving
+    draining VMs first
+  * drains surplus managed VMs that have been empty for `idle` seconds: a draining VM
+    is deleted on a later round, at least DRAIN_SECONDS on, if it is still empty and
+    still surplus; a player joining in between cancels the drain
+
+Only managed VMs (the caller decides which; the CLI uses a name prefix) are ever
+deleted, but every VM in a region counts towards its target. Each decision is appended
+to .tf2ctl/scaler/decisions.jsonl and the idle/drain state kept in .tf2ctl/scaler/state.json:
+
+    {"time": "...Z", "region": "fra1", "vm": "auto-fra1-03", "decision": "drain", "reason": "..."}
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+try:
+    from tf2ctl import a2s
+    from tf2ctl import periodic
+except ImportError:
+    import a2s
+    import periodic
+
+DEFAULT_INTERVAL = 60
+DEFAULT_IDLE_MINUTES = 30
+DEFAULT_LEAD_MINUTES = 15
+# A draining VM must still be empty this long after the drain started before it is deleted
+DRAIN_SECONDS = 120
+# After a failed provision, the region is left alone this long
+PROVISION_RETRY = 600
+A2S_TIMEOUT = 3.0
+
+STATE_NAME = "state.json"
+DECISIONS_NAME = "decisions.jsonl"
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+# {vm: {"region": str, "managed": bool, "endpoints": [(ip, game port), ...]}}
+Inventory = Callable[[], Dict[str, Dict[str, Any]]]
+# [(ip, port), ...] -> {(ip, port): A2S info or None}
+Prober = Callable[[List[Tuple[str, int]]], Dict[Tuple[str, int], Optional[Dict[str, Any]]]]
+# (region, VMs to add, window) -> (names of the VMs that became ready, detail)
+Provision = Callable[[str, int, Dict[str, Any]], Tuple[List[str], str]]
+# vm -> (ok, detail)
+Retire = Callable[[str], Tuple[bool, str]]
+
+
+class ScheduleError(ValueError):
+    """The schedule (or minimum) in the config is malformed."""
+
+
+def _clock_time(value: str, where: str) -> Tuple[int, int]:
+    try:
+        hh, mm = (int(p) for p in str(value).split(":"))
+    except ValueError as exc:
+        raise ScheduleError(f"{where}: expected HH:MM, got {value!r}") from exc
+    if not (0 <= hh <= 24 and 0 <= mm < 60) or (hh == 24 and mm):
+        raise ScheduleError(f"{where}: {value!r} is not a time of day")
+    return hh, mm
+
+
+def _days(spec: Any, where: str) -> frozenset:
+    """Weekday numbers (Monday 0) for "mon-fri", "sat,sun", ["mon", "wed"], or None/"" (every day)."""
+    if not spec:
+        return frozenset(range(7))
+    parts = spec if isinstance(spec, list) else str(spec).split(",")
+    out = set()
+    for part in parts:
+        first, _, last = str(part).strip().lower().partition("-")
+        try:
+            a, b = DAYS.index(first[:3]), DAYS.index((last or first)[:3])
+        except ValueError as exc:
+            raise ScheduleError(f"{where}: unknown day in {part!r}") from exc
+        out.update(range(a, b + 1) if a <= b else [*range(a, 7), *range(0, b + 1)])
+    return frozenset(out)
+
+
+def parse_schedule(windows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Validated copies of the config's windows (times, days and time zone resolved). Raises ScheduleError."""
+    out = []
+    for i, w in enumerate(windows or []):
+        where = f"window {w.get('name') or i + 1}" if isinstance(w, dict) else f"window {i + 1}"
+        if not isinstance(w, dict) or not isinstance(w.get("regions"), dict) or not w["regions"]:
+            raise ScheduleError(f"{where}: needs a \"regions\" object of region -> server count")
+        try:
+            regions = {str(r): int(n) for r, n in w["regions"].items()}
+        except (TypeError, ValueError) as exc:
+            raise ScheduleError(f"{where}: server counts must be whole numbers") from exc
+        try:
+            zone = ZoneInfo(w.get("tz") or "UTC")
+        except (ZoneInfoNotFoundError, ValueError) as exc:
+            raise ScheduleError(f"{where}: unknown time zone {w.get('tz')!r}") from exc
+        if any(n < 0 for n in regions.values()):
+            raise ScheduleError(f"{where}: server counts cannot be negative")
+        out.append({**w, "name": w.get("name") or f"window-{i + 1}", "regions": regions, "zone": zone,
+                    "_start": _clock_time(w.get("start", ""), where), "_end": _clock_time(w.get("end", ""), where),
+                    "_days": _days(w.get("days"), where)})
+    return out
+
+
+def _window_open(w: Dict[str, Any], now: float, lead: float) -> bool:
+    """True when `now` falls in [start - lead, end) of an occurrence of window `w`."""
+    local = datetime.fromtimestamp(now, w["zone"])
+    for back in (-1, 0, 1):
+        day = (local + timedelta(days=back)).date()
+        if day.weekday() not in w["_days"]:
+            continue
+        start = datetime(day.year, day.month, day.day, tzinfo=w["zone"]) + timedelta(hours=w["_start"][0],
+                                                                                      minutes=w["_start"][1])
+        end = datetime(day.year, day.month, day.day, tzinfo=w["zone"]) + timedelta(hours=w["_end"][0],
+                                                                                    minutes=w["_end"][1])
+        if end <= start:
+            end += timedelta(days=1)
+        if start.timestamp() - lead <= now < end.timestamp():
+            return True
+    return False
+
+
+def targets(schedule: List[Dict[str, Any]], minimum: Dict[str, int], now: float,
+            lead: float) -> Dict[str, Tuple[int, Optional[Dict[str, Any]]]]:
+    """{region: (servers wanted, the window asking for them or None when it is the minimum)}."""
+    out: Dict[str, Tuple[int, Optional[Dict[str, Any]]]] = {r: (int(n), None) for r, n in minimum.items()}
+    for w in schedule:
+        if not _window_open(w, now, lead):
+            continue
+        for region, count in w["regions"].items():
+            if count > out.get(region, (0, None))[0]:
+                out[region] = (count, w)
+    return out
+
+
+def load_state(state_dir: Path) -> Dict[str, Any]:
+    state = periodic.load_json(state_dir / STATE_NAME)
+    state.setdefault("vms", {})
+    state.setdefault("targets", {})
+    state.setdefault("retry_after", {})
+    return state
+
+
+def recent_decisions(state_dir: Path, limit: int = 50) -> List[Dict[str, Any]]:
+    return periodic.tail_jsonl(state_dir / DECISIONS_NAME, limit)
+
+
+def _new_vm() -> Dict[str, Any]:
+    return {"region": "", "players": None, "empty_since": None, "draining_since": None}
+
+
+class Scaler:
+    """One instance per running scaler; call run_round() on an interval (or run())."""
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, state_dir: Path, schedule: List[Dict[str, Any]], minimum: Dict[str, int], idle: float,
+                 lead: float, inventory: Inventory, probe: Prober, provision: Provision, retire: Retire,
+                 dry_run: bool = False, clock: Callable[[], float] = time.time):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.state_dir = state_dir
+        self.schedule = schedule
+        self.minimum = {str(r): max(0, int(n)) for r, n in (minimum or {}).items()}
+        self.idle = idle
+        self.lead = lead
+        self.inventory = inventory
+        self.probe = probe
+        self.provision = provision
+        self.retire = retire
+        self.dry_run = dry_run
+        self.clock = clock
+        self.rounds = 0
+        self.state = load_state(state_dir)
+
+    def _log(self, now: float, region: str, decision: str, vm: str = "", **fields):
+        entry = {"time": periodic.stamp(now), "region": region, "vm": vm, "decision": decision, **fields}
+        if self.dry_run:
+            entry["dry_run"] = True
+        print(f"[scaler] {region}{'/' + vm if vm else ''}: {decision} "
+              + " ".join(f"{k}={v}" for k, v in fields.items()))
+        periodic.append_jsonl(self.state_dir / DECISIONS_NAME, entry)
+
+    def _save(self):
+        periodic.save_json(self.state_dir / STATE_NAME, self.state)
+
+    def _observe(self, now: float, fleet: Dict[str, Dict[str, Any]]):
+        """Probe every instance and update each VM's empty_since."""
+        vms = self.state["vms"]
+        for gone in set(vms) - set(fleet):
+            del vms[gone]
+        endpoints = [tuple(ep) for vm in fleet.values() for ep in vm["endpoints"]]
+        replies = self.probe(endpoints) if endpoints else {}
+        for name, vm in sorted(fleet.items()):
+            st = vms.setdefault(name, _new_vm())
+            st["region"] = vm["region"]
+            answers = [replies.get(tuple(ep)) for ep in vm["endpoints"]]
+            if not answers or any(a is None for a in answers):
+                continue  # not (fully) up, or not answering: no evidence either way
+            players = sum(a2s.humans(a) for a in answers)
+            st["players"] = players
+            if players:
+                if st["draining_since"] is not None:
+                    self._log(now, vm["region"], "drain_cancelled", name, reason=f"{players} player(s) joined")
+                    st["draining_since"] = None
+                st["empty_since"] = None
+            elif st["empty_since"] is None:
+                st["empty_since"] = now
+
+    def _scale_region(self, now: float, region: str, want: int, window: Optional[Dict[str, Any]],
+                      members: List[str], fleet: Dict[str, Dict[str, Any]]):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+        vms = self.state["vms"]
+        draining = [n for n in members if vms.get(n, {}).get("draining_since") is not None]
+        serving = len(members) - len(draining)
+        why = f"window {window['name']}" if window else "minimum" if want else "no window open"
+        if serving < want:
+            for name in sorted(draining)[:want - serving]:
+                vms[name]["draining_since"] = None
+                serving += 1
+                self._log(now, region, "drain_cancelled", name, reason=f"needed again: target {want} ({why})")
+        if serving < want:
+            self._grow(now, region, want - serving, want, window, why)
+            return
+        surplus = serving - want
+        # Drains that went through: delete when still empty and still surplus
+        for name in sorted(draining):
+            st = vms[name]
+            if now - st["draining_since"] < DRAIN_SECONDS or st["empty_since"] is None:
+                continue
+            self._log(now, region, "delete", name, reason=f"empty since {periodic.stamp(st['empty_since'])}, drained")
+            ok, detail = (True, "dry run") if self.dry_run else self.retire(name)
+            self._log(self.clock(), region, "deleted" if ok else "delete_failed", name, detail=detail[-300:])
+            if ok and not self.dry_run:
+                vms.pop(name, None)
+        if surplus <= 0:
+            return
+        idle = sorted((n for n in members if fleet[n]["managed"] and n not in draining
+                       and vms.get(n, {}).get("empty_since") is not None
+                       and now - vms[n]["empty_since"] >= self.idle),
+                      key=lambda n: vms[n]["empty_since"])
+        for name in idle[:surplus]:
+            vms[name]["draining_since"] = now
+            minutes = (now - vms[name]["empty_since"]) / 60
+            self._log(now, region, "drain", name, reason=f"empty for {minutes:.0f} min; {serving} serving, "
+                                                          f"target {want} ({why})")
+            serving -= 1
+
+    def _grow(self, now: float, region: str, missing: int, want: int, window: Optional[Dict[str, Any]], why: str):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        retry = self.state["retry_after"].get(region, 0)
+        if now < retry:
+            return
+        self._log(now, region, "provision", count=missing, reason=f"target {want} ({why})")
+        if self.dry_run:
+            return
+        ready, detail = self.provision(region, missing, window or {})
+        done = self.clock()
+        if len(ready) < missing:
+            self.state["retry_after"][region] = done + PROVISION_RETRY
+        for name in ready:
+            # Fresh servers get a full idle period before they can be drained
+            self.state["vms"][name] = {**_new_vm(), "region": region}
+        self._log(done, region, "provisioned" if len(ready) == missing else "provision_failed",
+                  servers=ready, detail=detail[-300:], seconds=round(done - now, 1))
+
+    def run_round(self) -> Dict[str, Any]:
+        """Probe, then provision / drain / delete towards the current targets; returns the state."""
+        now = self.clock()
+        fleet = self.inventory()
+        self._observe(now, fleet)
+        self.rounds += 1
+        wanted = targets(self.schedule, self.minimum, now, self.lead)
+        by_region: Dict[str, List[str]] = {}
+        for name, vm in fleet.items():
+            by_region.setdefault(vm["region"], []).append(name)
+        for region in sorted(set(wanted) | set(by_region)):
+            want, window = wanted.get(region, (0, None))
+            if self.state["targets"].get(region) != want:
+                self._log(now, region, "target", count=want, previous=self.state["targets"].get(region),
+                          reason=f"window {window['name']}" if window else
+                          "minimum" if want else "no window open")
+                self.state["targets"][region] = want
+            self._scale_region(now, region, want, window, sorted(by_region.get(region, [])), fleet)
+        self._save()
+        return self.state
+
+    def run(self, interval: float = DEFAULT_INTERVAL, stop: Optional[threading.Event] = None,
+            rounds: Optional[int] = None):
+        """run_round() every `interval` seconds until `stop` is set, `rounds` ran, or Ctrl-C."""
+        periodic.run(self.run_round, interval, stop, rounds, self.clock)
+
+
+def summary(state: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-friendly view of the state (times as ISO strings)."""
+    now = time.time()
+    vms = {}
+    for name, st in sorted(state["vms"].items()):
+        vms[name] = {
+            "region": st.get("region", ""), "players": st["players"],
+            "empty_since": periodic.stamp(st["empty_since"]) if st["empty_since"] else None,
+            "draining_since": periodic.stamp(st["draining_since"]) if st["draining_since"] else None,
+        }
+    return {"targets": dict(sorted(state["targets"].items())), "servers": vms,
+            "retry_after": {r: periodic.stamp(t) for r, t in state["retry_after"].items() if t > now}}
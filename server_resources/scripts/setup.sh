@@ -2,6 +2,30 @@
 # TF2 Tournament Server Setup Script
 # This script configures a complete TF2 server using Melkor's container
 # Run after basic system setup (Docker, user creation) is complete
+#
+# Setup is split into named phases. Each phase stores a hash of its inputs under
+# /var/local/tf2ctl/; on a re-run only phases whose inputs changed execute again
+# (e.g. a hostname change only recreates the container). Set FORCE_PHASES to
+# "all" or a space-separated list of phase names to re-run them regardless.
+#
+# A VM can host several srcds instances: the controller renders one copy of this
+# script per instance (CONTAINER_NAME + its allocated ports). Host-wide phases are
+# shared; per-instance phases keep their markers under the container name.
+#
+# TUNING_PROFILE=performance opts the host into the tuning phase (CPU governor,
+# UDP socket buffers, apt deferred while srcds runs, ufw logging off) and each
+# container into CPU pinning and a raised scheduling priority. "off" reverts the
+# host-wide settings. What was applied is written to $STATE_DIR/tuning-<container>.json.
+#
+# TF2_IMAGE_ID pins the exact image (its config digest, which survives docker
+# save/load). It comes from a local archive (TF2_IMAGE_ARCHIVE, a zstd'd
+# `docker save` relayed from a seed server) when present, otherwise from a pull
+# of TF2_IMAGE. The image actually used is written to $STATE_DIR/image.json.
+#
+# The agent phase runs tf2ctl_agent.py (installed by the bootstrap) as a systemd
+# service on 127.0.0.1:$AGENT_PORT. The controller talks to it through its SSH
+# connection for status, logs, restarts and include copies; its token and port are
+# written to $STATE_DIR/agent.json and reported back by the bootstrap.
 
 set -e
 LOG_FILE="/var/log/tf2-setup.log"
@@ -9,28 +33,43 @@ exec > >(tee -a $LOG_FILE) 2>&1
 
 echo "=== TF2 Server Setup Started at $(date) ==="
 
+# Phase markers: tf2ctl parses these from the setup log for per-phase timing
+phase_begin() { echo "__TF2CTL_PHASE__ $1 begin $(date +%s.%N)"; }
+phase_end() { echo "__TF2CTL_PHASE__ $1 end $(date +%s.%N)"; }
+
+STATE_DIR="/var/local/tf2ctl"
+mkdir -p "$STATE_DIR"
+RAN_PHASES=""
+
+# run_phase NAME INPUTS_FN PHASE_FN [SCOPE]
+# Runs PHASE_FN unless the hash of INPUTS_FN's output matches the stored marker.
+# The marker is written from the inputs as observed *after* the phase, so state the
+# phase itself creates (a pulled image, a new container id) does not force a re-run.
+# SCOPE (an instance's container name) keeps per-instance markers apart.
+run_phase() {
+    local name="$1" inputs_fn="$2" phase_fn="$3" scope="${4:-}"
+    local marker="$STATE_DIR/${scope:+$scope.}$name.hash" want
+    want=$("$inputs_fn" | sha256sum | cut -d' ' -f1)
+    if [ -f "$marker" ] && [ "$(cat "$marker")" = "$want" ] \
+       && [ "$FORCE_PHASES" != "all" ] && [[ " $FORCE_PHASES " != *" $name "* ]]; then
+        echo "Phase $name: inputs unchanged, skipping"
+        return 0
+    fi
+    phase_begin "$name"
+    "$phase_fn"
+    phase_end "$name"
+    "$inputs_fn" | sha256sum | cut -d' ' -f1 > "$marker"
+    RAN_PHASES="$RAN_PHASES $name"
+}
+
+phase_ran() { [[ " $RAN_PHASES " == *" $1 "* ]]; }
+
 # Check if running as root
 if [[ $EUID -ne 0 ]]; then
    echo "This script must be run as root"
    exit 1
 fi
 
-# Verify Docker is available
-if ! command -v docker &> /dev/null; then
-    echo "ERROR: Docker is not installed"
-    curl -fsSL https://get.docker.com -o get-docker.sh
-    sh ./get-docker.sh
-fi
-
-# Verify tf2server user exists
-if ! id "tf2server" &>/dev/null; then
-    echo "ERROR: tf2server user does not exist"
-    # make user with home directory
-    useradd -m tf2server
-fi
-
-echo "Prerequisites verified - Docker and tf2server user are ready"
-
 # =============================================================================
 # CONFIGURATION VARIABLES (replaced by TF2 Manager)
 # =============================================================================
@@ -42,6 +81,38 @@ STV_PASSWORD="STV_PASSWORD_REPLACE"
 START_MAP="START_MAP_REPLACE"
 DEMOS_TF_APIKEY="DEMOS_TF_APIKEY_REPLACE"
 LOGS_TF_APIKEY="LOGS_TF_APIKEY_REPLACE"
+FORCE_PHASES="FORCE_PHASES_REPLACE"
+CONTAINER_NAME="CONTAINER_NAME_REPLACE"
+GAME_PORT="GAME_PORT_REPLACE"
+STV_PORT="STV_PORT_REPLACE"
+CLIENT_PORT="CLIENT_PORT_REPLACE"
+STEAM_PORT="STEAM_PORT_REPLACE"
+INSTANCE_INDEX="INSTANCE_INDEX_REPLACE"
+INSTANCE_COUNT="INSTANCE_COUNT_REPLACE"
+TUNING_PROFILE="TUNING_PROFILE_REPLACE"
+FASTDL_URL="FASTDL_URL_REPLACE"
+TF2_IMAGE="TF2_IMAGE_REPLACE"
+TF2_IMAGE_ID="TF2_IMAGE_ID_REPLACE"
+TF2_IMAGE_ARCHIVE="TF2_IMAGE_ARCHIVE_REPLACE"
+
+
+# Placeholders left untouched by an older controller fall back to single-instance defaults
+default_if_unset() { case "$1" in *_REPLACE) echo "$2" ;; *) echo "$1" ;; esac; }
+FORCE_PHASES=$(default_if_unset "$FORCE_PHASES" "")
+CONTAINER_NAME=$(default_if_unset "$CONTAINER_NAME" "tf2")
+GAME_PORT=$(default_if_unset "$GAME_PORT" "27015")
+STV_PORT=$(default_if_unset "$STV_PORT" "27020")
+CLIENT_PORT=$(default_if_unset "$CLIENT_PORT" "27005")
+STEAM_PORT=$(default_if_unset "$STEAM_PORT" "26900")
+INSTANCE_INDEX=$(default_if_unset "$INSTANCE_INDEX" "0")
+INSTANCE_COUNT=$(default_if_unset "$INSTANCE_COUNT" "1")
+TUNING_PROFILE=$(default_if_unset "$TUNING_PROFILE" "off")
+FASTDL_URL=$(default_if_unset "$FASTDL_URL" "")
+TF2_IMAGE=$(default_if_unset "$TF2_IMAGE" "ghcr.io/melkortf/tf2-competitive:latest")
+TF2_IMAGE_ID=$(default_if_unset "$TF2_IMAGE_ID" "")
+TF2_IMAGE_ARCHIVE=$(default_if_unset "$TF2_IMAGE_ARCHIVE" "")
+# Containers run from the pinned image id when there is one, so a moved tag cannot change them
+RUN_IMAGE="${TF2_IMAGE_ID:-$TF2_IMAGE}"
 
 echo "=== Server Configuration ==="
 echo "SERVER_HOSTNAME: ${SERVER_HOSTNAME}"
@@ -51,39 +122,313 @@ echo "STV_PASSWORD: ${STV_PASSWORD}"
 echo "RCON_PASSWORD: [REDACTED]"
 echo "DEMOS_TF_APIKEY: $([ -n "$DEMOS_TF_APIKEY" ] && echo '[SET]' || echo '[EMPTY]')"
 echo "LOGS_TF_APIKEY: $([ -n "$LOGS_TF_APIKEY" ] && echo '[SET]' || echo '[EMPTY]')"
+echo "FORCE_PHASES: ${FORCE_PHASES:-none}"
+echo "CONTAINER: $CONTAINER_NAME (game $GAME_PORT, stv $STV_PORT, client $CLIENT_PORT, steam $STEAM_PORT)"
+echo "INSTANCE: $((INSTANCE_INDEX + 1)) of $INSTANCE_COUNT, tuning profile: $TUNING_PROFILE"
+echo "FASTDL_URL: ${FASTDL_URL:-none}"
+echo "TF2_IMAGE: $TF2_IMAGE (pinned id: ${TF2_IMAGE_ID:-none}${TF2_IMAGE_ARCHIVE:+, from archive})"
 echo "=============================="
 
+# =============================================================================
+# PREREQUISITES
+# =============================================================================
+prereqs_inputs() {
+    echo "v2"
+    command -v docker || true
+    command -v zstd || true
+    id -u tf2server 2>/dev/null || true
+}
+
+prereqs_phase() {
+    # Verify Docker is available
+    if ! command -v docker &> /dev/null; then
+        echo "ERROR: Docker is not installed"
+        curl -fsSL https://get.docker.com -o get-docker.sh
+        sh ./get-docker.sh
+    fi
+
+    # Verify tf2server user exists
+    if ! id "tf2server" &>/dev/null; then
+        echo "ERROR: tf2server user does not exist"
+        # make user with home directory
+        useradd -m tf2server
+    fi
+
+    # zstd unpacks (and on seed servers, packs) relayed image archives
+    if ! command -v zstd &> /dev/null; then
+        apt-get update -q && apt-get install -y -q zstd
+    fi
+
+    echo "Prerequisites verified - Docker and tf2server user are ready"
+}
+
+run_phase prereqs prereqs_inputs prereqs_phase
+
 # =============================================================================
 # DIRECTORY STRUCTURE SETUP
 # =============================================================================
-echo "Setting up TF2 server directory structure..."
-mkdir -p /home/tf2server/tf2-server/{cfg,maps,addons,logs}
-mkdir -p /home/tf2server/tf2-server/addons/{sourcemod/plugins,sourcemod/configs,sourcemod/data,metamod}
+directories_inputs() {
+    echo "v1"
+    for d in cfg maps addons logs addons/sourcemod/plugins addons/sourcemod/configs addons/sourcemod/data addons/metamod; do
+        [ -d "/home/tf2server/tf2-server/$d" ] && echo "$d"
+    done
+    true
+}
+
+directories_phase() {
+    echo "Setting up TF2 server directory structure..."
+    mkdir -p /home/tf2server/tf2-server/{cfg,maps,addons,logs}
+    mkdir -p /home/tf2server/tf2-server/addons/{sourcemod/plugins,sourcemod/configs,sourcemod/data,metamod}
 
-# Set proper ownership
-chown -R tf2server:tf2server /home/tf2server/tf2-server
-chmod -R 755 /home/tf2server/tf2-server
+    # Set proper ownership
+    chown -R tf2server:tf2server /home/tf2server/tf2-server
+    chmod -R 755 /home/tf2server/tf2-server
 
-echo "Directory structure created"
+    echo "Directory structure created"
+}
+
+run_phase directories directories_inputs directories_phase
 
 # =============================================================================
 # FIREWALL CONFIGURATION
 # =============================================================================
-echo "Configuring firewall for TF2..."
-ufw --force enable
-ufw allow ssh
-ufw allow 27015/udp  # TF2 game port (UDP primary)
-ufw allow 27015/tcp  # TF2 game port (TCP for queries)
-ufw allow 27020/udp  # SourceTV port
-ufw reload
+firewall_inputs() {
+    echo "v1 $GAME_PORT/udp $GAME_PORT/tcp $STV_PORT/udp"
+    ufw status 2>/dev/null | head -1 || true
+}
+
+firewall_phase() {
+    echo "Configuring firewall for TF2 instance $CONTAINER_NAME..."
+    ufw --force enable
+    ufw allow ssh
+    ufw allow "$GAME_PORT/udp"  # TF2 game port (UDP primary)
+    ufw allow "$GAME_PORT/tcp"  # TF2 game port (TCP for queries)
+    ufw allow "$STV_PORT/udp"   # SourceTV port
+    ufw reload
+
+    echo "Firewall configured"
+}
 
-echo "Firewall configured"
+run_phase firewall firewall_inputs firewall_phase "$CONTAINER_NAME"
+
+# =============================================================================
+# HOST TUNING (TUNING_PROFILE=performance)
+# =============================================================================
+SYSCTL_FILE="/etc/sysctl.d/90-tf2ctl.conf"
+APT_DROPIN="tf2ctl-defer.conf"
+UDP_RMEM_MAX=16777216
+UDP_WMEM_MAX=16777216
+TUNING_NICE=-10
+TUNING_CPU_SHARES=4096
+PRIORITY_SRC="/usr/local/lib/tf2ctl/priority.sh"
+PRIORITY_UNIT="/etc/systemd/system/tf2ctl-priority.service"
+
+current_governor() {
+    cat /sys/devices/system/cpu/cpu0/cpufreq/scaling_governor 2>/dev/null || echo "unavailable"
+}
+
+# Pin each instance to its own block of cores. With spare cores, cpu0 is left to the
+# host (interrupts, sshd, dockerd); with fewer cores than instances they share round-robin.
+tuning_cpuset() {
+    local n per first
+    n=$(nproc)
+    if [ "$n" -gt "$INSTANCE_COUNT" ]; then
+        per=$(( (n - 1) / INSTANCE_COUNT ))
+        first=$(( 1 + INSTANCE_INDEX * per ))
+        if [ "$per" -eq 1 ]; then echo "$first"; else echo "$first-$(( first + per - 1 ))"; fi
+    else
+        echo "$(( INSTANCE_INDEX % n ))"
+    fi
+}
+
+host_tuning_inputs() {
+    echo "v2 $TUNING_PROFILE"
+    # A reboot resets the governor; re-apply when it drifted
+    current_governor
+    [ -f "$SYSCTL_FILE" ] && echo sysctl
+    systemctl is-active tf2ctl-priority 2>/dev/null || true
+    true
+}
+
+host_tuning_phase() {
+    local dropin_dir
+    if [ "$TUNING_PROFILE" = "performance" ]; then
+        echo "Applying host performance tuning..."
+        for gov in /sys/devices/system/cpu/cpu*/cpufreq/scaling_governor; do
+            [ -f "$gov" ] || continue
+            if grep -qw performance "$(dirname "$gov")/scaling_available_governors" 2>/dev/null; then
+                echo performance > "$gov" || true
+            fi
+        done
+        echo "CPU governor: $(current_governor)"
+
+        cat > "$SYSCTL_FILE" <<SYSCTL
+# Written by tf2ctl (TUNING_PROFILE=performance)
+net.core.rmem_max = $UDP_RMEM_MAX
+net.core.wmem_max = $UDP_WMEM_MAX
+net.core.rmem_default = 1048576
+net.core.wmem_default = 1048576
+net.core.netdev_max_backlog = 5000
+SYSCTL
+        sysctl -q -p "$SYSCTL_FILE"
+
+        # apt timers still fire, but the jobs skip while any srcds container is up
+        for unit in apt-daily.service apt-daily-upgrade.service; do
+            dropin_dir="/etc/systemd/system/$unit.d"
+            mkdir -p "$dropin_dir"
+            cat > "$dropin_dir/$APT_DROPIN" <<DROPIN
+[Service]
+ExecCondition=/bin/sh -c '! docker ps -q --filter label=tf2ctl.instance | grep -q .'
+DROPIN
+        done
+        systemctl daemon-reload
+        systemctl stop unattended-upgrades.service 2>/dev/null || true
+
+        ufw logging off || true
+
+        # Docker has no nice option: renice each labelled container whenever it starts
+        # (restart policy, agent restarts, reboots), not just when this script runs
+        mkdir -p "$(dirname "$PRIORITY_SRC")"
+        cat > "$PRIORITY_SRC" <<'PRIORITY'
+#!/bin/bash
+docker events --filter event=start --filter label=tf2ctl.nice \
+    --format '{{.Actor.ID}} {{index .Actor.Attributes "tf2ctl.nice"}}' |
+while read -r id nice; do
+    for pid in $(docker top "$id" -eo pid 2>/dev/null | tail -n +2); do
+        renice -n "$nice" -p "$pid" >/dev/null 2>&1 || true
+    done
+done
+PRIORITY
+        chmod 755 "$PRIORITY_SRC"
+        cat > "$PRIORITY_UNIT" <<UNIT
+[Unit]
+Description=tf2ctl container priority (renice on container start)
+After=docker.service
+Requires=docker.service
+
+[Service]
+ExecStart=$PRIORITY_SRC
+Restart=always
+RestartSec=2
+
+[Install]
+WantedBy=multi-user.target
+UNIT
+        systemctl daemon-reload
+        systemctl enable tf2ctl-priority >/dev/null 2>&1 || true
+        systemctl restart tf2ctl-priority || true
+    else
+        echo "Tuning profile off; reverting host tuning (if any)..."
+        if [ -f "$SYSCTL_FILE" ]; then
+            rm -f "$SYSCTL_FILE"
+            sysctl -q --system || true
+        fi
+        rm -f /etc/systemd/system/apt-daily.service.d/$APT_DROPIN \
+              /etc/systemd/system/apt-daily-upgrade.service.d/$APT_DROPIN
+        systemctl disable --now tf2ctl-priority >/dev/null 2>&1 || true
+        rm -f "$PRIORITY_UNIT" "$PRIORITY_SRC"
+        systemctl daemon-reload
+        systemctl start unattended-upgrades.service 2>/dev/null || true
+        ufw logging low || true
+    fi
+}
+
+run_phase host_tuning host_tuning_inputs host_tuning_phase
+
+TUNING_RUN_ARGS=()
+if [ "$TUNING_PROFILE" = "performance" ]; then
+    TUNING_CPUSET=$(tuning_cpuset)
+    TUNING_RUN_ARGS=(--cpuset-cpus "$TUNING_CPUSET" --cpu-shares "$TUNING_CPU_SHARES"
+                     --label "tf2ctl.nice=$TUNING_NICE")
+fi
+
+# tf2ctl-priority renices each start from now on; this covers a container that was
+# already running before the hook was installed
+apply_priority() {
+    local pid
+    for pid in $(docker top "$CONTAINER_NAME" -eo pid 2>/dev/null | tail -n +2); do
+        renice -n "$TUNING_NICE" -p "$pid" >/dev/null 2>&1 || true
+    done
+}
+
+write_tuning_record() {
+    local f="$STATE_DIR/tuning-$CONTAINER_NAME.json"
+    if [ "$TUNING_PROFILE" != "performance" ]; then
+        printf '{"profile": "off"}\n' > "$f"
+        return 0
+    fi
+    printf '{"profile": "%s", "governor": "%s", "cpuset": "%s", "cpu_shares": %s, "nice": %s, "udp_rmem_max": %s, "udp_wmem_max": %s, "apt_deferred": %s, "ufw_logging": "%s", "applied_at": "%s"}\n' \
+        "$TUNING_PROFILE" "$(current_governor)" "$TUNING_CPUSET" "$TUNING_CPU_SHARES" "$TUNING_NICE" \
+        "$(sysctl -n net.core.rmem_max)" "$(sysctl -n net.core.wmem_max)" \
+        "$([ -f /etc/systemd/system/apt-daily.service.d/$APT_DROPIN ] && echo true || echo false)" \
+        "$(ufw status verbose 2>/dev/null | sed -n 's/^Logging: //p' | head -1)" \
+        "$(date -u +%Y-%m-%dT%H:%M:%SZ)" > "$f"
+}
+
+# =============================================================================
+# AGENT (structured requests from the controller, see tf2ctl_agent.py)
+# =============================================================================
+AGENT_SRC="/usr/local/lib/tf2ctl/agent.py"
+AGENT_PORT=27099  # loopback only; outside every instance's port block
+AGENT_TOKEN_FILE="$STATE_DIR/agent.token"
+AGENT_UNIT="/etc/systemd/system/tf2ctl-agent.service"
+
+agent_inputs() {
+    echo "v1 $AGENT_PORT"
+    sha256sum "$AGENT_SRC" 2>/dev/null || true
+    command -v python3 || true
+    # A crashed or disabled agent is restarted on the next configure
+    systemctl is-active tf2ctl-agent 2>/dev/null || true
+}
+
+agent_phase() {
+    if [ ! -f "$AGENT_SRC" ]; then
+        echo "No agent in this bundle; skipping"
+        return 0
+    fi
+    if ! command -v python3 &> /dev/null; then
+        apt-get update -q && apt-get install -y -q python3-minimal
+    fi
+    if [ ! -s "$AGENT_TOKEN_FILE" ]; then
+        (umask 077; head -c 32 /dev/urandom | sha256sum | cut -d' ' -f1 > "$AGENT_TOKEN_FILE")
+    fi
+    cat > "$AGENT_UNIT" <<UNIT
+[Unit]
+Description=tf2ctl agent (controller requests over SSH)
+After=docker.service
+Wants=docker.service
+
+[Service]
+ExecStart=/usr/bin/env python3 $AGENT_SRC --port $AGENT_PORT --token-file $AGENT_TOKEN_FILE
+Restart=always
+RestartSec=2
+
+[Install]
+WantedBy=multi-user.target
+UNIT
+    systemctl daemon-reload
+    systemctl enable tf2ctl-agent >/dev/null 2>&1 || true
+    if systemctl restart tf2ctl-agent; then
+        (umask 077; printf '{"port": %s, "token": "%s"}\n' "$AGENT_PORT" "$(cat "$AGENT_TOKEN_FILE")" \
+            > "$STATE_DIR/agent.json")
+        echo "Agent listening on 127.0.0.1:$AGENT_PORT"
+    else
+        # The controller falls back to plain SSH commands without it
+        echo "WARN: tf2ctl-agent did not start"
+        rm -f "$STATE_DIR/agent.json"
+    fi
+}
+
+run_phase agent agent_inputs agent_phase
 
 # =============================================================================
 # CUSTOM REMOTE FILE DOWNLOADS
 # =============================================================================
 # This section is for users who want to download additional files from remote sources
 # Examples: custom maps, plugins, configs from GitHub, fastDL, etc.
+# Wrap downloads in a phase (see run_phase above) so re-runs skip them.
+# Maps are better kept in the controller's map store (.tf2ctl/maps/): the bootstrap
+# installs the ones this server is missing before this script runs.
 #
 # EXAMPLE - Uncomment and modify as needed:
 #
@@ -106,108 +451,194 @@ echo "Custom downloads section (modify script to add custom downloads)"
 # =============================================================================
 echo "Setting up TF2 container..."
 
-# Download Badlands as default
-cd /home/tf2server/tf2-server/maps
-wget -q https://fastdl.fullbuff.gg/tf/maps/cp_badlands.bsp
+# Maps (including the start map) were installed from the controller's map store
+if [ ! -f "/home/tf2server/tf2-server/maps/${START_MAP}.bsp" ]; then
+    echo "Note: ${START_MAP}.bsp is not in the maps volume; assuming it ships with the game."
+fi
 
-# Pre-pull the container image
-echo "Pulling TF2 server container image..."
-docker pull ghcr.io/melkortf/tf2-competitive:latest
+# Get the container image: pinned and already present, from a relayed archive, or pulled
+docker_pull_inputs() {
+    echo "$TF2_IMAGE $TF2_IMAGE_ID"
+    docker image inspect --format '{{.Id}}' "$RUN_IMAGE" 2>/dev/null || true
+}
 
-echo "Starting TF2 server container..."
-echo "Server: ${SERVER_HOSTNAME}"
-echo "Map: ${START_MAP}"
+docker_pull_phase() {
+    if [ -n "$TF2_IMAGE_ID" ] && docker image inspect "$TF2_IMAGE_ID" >/dev/null 2>&1; then
+        echo "Pinned image $TF2_IMAGE_ID already present"
+    elif [ -n "$TF2_IMAGE_ARCHIVE" ] && [ -f "$TF2_IMAGE_ARCHIVE" ]; then
+        echo "Loading TF2 server image from $TF2_IMAGE_ARCHIVE..."
+        zstd -dc "$TF2_IMAGE_ARCHIVE" | docker load
+        rm -f "$TF2_IMAGE_ARCHIVE"
+    else
+        echo "Pulling TF2 server container image..."
+        docker pull "$TF2_IMAGE"
+    fi
+    if ! docker image inspect "$RUN_IMAGE" >/dev/null 2>&1; then
+        echo "ERROR: image $RUN_IMAGE is not available after pull/load (pinned digest mismatch?)"
+        exit 1
+    fi
+}
 
-# Stop and remove existing container if it exists
-if [ "$(docker ps -aq -f name=tf2)" ]; then
-    echo "Stopping existing TF2 container..."
-    docker stop tf2 2>/dev/null || true
-    docker rm tf2 2>/dev/null || true
+run_phase docker_pull docker_pull_inputs docker_pull_phase
+
+# Record the image this host runs (id + registry digest) for the controller's registry
+printf '{"ref": "%s", "id": "%s", "repo_digest": "%s"}\n' "$TF2_IMAGE" \
+    "$(docker image inspect --format '{{.Id}}' "$RUN_IMAGE")" \
+    "$(docker image inspect --format '{{if .RepoDigests}}{{index .RepoDigests 0}}{{end}}' "$RUN_IMAGE")" \
+    > "$STATE_DIR/image.json"
+
+# Everything the container is created from; any change recreates it
+container_inputs() {
+    echo "v2 ${TUNING_RUN_ARGS[*]}"
+    docker image inspect --format '{{.Id}}' "$RUN_IMAGE" 2>/dev/null || true
+    printf '%s\n' "$SERVER_HOSTNAME" "$RCON_PASSWORD" "$SERVER_PASSWORD" "$STV_PASSWORD" \
+        "$START_MAP" "$DEMOS_TF_APIKEY" "$LOGS_TF_APIKEY" \
+        "$GAME_PORT" "$STV_PORT" "$CLIENT_PORT" "$STEAM_PORT"
+    docker inspect --format '{{.Id}}' "$CONTAINER_NAME" 2>/dev/null || true
+}
+
+container_phase() {
+    echo "Starting TF2 server container..."
+    echo "Server: ${SERVER_HOSTNAME}"
+    echo "Map: ${START_MAP}"
+
+    # Stop and remove existing container if it exists
+    if [ "$(docker ps -aq -f name="^${CONTAINER_NAME}\$")" ]; then
+        echo "Stopping existing TF2 container $CONTAINER_NAME..."
+        docker stop "$CONTAINER_NAME" 2>/dev/null || true
+        docker rm "$CONTAINER_NAME" 2>/dev/null || true
+    fi
+
+    # Start the TF2 server container with hybrid approach (env vars + command line args)
+    echo "Launching TF2 server container..."
+    docker run -d \
+        --name "$CONTAINER_NAME" \
+        --restart unless-stopped \
+        --label "tf2ctl.instance=$CONTAINER_NAME" \
+        "${TUNING_RUN_ARGS[@]}" \
+        -p "$GAME_PORT:$GAME_PORT/udp" \
+        -p "$GAME_PORT:$GAME_PORT/tcp" \
+        -p "$STV_PORT:$STV_PORT/udp" \
+        -v /home/tf2server/tf2-server/maps:/home/tf2/server/tf/maps \
+        -e "PORT=$GAME_PORT" \
+        -e "CLIENT_PORT=$CLIENT_PORT" \
+        -e "STV_PORT=$STV_PORT" \
+        -e "STEAM_PORT=$STEAM_PORT" \
+        -e "RCON_PASSWORD=${RCON_PASSWORD}" \
+        -e "SERVER_HOSTNAME=${SERVER_HOSTNAME}" \
+        -e "SERVER_PASSWORD=${SERVER_PASSWORD}" \
+        -e "STV_NAME=${SERVER_HOSTNAME} TV" \
+        -e "STV_PASSWORD=${STV_PASSWORD}" \
+        -e "DEMOS_TF_APIKEY=${DEMOS_TF_APIKEY}" \
+        -e "LOGS_TF_APIKEY=${LOGS_TF_APIKEY}" \
+        -e "ENABLE_FAKE_IP=1" \
+        "$RUN_IMAGE" \
+        -port "$GAME_PORT" \
+        +clientport "$CLIENT_PORT" \
+        +tv_port "$STV_PORT" \
+        +map "${START_MAP}" \
+        +rcon_password "${RCON_PASSWORD}" \
+        +hostname "${SERVER_HOSTNAME}" \
+        +sv_password "${SERVER_PASSWORD}" \
+        +tv_name "${SERVER_HOSTNAME} TV" \
+        +tv_password "${STV_PASSWORD}" \
+        +sm_demostf_apikey "${DEMOS_TF_APIKEY}" \
+        +logstf_apikey "${LOGS_TF_APIKEY}"
+
+    # Wait for container to start
+    echo "Waiting for container to start..."
+    sleep 15
+
+    # Verify container is running
+    if [ "$(docker ps -q -f name="^${CONTAINER_NAME}\$")" ]; then
+        echo "✅ TF2 server container $CONTAINER_NAME started successfully!"
+    else
+        echo "❌ Failed to start TF2 server container $CONTAINER_NAME"
+        echo "Container logs:"
+        docker logs "$CONTAINER_NAME" 2>/dev/null || echo "No logs available"
+        exit 1
+    fi
+}
+
+run_phase container container_inputs container_phase "$CONTAINER_NAME"
+
+# A container that was stopped out-of-band is started again even when unchanged
+if [ -z "$(docker ps -q -f name="^${CONTAINER_NAME}\$")" ]; then
+    echo "Container $CONTAINER_NAME is not running; starting it..."
+    docker start "$CONTAINER_NAME"
 fi
 
-# Start the TF2 server container with hybrid approach (env vars + command line args)
-echo "Launching TF2 server container..."
-docker run -d \
-    --name tf2 \
-    --restart unless-stopped \
-    -p 27015:27015/udp \
-    -p 27015:27015/tcp \
-    -p 27020:27020/udp \
-    -v /home/tf2server/tf2-server/maps:/home/tf2/server/tf/maps \
-    -e "RCON_PASSWORD=${RCON_PASSWORD}" \
-    -e "SERVER_HOSTNAME=${SERVER_HOSTNAME}" \
-    -e "SERVER_PASSWORD=${SERVER_PASSWORD}" \
-    -e "STV_NAME=${SERVER_HOSTNAME} TV" \
-    -e "STV_PASSWORD=${STV_PASSWORD}" \
-    -e "DEMOS_TF_APIKEY=${DEMOS_TF_APIKEY}" \
-    -e "LOGS_TF_APIKEY=${LOGS_TF_APIKEY}" \
-    -e "ENABLE_FAKE_IP=1" \
-    ghcr.io/melkortf/tf2-competitive:latest \
-    +map "${START_MAP}" \
-    +rcon_password "${RCON_PASSWORD}" \
-    +hostname "${SERVER_HOSTNAME}" \
-    +sv_password "${SERVER_PASSWORD}" \
-    +tv_name "${SERVER_HOSTNAME} TV" \
-    +tv_password "${STV_PASSWORD}" \
-    +sm_demostf_apikey "${DEMOS_TF_APIKEY}" \
-    +logstf_apikey "${LOGS_TF_APIKEY}"
-
-# Wait for container to start
-echo "Waiting for container to start..."
-sleep 15
-
-# Verify container is running
-if [ "$(docker ps -q -f name=tf2)" ]; then
-    echo "✅ TF2 server container started successfully!"
-
-    # Get server IP
-    SERVER_IP=$(curl -s ifconfig.me 2>/dev/null || echo "unknown")
-
-    echo ""
-    echo "=== CONNECTION INFORMATION ==="
-    echo "Game Server: connect ${SERVER_IP}:27015"
-    if [ -n "${SERVER_PASSWORD}" ]; then
-        echo "Game Password: ${SERVER_PASSWORD}"
-    fi
-    echo "SourceTV: connect ${SERVER_IP}:27020"
-    echo "SourceTV Password: ${STV_PASSWORD}"
-    echo "RCON: rcon_address ${SERVER_IP}:27015"
-    echo "RCON Password: ${RCON_PASSWORD}"
-    echo "=============================="
-    echo ""
-else
-    echo "❌ Failed to start TF2 server container"
-    echo "Container logs:"
-    docker logs tf2 2>/dev/null || echo "No logs available"
-    exit 1
+# Get server IP
+SERVER_IP=$(curl -s ifconfig.me 2>/dev/null || echo "unknown")
+
+echo ""
+echo "=== CONNECTION INFORMATION ==="
+echo "Game Server: connect ${SERVER_IP}:$GAME_PORT"
+if [ -n "${SERVER_PASSWORD}" ]; then
+    echo "Game Password: ${SERVER_PASSWORD}"
 fi
+echo "SourceTV: connect ${SERVER_IP}:$STV_PORT"
+echo "SourceTV Password: ${STV_PASSWORD}"
+echo "RCON: rcon_address ${SERVER_IP}:$GAME_PORT"
+echo "RCON Password: ${RCON_PASSWORD}"
+echo "=============================="
+echo ""
 
-# Set final permissions
-echo "Setting final permissions..."
-chown -R tf2server:tf2server /home/tf2server/tf2-server
+# Set final permissions (only needed when directories or the container changed)
+if phase_ran directories || phase_ran container; then
+    echo "Setting final permissions..."
+    chown -R tf2server:tf2server /home/tf2server/tf2-server
+fi
 
 # Create init-done marker for tf2ctl wait logic
 mkdir -p /var/local
 date -u > /var/local/tf2ctl-init-done
 
 # TF2CTL_POSTCOPY
-bash /root/tf2-copy.sh || true
+# Re-copy includes when their content changed or the container was recreated
+includes_copy_inputs() {
+    echo "v2 $FASTDL_URL"
+    if [ -d /root/tf2-includes ]; then
+        # tf2-copy.sh renames server.cfg to tf2ctl.cfg in place; hash both spellings alike
+        (cd /root/tf2-includes && find . -type f -exec sha256sum {} + | sed 's#/server\.cfg$#/tf2ctl.cfg#' | sort -u)
+    fi
+    docker inspect --format '{{.Id}}' "$CONTAINER_NAME" 2>/dev/null || true
+}
+
+includes_copy_phase() {
+    bash /root/tf2-copy.sh "$CONTAINER_NAME" || true
+    # FastDL: point clients at the bz2 mirror (tf2-copy.sh may have just replaced tf2ctl.cfg)
+    docker exec -e "FASTDL_URL=$FASTDL_URL" "$CONTAINER_NAME" bash -lc '
+        CFG=/home/tf2/server/tf/cfg/tf2ctl.cfg
+        touch "$CFG"
+        sed -i "/^sv_downloadurl /d; /^sv_allowdownload /d" "$CFG"
+        if [ -n "$FASTDL_URL" ]; then
+            printf "sv_allowdownload 1\nsv_downloadurl \"%s\"\n" "$FASTDL_URL" >> "$CFG"
+        fi' || true
+}
+
+run_phase includes_copy includes_copy_inputs includes_copy_phase "$CONTAINER_NAME"
 
 # Create completion marker for the Python application
 touch /tmp/tf2-setup-complete
 
-# Final container restart
-echo "Restarting TF2 server container..."
-docker restart tf2
+# Final container restart, so srcds picks up freshly copied configs
+if phase_ran includes_copy; then
+    phase_begin container_restart
+    echo "Restarting TF2 server container $CONTAINER_NAME..."
+    docker restart "$CONTAINER_NAME"
+    phase_end container_restart
+fi
+
+if [ "$TUNING_PROFILE" = "performance" ]; then
+    apply_priority
+fi
+write_tuning_record
 
 echo ""
 echo "=== TF2 Server Setup Completed Successfully at $(date) ==="
 echo ""
-echo "Setup Summary:"
-echo "✅ Directory structure created"
-echo "✅ Firewall configured (ports 27015, 27020)"
-echo "✅ TF2 container image pulled"
-echo "✅ TF2 server container started"
+echo "Phases executed this run:${RAN_PHASES:- none (everything up to date)}"
 echo ""
 echo "The server is ready! Custom configs will be uploaded by TF2 Manager."
 echo "=== Setup Complete ==="
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+tf2ctl agent: runs on every VM next to the srcds containers (setup.sh installs it as
+the tf2ctl-agent systemd service) and answers structured requests from the controller.
+
+It listens on 127.0.0.1 only. The controller reaches it through a direct-tcpip channel
+of its SSH connection, and every request must carry the token setup.sh wrote to
+--token-file (reported to the controller by the bootstrap).
+
+Protocol: JSON lines, any number of requests per connection.
+    request  {"token": "...", "op": "<op>", "args": {...}}
+    reply    {"ok": true, "result": ...}  or  {"ok": false, "error": "..."}
+
+Ops: ping, status, logs, restart, apply_includes, hashes, read_logs, demos. Standard library
+only, so it runs on the distribution's python3.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import socketserver
+import subprocess
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+AGENT_VERSION = 3
+STATE_DIR = "/var/local/tf2ctl"
+COPY_SCRIPT = "/root/tf2-copy.sh"
+# Directories `hashes` may report on, by the name the controller asks for
+HASH_ROOTS = {
+    "includes": "/root/tf2-includes",
+    "maps": "/home/tf2server/tf2-server/maps",
+}
+MAX_LOG_LINES = 5000
+OUTPUT_TAIL = 4000
+# read_logs sources besides each container's docker log: setup.sh's log and srcds' own
+# logs, read through /proc/<pid>/root so nothing has to be exec'd in the container
+SETUP_LOG = "/var/log/tf2-setup.log"
+SRCDS_LOG_DIR = "home/tf2/server/tf/logs"
+MAX_READ = 4 * 1024 * 1024
+# SourceTV demos: tf/*.dem and tf/demos/**/*.dem inside each container; a demo written to
+# in the last RECORDING_GRACE seconds is still being recorded
+SRCDS_GAME_DIR = "home/tf2/server/tf"
+DEMO_SUBDIR = "demos"
+RECORDING_GRACE = 60
+
+
+class AgentError(Exception):
+    pass
+
+
+def _run(cmd: List[str], timeout: float = 120) -> Tuple[int, str]:
+    """(rc, combined output) of a command; rc 124 on timeout."""
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout, check=False)
+    except subprocess.TimeoutExpired:
+        return 124, f"timed out after {timeout:.0f}s"
+    except OSError as exc:
+        return 127, str(exc)
+    return proc.returncode, proc.stdout.decode("utf-8", "replace")
+
+
+def _read_json(path: str) -> Any:
+    try:
+        with open(path, encoding="utf-8") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+class Agent:
+    """The operations; state (hash cache, counters) lives as long as the service."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        # path -> (size, mtime_ns, sha256): unchanged files are not hashed again
+        self._hash_cache: Dict[str, Tuple[int, int, str]] = {}
+        self._hash_lock = threading.Lock()
+        # Restarts and copies of one VM's containers run one at a time
+        self._mutate_lock = threading.Lock()
+
+    def containers(self) -> List[str]:
+        rc, out = _run(["docker", "ps", "-a", "--filter", "label=tf2ctl.instance", "--format", "{{.Names}}"], 30)
+        if rc != 0:
+            raise AgentError(f"docker ps failed: {out.strip()[-200:]}")
+        return sorted(out.split())
+
+    def _known(self, names: Any) -> List[str]:
+        if not isinstance(names, list) or not names:
+            raise AgentError("args.containers must be a non-empty list")
+        known = self.containers()
+        unknown = [n for n in names if n not in known]
+        if unknown:
+            raise AgentError(f"unknown container(s): {', '.join(map(str, unknown))}")
+        return names
+
+    def op_ping(self, _args: Dict[str, Any]) -> Dict[str, Any]:
+        return {"version": AGENT_VERSION, "uptime": round(time.time() - self.started, 1), "requests": self.requests}
+
+    @staticmethod
+    def _inspect(names: List[str]) -> List[Dict[str, Any]]:
+        if not names:
+            return []
+        rc, out = _run(["docker", "inspect", *names], 30)
+        return json.loads(out) if rc == 0 else []
+
+    def op_status(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        """Containers, load, disk, image and tuning; args.hashes (a list of roots) adds op_hashes' result."""
+        names = self.containers()
+        containers: Dict[str, Any] = {}
+        for item in self._inspect(names):
+            state = item.get("State") or {}
+            containers[item.get("Name", "").lstrip("/")] = {
+                "running": bool(state.get("Running")),
+                "status": state.get("Status", ""),
+                "started_at": state.get("StartedAt", ""),
+                "restart_count": item.get("RestartCount", 0),
+                "image": item.get("Image", ""),
+            }
+        disk = shutil.disk_usage("/")
+        out = {
+            "containers": containers,
+            "load": list(os.getloadavg()),
+            "disk_free_gb": round(disk.free / 1024 ** 3, 1),
+            "image": _read_json(os.path.join(STATE_DIR, "image.json")) or {},
+            "tuning": {n: _read_json(os.path.join(STATE_DIR, f"tuning-{n}.json")) or {} for n in names},
+        }
+        if args.get("hashes"):
+            out["hashes"] = self.op_hashes({"roots": args["hashes"]})
+        return out
+
+    def op_logs(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        container = self._known([args.get("container")])[0]
+        tail = max(1, min(int(args.get("tail", 200)), MAX_LOG_LINES))
+        cmd = ["docker", "logs", "--tail", str(tail)]
+        if args.get("since"):
+            cmd += ["--since", str(args["since"])]
+        rc, out = _run(cmd + [container], 60)
+        return {"container": container, "rc": rc, "text": out}
+
+    def _each(self, args: Dict[str, Any], command: Callable[[str], List[str]], timeout: float) -> Dict[str, Any]:
+        names = self._known(args.get("containers"))
+        out: Dict[str, Any] = {}
+        with self._mutate_lock:
+            for name in names:
+                rc, text = _run(command(name), timeout)
+                out[name] = {"rc": rc, "output": text[-OUTPUT_TAIL:]}
+        return out
+
+    def op_restart(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        return self._each(args, lambda c: ["docker", "restart", c], 120)
+
+    def op_apply_includes(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        return self._each(args, lambda c: ["bash", COPY_SCRIPT, c], 300)
+
+    def _sha256(self, path: str) -> str:
+        st = os.stat(path)
+        with self._hash_lock:
+            cached = self._hash_cache.get(path)
+        if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+            return cached[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                h.update(chunk)
+        with self._hash_lock:
+            self._hash_cache[path] = (st.st_size, st.st_mtime_ns, h.hexdigest())
+        return h.hexdigest()
+
+    def op_hashes(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        roots = args.get("roots") or sorted(HASH_ROOTS)
+        out: Dict[str, Dict[str, str]] = {}
+        for root in roots:
+            if root not in HASH_ROOTS:
+                raise AgentError(f"unknown root {root!r} (known: {', '.join(sorted(HASH_ROOTS))})")
+            base = HASH_ROOTS[root]
+            files: Dict[str, str] = {}
+            for dirpath, _, names in os.walk(base):
+                for fname in names:
+                    path = os.path.join(dirpath, fname)
+                    if os.path.isfile(path):
+                        files[os.path.relpath(path, base)] = self._sha256(path)
+            out[root] = files
+        return out
+
+    def _log_sources(self) -> Dict[str, Tuple[str, bool]]:
+        """{source id: (path on the host, is a docker json-file log)}"""
+        out = {"setup": (SETUP_LOG, False)}
+        for item in self._inspect(self.containers()):
+            name = item.get("Name", "").lstrip("/")
+            if item.get("LogPath"):
+                out[f"container/{name}"] = (item["LogPath"], True)
+            pid = (item.get("State") or {}).get("Pid")
+            logdir = f"/proc/{pid}/root/{SRCDS_LOG_DIR}"
+            if pid and os.path.isdir(logdir):
+                for fname in sorted(os.listdir(logdir)):
+                    if fname.endswith(".log"):
+                        out[f"srcds/{name}/{fname}"] = (os.path.join(logdir, fname), False)
+        return out
+
+    @staticmethod
+    def _read_new(path: str, offset: int, limit: int) -> Tuple[bytes, int]:
+        """Whole lines after `offset`, at most `limit` bytes (unless one line is longer); (data, new offset)."""
+        with open(path, "rb") as fp:
+            fp.seek(offset)
+            data = fp.read(limit)
+        cut = data.rfind(b"\n") + 1
+        if cut == 0 and len(data) < limit:
+            return b"", offset  # only a partial last line so far
+        data = data[:cut] if cut else data
+        return data, offset + len(data)
+
+    @staticmethod
+    def _docker_lines(data: bytes) -> str:
+        """json-file records -> "<time> <line>" text."""
+        out = []
+        for raw in data.splitlines():
+            try:
+                rec = json.loads(raw)
+                out.append(f"{rec.get('time', '')} {rec.get('log', '').rstrip(chr(10))}")
+            except ValueError:
+                out.append(raw.decode("utf-8", "replace"))
+        return "\n".join(out) + ("\n" if out else "")
+
+    def op_read_logs(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        New bytes of every log source since args.offsets ({source: [inode, offset]}). A source whose
+        inode changed or that shrank (rotated, container recreated) is read from the start
+        ("reset"). At most args.max_bytes are returned per call; "more" marks sources with more to read.
+        """
+        offsets = args.get("offsets") or {}
+        budget = max(1, min(int(args.get("max_bytes", MAX_READ)), MAX_READ))
+        out: Dict[str, Any] = {}
+        for sid, (path, docker_json) in self._log_sources().items():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            inode, offset = (offsets.get(sid) or [None, 0])[:2]
+            reset = inode is not None and (inode != st.st_ino or st.st_size < offset)
+            if reset or inode is None:
+                offset = 0
+            entry = {"inode": st.st_ino, "offset": offset, "reset": reset, "text": "", "more": False}
+            if st.st_size > offset:
+                if budget <= 0:
+                    entry["more"] = True
+                else:
+                    data, entry["offset"] = self._read_new(path, offset, budget)
+                    budget -= len(data)
+                    entry["more"] = st.st_size > entry["offset"] and bool(data)
+                    entry["text"] = self._docker_lines(data) if docker_json else data.decode("utf-8", "replace")
+            out[sid] = entry
+        return {"sources": out}
+
+    def _container_demos(self, root: str, now: float) -> List[Dict[str, Any]]:
+        found = [f for f in sorted(os.listdir(root)) if f.endswith(".dem")]
+        for dirpath, _, names in os.walk(os.path.join(root, DEMO_SUBDIR)):
+            rel = os.path.relpath(dirpath, root)
+            found += [os.path.join(rel, f) for f in sorted(names) if f.endswith(".dem")]
+        out = []
+        for rel in found:
+            path = os.path.join(root, rel)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            recording = now - st.st_mtime < RECORDING_GRACE
+            out.append({"path": rel, "size": st.st_size, "mtime": int(st.st_mtime), "recording": recording,
+                        # Finished demos never change, so the hash cache makes repeat listings cheap
+                        "sha256": "" if recording else self._sha256(path)})
+        return out
+
+    def op_demos(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        """{container: {"demos": [{"path", "size", "mtime", "sha256", "recording"}]} or {"error"}}"""
+        names = self._known(args["containers"]) if args.get("containers") else self.containers()
+        now = time.time()
+        out: Dict[str, Any] = {}
+        for item in self._inspect(names):
+            name = item.get("Name", "").lstrip("/")
+            pid = (item.get("State") or {}).get("Pid")
+            root = f"/proc/{pid}/root/{SRCDS_GAME_DIR}"
+            if not pid or not os.path.isdir(root):
+                out[name] = {"error": "container is not running"}
+                continue
+            out[name] = {"demos": self._container_demos(root, now)}
+        return out
+
+    def handle(self, req: Dict[str, Any]) -> Any:
+        op = req.get("op")
+        fn = getattr(self, f"op_{op}", None) if isinstance(op, str) else None
+        if fn is None:
+            raise AgentError(f"unknown op {op!r}")
+        args = req.get("args") or {}
+        if not isinstance(args, dict):
+            raise AgentError("args must be an object")
+        self.requests += 1
+        return fn(args)
+
+
+class _Request(socketserver.StreamRequestHandler):
+    server: "_Server"
+
+    def handle(self):
+        for raw in self.rfile:
+            try:
+                req = json.loads(raw)
+                if not isinstance(req, dict):
+                    raise AgentError("request must be a JSON object")
+                if not hmac.compare_digest(str(req.get("token", "")), self.server.token):
+                    reply = {"ok": False, "error": "bad token"}
+                else:
+                    reply = {"ok": True, "result": self.server.agent.handle(req)}
+            except (AgentError, ValueError, OSError) as exc:
+                reply = {"ok": False, "error": str(exc)}
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int, token: str):
+        super().__init__(("127.0.0.1", port), _Request)
+        self.token = token
+        self.agent = Agent()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="tf2ctl on-server agent")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--token-file", required=True)
+    args = parser.parse_args()
+    with open(args.token_file, encoding="utf-8") as fp:
+        token = fp.read().strip()
+    if not token:
+        raise SystemExit(f"{args.token_file} is empty")
+    with _Server(args.port, token) as server:
+        print(f"tf2ctl agent v{AGENT_VERSION} listening on 127.0.0.1:{args.port}", flush=True)
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,24 +2,139 @@
 import io
 import os
 import sys
-import stat
 import time
+import hashlib
+import threading
 import random
 import string
 import shutil
 import subprocess
 import socket
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, Union
 
-import paramiko
-from paramiko.ssh_exception import SSHException, NoValidConnectionsError
-from cryptography.hazmat.primitives.asymmetric import ed25519
-from cryptography.hazmat.primitives import serialization
+try:
+    from tf2ctl import tracing
+    from tf2ctl import bundle
+except ImportError:
+    import tracing
+    import bundle
+
+if TYPE_CHECKING:
+    import paramiko
+
+
+def _paramiko():
+    """
+    paramiko, imported on first SSH use. It (and cryptography under it) is most of the
+    CLI's start-up time, and commands like `list` never open a connection.
+    """
+    import paramiko  # pylint: disable=import-outside-toplevel,redefined-outer-name
+    return paramiko
+
+
+def _ssh_errors() -> Tuple[type, ...]:
+    """(SSHException, NoValidConnectionsError)"""
+    paramiko = _paramiko()  # pylint: disable=redefined-outer-name
+    return paramiko.SSHException, paramiko.ssh_exception.NoValidConnectionsError
+
+
+# Connection pool, off unless SSHOps.enable_pool() is called (the controller daemon does).
+# {(host, user, key hash): [client, last used, leases out]}. Only entries with no lease
+# out are closed; one replaced or evicted while lent is closed by its last lease.
+_POOL: Optional[Dict[Tuple[str, str, str], list]] = None
+_POOL_LOCK = threading.Lock()
+_POOL_IDLE = 300.0
+
+
+class _Lease:
+    """A pooled SSHClient lent to one caller: close() hands the connection back for the next one."""
+    def __init__(self, key: Tuple[str, str, str], entry: list):
+        # Called with _POOL_LOCK held
+        self._key = key
+        self._entry = entry
+        self._returned = False
+        entry[2] += 1
+
+    def __getattr__(self, name: str):
+        return getattr(self._entry[0], name)
+
+    def close(self):
+        with _POOL_LOCK:
+            if self._returned:
+                return
+            self._returned = True
+            entry = self._entry
+            entry[1] = time.time()
+            entry[2] -= 1
+            orphaned = entry[2] == 0 and (_POOL is None or _POOL.get(self._key) is not entry)
+        if orphaned:
+            entry[0].close()
+
+
+def _pool_key(host: str, user: str, private_key: str) -> Tuple[str, str, str]:
+    return host, user, hashlib.sha256(private_key.encode("utf-8")).hexdigest()
+
+
+def _pool_get(host: str, user: str, private_key: str) -> Optional[_Lease]:
+    if _POOL is None:
+        return None
+    now = time.time()
+    stale = []
+    with _POOL_LOCK:
+        for key, entry in list(_POOL.items()):
+            transport = entry[0].get_transport()
+            dead = transport is None or not transport.is_active()
+            if dead or (entry[2] == 0 and now - entry[1] > _POOL_IDLE):
+                del _POOL[key]
+                if entry[2] == 0:
+                    stale.append(entry[0])
+        key = _pool_key(host, user, private_key)
+        entry = _POOL.get(key)
+        lease = _Lease(key, entry) if entry is not None else None
+    for client in stale:
+        client.close()
+    return lease
+
+
+def _pool_put(host: str, user: str, private_key: str, client):
+    if _POOL is None:
+        return client
+    transport = client.get_transport()
+    if transport is not None:
+        transport.set_keepalive(30)
+    key = _pool_key(host, user, private_key)
+    entry = [client, time.time(), 0]
+    with _POOL_LOCK:
+        old = _POOL.get(key)
+        _POOL[key] = entry
+        lease = _Lease(key, entry)
+    if old is not None and old[2] == 0:
+        old[0].close()
+    return lease
 
 
 class SSHOps:
     # pylint: disable=too-many-branches,too-many-statements,too-many-locals,too-many-nested-blocks,too-many-arguments,too-many-positional-arguments
+    @staticmethod
+    def enable_pool(idle_seconds: float = 300.0):
+        """Reuse SSH transports across calls (per host/user/key) until idle for `idle_seconds`."""
+        global _POOL, _POOL_IDLE  # pylint: disable=global-statement
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = {}
+            _POOL_IDLE = idle_seconds
+
+    @staticmethod
+    def close_pool():
+        global _POOL  # pylint: disable=global-statement
+        with _POOL_LOCK:
+            pool, _POOL = _POOL or {}, None
+            idle = [entry[0] for entry in pool.values() if entry[2] == 0]
+        # Clients still lent out are closed by their last lease
+        for client in idle:
+            client.close()
+
     @staticmethod
     def random_password(n: int = 16) -> str:
         chars = string.ascii_letters + string.digits + "!@#$%^&*"
@@ -27,6 +142,9 @@ class SSHOps:
 
     @staticmethod
     def generate_ed25519_keypair(comment: str = "tf2ctl") -> tuple[str, str]:
+        # pylint: disable=import-outside-toplevel
+        from cryptography.hazmat.primitives.asymmetric import ed25519
+        from cryptography.hazmat.primitives import serialization
         private_key = ed25519.Ed25519PrivateKey.generate()
         priv_pem = private_key.private_bytes(
             encoding=serialization.Encoding.PEM,
@@ -74,7 +192,8 @@ class SSHOps:
         return False
 
     @staticmethod
-    def _connect(host: str, user: str, private_key: str, timeout: int = 20) -> paramiko.SSHClient:
+    def _connect(host: str, user: str, private_key: str, timeout: int = 20) -> "paramiko.SSHClient":
+        paramiko = _paramiko()  # pylint: disable=redefined-outer-name
         key = paramiko.Ed25519Key.from_private_key(io.StringIO(private_key))
         client = paramiko.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -89,11 +208,15 @@ class SSHOps:
         attempts: int = 8,
         base_delay: float = 3.0,
         max_delay: float = 10.0,
-    ) -> paramiko.SSHClient:
+    ) -> "paramiko.SSHClient":
         """
         Robust connector that retries on transient failures like banner read errors,
         connection resets, or port not ready. Always checks port availability first.
+        With the pool enabled, a live pooled connection is returned without reconnecting.
         """
+        pooled = _pool_get(host, user, private_key)
+        if pooled is not None:
+            return pooled
         last_exc: Optional[Exception] = None
         for i in range(1, attempts + 1):
             try:
@@ -101,15 +224,15 @@ class SSHOps:
                 if not SSHOps.is_port_open(host, 22, timeout=3.0):
                     raise socket.error("Port 22 not open yet")
                 # Try to connect
-                return SSHOps._connect(host, user, private_key, timeout=20)
-            except (SSHException, NoValidConnectionsError, OSError, ConnectionResetError, socket.error) as e:
+                return _pool_put(host, user, private_key, SSHOps._connect(host, user, private_key, timeout=20))
+            except (*_ssh_errors(), OSError, ConnectionResetError, socket.error) as e:
                 last_exc = e
                 delay = min(max_delay, base_delay * i)
                 if i < attempts:
                     print(f"SSH connection attempt {i}/{attempts} failed, retrying in {delay:.1f}s...")
-                time.sleep(delay)
+                    time.sleep(delay)
         # Exhausted retries
-        raise last_exc if last_exc else SSHException("Unknown SSH connect failure")
+        raise last_exc if last_exc else _paramiko().SSHException("Unknown SSH connect failure")
 
     @staticmethod
     def _wait_ssh(host: str, user: str, private_key: str, timeout: int = 900) -> bool:
@@ -141,7 +264,7 @@ class SSHOps:
                 if rc == 0 and out == "READY":
                     print("SSH is ready and accepting commands")
                     return True
-            except (SSHException, NoValidConnectionsError, OSError, ConnectionResetError, socket.error, socket.timeout) as e:
+            except (*_ssh_errors(), OSError, ConnectionResetError, socket.error, socket.timeout) as e:
                 last_exc = e
             # Simple fixed backoff
             time.sleep(5)
@@ -151,40 +274,67 @@ class SSHOps:
             print("SSH not ready within timeout.")
         return False
 
-    # --- Robust remote mkdir -p with POSIX paths ---
     @staticmethod
-    def _mkdir_parents(sftp: paramiko.SFTPClient, path: str):
-        # Normalize to POSIX
-        path = path.replace("\\", "/")
-        parts = [p for p in path.split("/") if p not in ("", ".")]
-        cur = "/" if path.startswith("/") else ""
-        for part in parts:
-            new = (cur + part) if cur in ("", "/") else (cur + "/" + part)
-            try:
-                sftp.stat(new)
-            except IOError:
-                try:
-                    sftp.mkdir(new)
-                except IOError:
-                    pass
-            cur = new
+    def wait_ssh_ready(host: str, user: str, private_key: str, timeout: int = 900) -> bool:
+        with tracing.span("ssh.wait_ready", host=host) as sp:
+            sp["ready"] = SSHOps._wait_ssh(host, user, private_key, timeout=timeout)
+        return sp["ready"]
 
     @staticmethod
-    def _sftp_put_dir(sftp: paramiko.SFTPClient, local_dir: Path, remote_dir: str):
-        # Ensure the root exists
-        SSHOps._mkdir_parents(sftp, remote_dir)
-        for root, _, files in os.walk(local_dir):
-            # rel may contain Windows backslashes; force POSIX for remote
-            rel = os.path.relpath(root, str(local_dir))
-            rel_posix = "." if rel == "." else rel.replace("\\", "/")
-            dest = remote_dir if rel_posix == "." else f"{remote_dir}/{rel_posix}"
-            SSHOps._mkdir_parents(sftp, dest)
-            for fname in files:
-                if fname.startswith("."):
+    def _stream_command(
+        client: "paramiko.SSHClient",
+        command: str,
+        on_line,
+        stall_timeout: float,
+        sink=None,
+        stdin_data: Optional[Union[bytes, Path]] = None,
+    ) -> Optional[int]:
+        """
+        Run `command` and feed its combined output to on_line() line by line as it arrives,
+        also writing raw bytes to `sink` (a binary file) when given. `stdin_data` (bytes, or
+        a local file streamed in chunks) is sent to the command's stdin, which is then closed.
+        Returns the exit status, or None if the command produced no output for
+        `stall_timeout` seconds.
+        """
+        transport = client.get_transport()
+        if transport is None:
+            raise _paramiko().SSHException("SSH transport is not available")
+        chan = transport.open_session()
+        chan.set_combine_stderr(True)
+        chan.exec_command(command)
+        if isinstance(stdin_data, Path):
+            with stdin_data.open("rb") as fp:
+                for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                    chan.sendall(chunk)
+        elif stdin_data is not None:
+            chan.sendall(stdin_data)
+        chan.shutdown_write()
+        chan.settimeout(1.0)
+        pending = b""
+        last_data = time.time()
+        try:
+            while True:
+                try:
+                    data = chan.recv(32768)
+                except socket.timeout:
+                    if time.time() - last_data > stall_timeout:
+                        return None
                     continue
-                local_path = os.path.join(root, fname)
-                remote_path = f"{dest}/{fname}"
-                sftp.put(local_path, remote_path)
+                if not data:
+                    break
+                last_data = time.time()
+                if sink is not None:
+                    sink.write(data)
+                    sink.flush()
+                pending += data
+                *lines, pending = pending.split(b"\n")
+                for raw in lines:
+                    on_line(raw.decode("utf-8", errors="replace").rstrip("\r"))
+            if pending:
+                on_line(pending.decode("utf-8", errors="replace").rstrip("\r"))
+            return chan.recv_exit_status()
+        finally:
+            chan.close()
 
     @staticmethod
     def configure_server(
@@ -193,255 +343,297 @@ class SSHOps:
         user: str,
         private_key: str,
         server_resources: Path,
-        substitutions: Dict[str, str],
+        substitutions: Union[Dict[str, str], List[Dict[str, str]]],
         logs_dir: Optional[Path] = None,
         log_filename: Optional[str] = None,
+        label: Optional[str] = None,
+        stall_timeout: int = 600,
+        wait_ready: bool = True,
+        report: Optional[Dict[str, Any]] = None,
+        extra_files: Optional[Dict[str, bytes]] = None,
+        shared_sha: Optional[str] = None,
     ) -> bool:
         """
-        Uploads server_resources, waits for cloud-init/apt to finish, runs setup.sh with bash -x,
-        copies includes into the container, and saves a full log locally if logs_dir is provided.
+        Packs setup.sh (with substitutions), the copy/wait helpers and includes into one
+        bootstrap bundle, streams it into a single SSH exec that installs it, waits for
+        cloud-init/apt, runs setup.sh with bash -x and copies includes into the container.
+        Output is streamed as it arrives (phase progress is printed with `label`) and saved
+        locally if logs_dir is provided; if no output arrives for `stall_timeout` seconds the
+        run is aborted. Pass wait_ready=False if the caller already confirmed SSH readiness.
+        `substitutions` is one dict per srcds instance on the VM (a single dict means one instance).
+        The structured result from the server is stored in `report` when given.
+        `extra_files` (bundle-relative path -> bytes, e.g. maps from the store) are added to the bundle,
+        unless `shared_sha` names a payload already placed on the server by distribute.fan_out().
         Returns True/False.
         """
         if not server_resources.exists():
             print(f"server_resources not found at {server_resources}")
             return False
+        setup_path = server_resources / "scripts" / "setup.sh"
+        if not setup_path.exists():
+            print(f"Missing {setup_path}")
+            return False
 
-        if not SSHOps._wait_ssh(host, user, private_key):
+        if wait_ready and not SSHOps.wait_ssh_ready(host, user, private_key):
             return False
 
+        with tracing.span("bundle.build", host=host) as sp:
+            instances = [substitutions] if isinstance(substitutions, dict) else list(substitutions)
+            payload = bundle.build_bundle(server_resources, instances, extra_files, shared_sha)
+            sp["bytes"] = len(payload)
+
         # connect with retry (handles banner/connection resets)
         try:
             client = SSHOps._connect_retry(host, user, private_key, attempts=8, base_delay=3.0, max_delay=10.0)
-        except (SSHException, NoValidConnectionsError, OSError, ConnectionResetError) as e:
+        except (*_ssh_errors(), OSError, ConnectionResetError) as e:
             print(f"Unable to establish SSH session: {e}")
             return False
 
-        try:
-            # Open SFTP (retry once if needed)
-            try:
-                sftp = client.open_sftp()
-            except paramiko.sftp.SFTPError:
-                client.close()
-                time.sleep(5)
-                client = SSHOps._connect_retry(host, user, private_key, attempts=6, base_delay=3.0, max_delay=10.0)
-                sftp = client.open_sftp()
-
-            # Upload setup.sh with robust decoding/encoding
-            setup_path = server_resources / "scripts" / "setup.sh"
-            if not setup_path.exists():
-                print(f"Missing {setup_path}")
-                return False
-
-            # Read raw bytes (avoid Windows locale issues), decode UTF-8 with surrogateescape
-            raw_bytes = setup_path.read_bytes()
-            text = raw_bytes.decode("utf-8", errors="surrogateescape")
-            # Normalize newlines for bash
-            text = text.replace("\r\n", "\n").replace("\r", "\n")
-            # Perform placeholder substitutions:
-            # - ${KEY}
-            # - KEY_REPLACE
-            for k, v in substitutions.items():
-                text = text.replace("${" + k + "}", str(v))
-                text = text.replace(f"{k}_REPLACE", str(v))
-
-            # --- Ensure setup.sh triggers a post-copy every time (idempotent) ---
-            appended_postcopy = False
-            if "TF2CTL_POSTCOPY" not in text:
-                text += "\n# TF2CTL_POSTCOPY\nbash /root/tf2-copy.sh || true\n"
-                appended_postcopy = True
-
-            # Encode back to bytes and upload in binary mode
-            out_bytes = text.encode("utf-8", errors="surrogateescape")
-            tmp_remote = "/root/tf2-setup.sh"
-            with sftp.open(tmp_remote, "wb") as fp:
-                fp.write(out_bytes)
-            sftp.chmod(tmp_remote, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
-
-            # Upload includes (configs/cfg/cfgs/maps/addons) if present
-            includes = server_resources / "includes"
-            if includes.exists():
-                SSHOps._sftp_put_dir(sftp, includes, "/root/tf2-includes")
-
-            # Upload the copy helper BEFORE running setup (so setup can call it)
-            #pylint: disable=line-too-long
-            copy_remote = "/root/tf2-copy.sh"
-            copy_script = r"""#!/usr/bin/env bash
-set -e
-log="/root/tf2-setup.log"
-container="tf2"
-
-{
-  echo "=== Copying resources into container: $container ==="
-  if ! docker inspect "$container" >/dev/null 2>&1; then
-    echo "Container $container does not exist yet; skipping copy."
-    exit 0
-  fi
-
-  if ! docker ps --format '{{.Names}}' | grep -qw "$container"; then
-    echo "WARN: container $container not running; trying to start..."
-    docker start "$container" >/dev/null 2>&1 || true
-  fi
-
-  # If a server.cfg exists in the uploaded cfg-like dir, rename it to tf2ctl.cfg to avoid overwriting generated server.cfg
-  for d in cfg cfgs configs; do
-    if [ -f "/root/tf2-includes/$d/server.cfg" ]; then
-      echo "Found user server.cfg in $d/, renaming to tf2ctl.cfg"
-      mv "/root/tf2-includes/$d/server.cfg" "/root/tf2-includes/$d/tf2ctl.cfg"
-    fi
-  done
-
-  # cfg-like dirs -> /home/tf2/server/tf/cfg/
-  for d in cfg cfgs configs; do
-    if [ -d "/root/tf2-includes/$d" ]; then
-      echo "Copying $d/ -> /home/tf2/server/tf/cfg/"
-      docker cp "/root/tf2-includes/$d/." "$container:/home/tf2/server/tf/cfg/"
-    fi
-  done
-
-  # Ensure autoexec.cfg will exec our overrides on every start (after server.cfg)
-  docker exec "$container" bash -lc 'CFG="/home/tf2/server/tf/cfg/autoexec.cfg"; touch "$CFG"; grep -q "^exec tf2ctl.cfg" "$CFG" || echo "exec tf2ctl.cfg" >> "$CFG"'
-
-  # maps/ -> /home/tf2/server/tf/maps/
-  if [ -d /root/tf2-includes/maps ]; then
-    echo "Copying maps/ -> /home/tf2/server/tf/maps/"
-    docker cp /root/tf2-includes/maps/. "$container:/home/tf2/server/tf/maps/"
-  fi
-
-  # addons/ -> /home/tf2/server/tf/addons/
-  if [ -d /root/tf2-includes/addons ]; then
-    echo "Copying addons/ -> /home/tf2/server/tf/addons/"
-    docker cp /root/tf2-includes/addons/. "$container:/home/tf2/server/tf/addons/"
-  fi
-
-  echo "=== Finished copying resources ==="
-} | tee -a "$log"
-"""
-            with sftp.open(copy_remote, "w") as fp:
-                fp.write(copy_script)
-            sftp.chmod(copy_remote, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
-
-            # Add a helpful alias on the host shell
+        label = label or host
+        local_fp = None
+        if logs_dir:
             try:
-                cmd_alias = r'''bash -lc 'PROFILE=/root/.bashrc; touch "$PROFILE"; grep -q "alias tf2apply=" "$PROFILE" || echo "alias tf2apply=\"bash /root/tf2-copy.sh\"" >> "$PROFILE"' '''
-                client.exec_command(cmd_alias)
-            except paramiko.ssh_exception.SSHException:
-                pass
+                logs_dir.mkdir(parents=True, exist_ok=True)
+                local_log = logs_dir / (log_filename or f"{host}-setup.log")
+                local_fp = local_log.open("wb")
+            except OSError as e:
+                print(f"(Could not open local setup log: {e})")
+        marker_lines = []
+        state: Dict[str, Any] = {"phase": "", "result": None}
+
+        def on_line(line: str):
+            if line.startswith(tracing.PHASE_MARKER):
+                marker_lines.append(line)
+                parts = line.split()
+                if len(parts) >= 3 and parts[2] == "begin":
+                    state["phase"] = parts[1]
+                    print(f"  [{label}] phase: {parts[1]}")
+            elif line.startswith(bundle.RESULT_MARKER):
+                state["result"] = bundle.parse_result(line)
 
-            # --- Wait for apt/dpkg/cloud-init to finish to avoid lock races ---
-            wait_remote = "/root/tf2-wait.sh"
-            wait_script = """#!/usr/bin/env bash
-set -e
-for _ in $(seq 1 200); do
-  if [ -f /var/lib/cloud/instance/boot-finished ] || [ -f /var/local/tf2ctl-init-done ]; then
-    break
-  fi
-  sleep 3
-done
-for _ in $(seq 1 200); do
-  if ! pgrep -x unattended-upgrade >/dev/null 2>&1 \
-     && ! pgrep -x apt >/dev/null 2>&1 \
-     && ! pgrep -x apt-get >/dev/null 2>&1 \
-     && ! pgrep -x dpkg >/dev/null 2>&1; then
-    break
-  fi
-  sleep 3
-done
-exit 0
-"""
-            with sftp.open(wait_remote, "w") as fp:
-                fp.write(wait_script)
-            sftp.chmod(wait_remote, stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
-
-            # Run the wait script and block until it completes
-            _, w_out, w_err = client.exec_command(f"bash {wait_remote}", get_pty=True)
-            _ = w_out.read()
-            _ = w_err.read()
-            _ = w_out.channel.recv_exit_status()
-
-            # --- Run setup script with tracing, pipe all output to a remote log ---
-            remote_log = "/root/tf2-setup.log"
-            cmd = f"bash -x {tmp_remote} > {remote_log} 2>&1; echo __EXIT_CODE__$?"
-            _, stdout, _ = client.exec_command(cmd)
-            marker = stdout.read().decode("utf-8", errors="replace").strip()
-            setup_rc = 1
-            if "__EXIT_CODE__" in marker:
-                try:
-                    setup_rc = int(marker.split("__EXIT_CODE__")[-1])
-                except (ValueError, IndexError):
-                    setup_rc = 1
-
-            # If we did NOT inject the call into setup.sh (rare), run copy script now
-            if not appended_postcopy:
-                _, c_out, _ = client.exec_command(f"bash {copy_remote}; echo __COPY_RC__$?")
-                marker2 = c_out.read().decode("utf-8", errors="replace").strip()
-                copy_rc = 0
-                if "__COPY_RC__" in marker2:
-                    try:
-                        copy_rc = int(marker2.split("__COPY_RC__")[-1])
-                    except (ValueError, IndexError):
-                        copy_rc = 1
-            else:
-                copy_rc = 0  # setup.sh already invoked it; the output is in the same log
-
-            # Pull the log locally if requested
-            overall_rc = (setup_rc == 0) and (copy_rc == 0)
-            if logs_dir:
+        try:
+            with tracing.span("remote.bootstrap", host=host, bytes=len(payload)) as sp:
+                rc = SSHOps._stream_command(client, bundle.remote_command(), on_line, stall_timeout,
+                                            sink=local_fp, stdin_data=payload)
+                sp["rc"] = rc
+            tracing.record_remote_phases("\n".join(marker_lines), host=host)
+            if rc is None:
+                print(f"  [{label}] no output for {stall_timeout}s during phase "
+                      f"'{state['phase'] or 'unknown'}'; aborting setup.")
                 try:
-                    logs_dir.mkdir(parents=True, exist_ok=True)
-                    local_log = logs_dir / (log_filename or f"{host}-setup.log")
-                    sftp.get(remote_log, str(local_log))
-                    print(f"(Saved setup log to {local_log})")
-                except (OSError, IOError, FileNotFoundError) as e:
-                    print(f"(Could not save setup log: {e})")
-
-            # Quick verify: docker ps (non-fatal)
-            client.exec_command("docker ps || true")
-
-            sftp.close()
-            client.close()
-            return overall_rc
-        except SSHException as e:
+                    client.exec_command("pkill -f /root/tf2-setup- || true")
+                except _paramiko().SSHException:
+                    pass
+            result = state["result"] or {}
+            if report is not None:
+                report.update(result)
+                report["rc"] = rc
+                report["stalled_phase"] = state["phase"] if rc is None else ""
+            return rc == 0 and result.get("setup_rc") == 0
+        except _paramiko().SSHException as e:
             print(f"SSH error: {e}")
-            try:
-                client.close()
-            except (OSError, SSHException):
-                pass
             return False
         except (OSError, socket.error) as e:
             print(f"Unexpected error during configure_server: {e}")
+            return False
+        finally:
+            if local_fp:
+                local_fp.close()
+                print(f"(Saved setup log to {local_fp.name})")
             try:
                 client.close()
-            except (OSError, SSHException):
+            except (OSError, _paramiko().SSHException):
                 pass
-            return False
 
     @staticmethod
-    def run_command(host: str, user: str, private_key: str, command: str, get_pty: bool = True) -> Tuple[int, str, str]:
+    def run_command(host: str, user: str, private_key: str, command: str, get_pty: bool = True,
+                    attempts: int = 6) -> Tuple[int, str, str]:
         """
-        Run a single command over SSH, return (rc, stdout, stderr).
+        Run a single command over SSH, return (rc, stdout, stderr); rc is 1 when the host
+        cannot be reached within `attempts` connection attempts.
         """
         try:
-            client = SSHOps._connect_retry(host, user, private_key, attempts=6, base_delay=3.0, max_delay=10.0)
+            client = SSHOps._connect_retry(host, user, private_key, attempts=attempts, base_delay=3.0, max_delay=10.0)
+        except (*_ssh_errors(), OSError) as e:
+            return 1, "", f"(failed to connect) {e}"
+        try:
             _, stdout, stderr = client.exec_command(command, get_pty=get_pty)
             out = stdout.read().decode("utf-8", errors="replace")
             err = stderr.read().decode("utf-8", errors="replace")
             rc = stdout.channel.recv_exit_status()
-            client.close()
             return rc, out, err
-        except (SSHException) as e:
+        except (_paramiko().SSHException, OSError) as e:
             return 1, "", f"(failed to run command) {e}"
+        finally:
+            client.close()
 
     @staticmethod
-    def get_container_logs(host: str, user: str, private_key: str, container: str = "tf2", tail: int = 200) -> str:
+    def pipe_command(
+        host: str,
+        user: str,
+        private_key: str,
+        command: str,
+        stdin_data: Union[bytes, Path],
+        stall_timeout: float = 600,
+    ) -> Tuple[int, str]:
+        """
+        Run `command` with `stdin_data` (bytes or a local file, streamed) on its stdin.
+        Returns (rc, combined output); rc is 1 on connection errors and 124 on a stall.
+        """
+        lines: List[str] = []
         try:
             client = SSHOps._connect_retry(host, user, private_key, attempts=6, base_delay=3.0, max_delay=10.0)
-            cmd = f"docker logs --tail {tail} {container} 2>&1 || true"
-            _, stdout, _ = client.exec_command(cmd)
-            out = stdout.read().decode("utf-8", errors="replace")
+        except (*_ssh_errors(), OSError) as e:
+            return 1, f"(failed to connect) {e}"
+        try:
+            rc = SSHOps._stream_command(client, command, lines.append, stall_timeout, stdin_data=stdin_data)
+            return (124 if rc is None else rc), "\n".join(lines)
+        except (_paramiko().SSHException, OSError) as e:
+            return 1, f"(failed to run command) {e}"
+        finally:
+            client.close()
+
+    @staticmethod
+    def tunnel_request(host: str, user: str, private_key: str, port: int, data: bytes,
+                       timeout: float = 60.0) -> bytes:
+        """
+        Send `data` to 127.0.0.1:`port` on `host` through a direct-tcpip channel of the SSH
+        connection and return the reply up to (and including) its first newline.
+        Raises ConnectionError when the host or the port cannot be reached (nothing was
+        delivered), TimeoutError when the request went out but no reply came in `timeout`.
+        """
+        try:
+            client = SSHOps._connect_retry(host, user, private_key, attempts=2, base_delay=1.0, max_delay=3.0)
+        except (*_ssh_errors(), OSError) as e:
+            raise ConnectionError(f"failed to connect: {e}") from e
+        try:
+            transport = client.get_transport()
+            if transport is None:
+                raise ConnectionError("SSH transport is not available")
+            # ChannelException (an SSHException) when nothing listens on the port
+            chan = transport.open_channel("direct-tcpip", ("127.0.0.1", port), ("127.0.0.1", 0), timeout=timeout)
+            try:
+                chan.settimeout(timeout)
+                # From here on a timeout (socket.timeout is TimeoutError) means the request may have run
+                chan.sendall(data)
+                reply = bytearray()
+                while not reply.endswith(b"\n"):
+                    chunk = chan.recv(65536)
+                    if not chunk:
+                        break
+                    reply += chunk
+                return bytes(reply)
+            finally:
+                chan.close()
+        except (ConnectionError, TimeoutError):
+            raise
+        except (_paramiko().SSHException, OSError) as e:
+            raise ConnectionError(f"port {port}: {e}") from e
+        finally:
+            client.close()
+
+    @staticmethod
+    def follow_command(host: str, user: str, private_key: str, command: str, on_line: Callable[[str], None],
+                       stop: threading.Event, max_line: int = 4096) -> Optional[int]:
+        """
+        Run a long-lived `command` (e.g. `docker logs -f`) and pass each output line to on_line()
+        until it exits or `stop` is set. It runs on a pty, so closing the channel hangs it up on
+        the server too. Lines are cut at `max_line` bytes, so memory stays bounded.
+        Returns the exit status, or None when stopped. Raises ConnectionError.
+        """
+        try:
+            client = SSHOps._connect_retry(host, user, private_key, attempts=3, base_delay=2.0, max_delay=5.0)
+        except (*_ssh_errors(), OSError) as e:
+            raise ConnectionError(f"failed to connect: {e}") from e
+        try:
+            transport = client.get_transport()
+            if transport is None:
+                raise ConnectionError("SSH transport is not available")
+            chan = transport.open_session()
+            try:
+                chan.get_pty()
+                chan.exec_command(command)
+                chan.settimeout(1.0)
+                pending = b""
+                while not stop.is_set():
+                    try:
+                        data = chan.recv(32768)
+                    except socket.timeout:
+                        continue
+                    if not data:
+                        break
+                    pending += data
+                    *lines, pending = pending.split(b"\n")
+                    if len(pending) > max_line:
+                        lines.append(pending)
+                        pending = b""
+                    for raw in lines:
+                        on_line(raw[:max_line].decode("utf-8", errors="replace").rstrip("\r"))
+                if stop.is_set():
+                    return None
+                if pending:
+                    on_line(pending.decode("utf-8", errors="replace").rstrip("\r"))
+                return chan.recv_exit_status()
+            finally:
+                chan.close()
+        except ConnectionError:
+            raise
+        except (_paramiko().SSHException, OSError) as e:
+            raise ConnectionError(str(e)) from e
+        finally:
+            client.close()
+
+    @staticmethod
+    def read_command(host: str, user: str, private_key: str, command: str, on_chunk: Callable[[bytes], None],
+                     stall_timeout: float = 120.0) -> Tuple[int, str]:
+        """
+        Run `command` without a pty and pass its stdout, unchanged, to on_chunk() as it arrives.
+        A slow on_chunk() throttles the sender through the SSH window. Returns (rc, tail of
+        stderr); rc is 124 when nothing arrives for `stall_timeout`. Raises ConnectionError.
+        """
+        try:
+            client = SSHOps._connect_retry(host, user, private_key, attempts=3, base_delay=2.0, max_delay=5.0)
+        except (*_ssh_errors(), OSError) as e:
+            raise ConnectionError(f"failed to connect: {e}") from e
+        try:
+            transport = client.get_transport()
+            if transport is None:
+                raise ConnectionError("SSH transport is not available")
+            chan = transport.open_session()
+            try:
+                chan.exec_command(command)
+                chan.settimeout(stall_timeout)
+                try:
+                    for data in iter(lambda: chan.recv(262144), b""):
+                        on_chunk(data)
+                except socket.timeout:
+                    return 124, f"no data for {stall_timeout:.0f}s"
+                err = b""
+                while chan.recv_stderr_ready():
+                    err = (err + chan.recv_stderr(4096))[-2000:]
+                return chan.recv_exit_status(), err.decode("utf-8", errors="replace")
+            finally:
+                chan.close()
+        except ConnectionError:
+            raise
+        except (_paramiko().SSHException, OSError) as e:
+            raise ConnectionError(str(e)) from e
+        finally:
             client.close()
-            return out
-        except (SSHException) as e:
+
+    @staticmethod
+    def get_container_logs(host: str, user: str, private_key: str, container: str = "tf2", tail: int = 200) -> str:
+        try:
+            client = SSHOps._connect_retry(host, user, private_key, attempts=6, base_delay=3.0, max_delay=10.0)
+        except _paramiko().SSHException as e:
+            return f"(failed to get logs) {e}"
+        try:
+            _, stdout, _ = client.exec_command(f"docker logs --tail {tail} {container} 2>&1 || true")
+            return stdout.read().decode("utf-8", errors="replace")
+        except _paramiko().SSHException as e:
             return f"(failed to get logs) {e}"
+        finally:
+            client.close()
 
     @staticmethod
     def open_ssh_session(host: str, user: str, private_key_path: str):
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Span-based timing for the provisioning pipeline.
+
+A run (one bulk create, one re-configure, ...) writes one JSONL file under
+.tf2ctl/traces/. Each line is a finished span:
+
+    {"run": "...", "phase": "provider.create_server", "start": 1.0, "end": 2.5,
+     "duration": 1.5, "ok": true, "server": "tf2-01", ...}
+
+Spans are no-ops when no run is active, so instrumented code (provider
+adapters, SSHOps) works unchanged outside of a traced run.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from functools import wraps
+from contextlib import contextmanager
+from datetime import datetime, UTC
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Lines emitted by setup.sh / tf2-copy.sh:  __TF2CTL_PHASE__ <name> <begin|end> <epoch>
+PHASE_MARKER = "__TF2CTL_PHASE__"
+_PHASE_RE = re.compile(r"^" + PHASE_MARKER + r"\s+(\S+)\s+(begin|end)\s+([0-9]+(?:\.[0-9]+)?)\s*$")
+
+
+class Tracer:
+    def __init__(self, trace_dir: Path, run_name: str):
+        stamp = datetime.now(UTC).strftime("%Y%m%dT%H%M%SZ")
+        self.run_id = f"{stamp}-{run_name}-{uuid.uuid4().hex[:6]}"
+        self.run_name = run_name
+        self.path = trace_dir / f"{self.run_id}.jsonl"
+        self._lock = threading.Lock()
+        trace_dir.mkdir(parents=True, exist_ok=True)
+
+    def record(self, phase: str, start: float, end: float, ok: bool = True, **attrs: Any):
+        entry = {
+            "run": self.run_id,
+            "kind": self.run_name,
+            "phase": phase,
+            "start": round(start, 3),
+            "end": round(end, 3),
+            "duration": round(max(0.0, end - start), 3),
+            "ok": ok,
+        }
+        entry.update(_current_tags())
+        entry.update(attrs)
+        line = json.dumps(entry)
+        with self._lock:
+            with self.path.open("a", encoding="utf-8") as fp:
+                fp.write(line + "\n")
+
+
+_ACTIVE: Optional[Tracer] = None
+_TAGS = threading.local()
+
+
+def start_run(trace_dir: Path, run_name: str) -> Tracer:
+    global _ACTIVE  # pylint: disable=global-statement
+    _ACTIVE = Tracer(trace_dir, run_name)
+    return _ACTIVE
+
+
+def end_run():
+    global _ACTIVE  # pylint: disable=global-statement
+    _ACTIVE = None
+
+
+def active() -> Optional[Tracer]:
+    return _ACTIVE
+
+
+def _current_tags() -> Dict[str, Any]:
+    merged: Dict[str, Any] = {}
+    for frame in getattr(_TAGS, "stack", []):
+        merged.update(frame)
+    return merged
+
+
+@contextmanager
+def tags(**attrs: Any) -> Iterator[None]:
+    """Attach attributes (e.g. server=name) to every span opened in this thread."""
+    stack = getattr(_TAGS, "stack", None)
+    if stack is None:
+        stack = _TAGS.stack = []
+    stack.append(attrs)
+    try:
+        yield
+    finally:
+        stack.pop()
+
+
+@contextmanager
+def span(phase: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time the enclosed block. The yielded dict can be updated with extra
+    attributes, and with "ok" for a block that reports failure by its result;
+    an exception marks the span as failed and is re-raised.
+    """
+    start = time.time()
+    ok = True
+    try:
+        yield attrs
+    except BaseException:
+        ok = False
+        raise
+    finally:
+        ok = attrs.pop("ok", True) and ok
+        tracer = _ACTIVE
+        if tracer is not None:
+            tracer.record(phase, start, time.time(), ok=ok, **attrs)
+
+
+def traced(phase: str, **attrs: Any) -> Callable:
+    """Decorator form of span(), used on provider adapter methods."""
+    def deco(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(phase, **attrs):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def record(phase: str, start: float, end: float, ok: bool = True, **attrs: Any):
+    tracer = _ACTIVE
+    if tracer is not None:
+        tracer.record(phase, start, end, ok=ok, **attrs)
+
+
+# ---------------------------
+# Remote phase markers
+# ---------------------------
+
+def parse_phase_markers(text: str) -> List[Tuple[str, float, float]]:
+    """
+    Pair begin/end markers from a remote setup log into (name, start, end).
+    Duplicate lines (the setup log is tee'd more than once) are ignored;
+    a phase without an end marker is dropped.
+    """
+    seen = set()
+    begins: Dict[str, float] = {}
+    out: List[Tuple[str, float, float]] = []
+    for raw in text.splitlines():
+        m = _PHASE_RE.match(raw.strip())
+        if not m:
+            continue
+        name, kind, ts = m.group(1), m.group(2), float(m.group(3))
+        if (name, kind, ts) in seen:
+            continue
+        seen.add((name, kind, ts))
+        if kind == "begin":
+            begins[name] = ts
+        elif name in begins:
+            out.append((name, begins.pop(name), ts))
+    return out
+
+
+def record_remote_phases(text: str, prefix: str = "setup", **attrs: Any) -> int:
+    phases = parse_phase_markers(text)
+    for name, start, end in phases:
+        record(f"{prefix}.{name}", start, end, remote=True, **attrs)
+    return len(phases)
+
+
+# ---------------------------
+# Summary
+# ---------------------------
+
+def load_spans(trace_dir: Path) -> List[Dict[str, Any]]:
+    spans: List[Dict[str, Any]] = []
+    if not trace_dir.exists():
+        return spans
+    for path in sorted(trace_dir.glob("*.jsonl")):
+        try:
+            lines = path.read_text(encoding="utf-8").splitlines()
+        except OSError:
+            continue
+        for line in lines:
+            try:
+                spans.append(json.loads(line))
+            except JSONDecodeError:
+                continue
+    return spans
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    pos = (len(sorted_vals) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (pos - lo)
+
+
+def summarize(trace_dir: Path) -> Dict[str, Dict[str, float]]:
+    """Per-phase count / failures / p50 / p95 / max duration across all recorded runs."""
+    durations: Dict[str, List[float]] = {}
+    failures: Dict[str, int] = {}
+    for s in load_spans(trace_dir):
+        phase = s.get("phase")
+        if not phase:
+            continue
+        durations.setdefault(phase, []).append(float(s.get("duration", 0.0)))
+        if not s.get("ok", True):
+            failures[phase] = failures.get(phase, 0) + 1
+    out: Dict[str, Dict[str, float]] = {}
+    for phase, vals in durations.items():
+        vals.sort()
+        out[phase] = {
+            "count": len(vals),
+            "failed": failures.get(phase, 0),
+            "p50": round(_percentile(vals, 0.50), 2),
+            "p95": round(_percentile(vals, 0.95), 2),
+            "max": round(vals[-1], 2),
+        }
+    return out
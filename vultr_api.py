@@ -4,6 +4,11 @@ from typing import Dict, Any, List, Optional
 
 import requests
 
+try:
+    from tf2ctl.tracing import traced
+except ImportError:
+    from tracing import traced
+
 
 class VultrAPIError(RuntimeError):
     pass
@@ -19,6 +24,8 @@ class VultrAPI:
 
     def __init__(self, token: str):
         self.token = token.strip()
+        # One keep-alive session per client: repeated calls reuse the TLS connection
+        self.session = requests.Session()
         self.base = "https://api.vultr.com/v2"
 
     # -------------- internal helpers --------------
@@ -75,7 +82,7 @@ class VultrAPI:
 
     def list_regions(self) -> List[Dict[str, Any]]:
         url = f"{self.base}/regions"
-        r = requests.get(url, headers=self._headers(), timeout=30)
+        r = self.session.get(url, headers=self._headers(), timeout=30)
         if not r.ok:
             self._handle_error(r)
         data = r.json().get("regions", [])
@@ -87,17 +94,19 @@ class VultrAPI:
             out.append({"slug": rid, "name": name})
         return sorted(out, key=lambda x: x["slug"])
 
+    @traced("provider.capacity_remaining", provider="vultr")
     def capacity_remaining(self) -> Optional[int]:
         # Vultr does not publish account droplet caps via API.
         return None
 
     # --- SSH Keys ---
+    @traced("provider.ensure_ssh_key", provider="vultr")
     def ensure_ssh_key(self, public_key: str, name: str = "tf2ctl") -> str:
         """
         Return existing key ID if the exact public_key exists, otherwise create and return new ID.
         """
         # List existing keys
-        r = requests.get(f"{self.base}/ssh-keys", headers=self._headers(), timeout=30)
+        r = self.session.get(f"{self.base}/ssh-keys", headers=self._headers(), timeout=30)
         if not r.ok:
             self._handle_error(r)
 
@@ -110,7 +119,7 @@ class VultrAPI:
 
         # Create new key
         payload = {"name": name, "ssh_key": public_key.strip()}
-        r = requests.post(f"{self.base}/ssh-keys", json=payload, headers=self._headers(), timeout=30)
+        r = self.session.post(f"{self.base}/ssh-keys", json=payload, headers=self._headers(), timeout=30)
         if not r.ok:
             self._handle_error(r)
 
@@ -128,6 +137,7 @@ class VultrAPI:
 
     # --- Instances ---
     # pylint: disable=too-many-arguments,too-many-positional-arguments
+    @traced("provider.create_server", provider="vultr")
     def create_server(
         self,
         name: str,
@@ -154,18 +164,29 @@ class VultrAPI:
             "ddos_protection": False,
             "activation_email": False,
         }
-        r = requests.post(f"{self.base}/instances", json=payload, headers=self._headers(), timeout=60)
+        r = self.session.post(f"{self.base}/instances", json=payload, headers=self._headers(), timeout=60)
         if not r.ok:
             self._handle_error(r)
         inst = r.json().get("instance", {})
         return {"id": inst.get("id"), "status": inst.get("status"), "raw": inst}
 
     def get_instance(self, instance_id: str) -> Dict[str, Any]:
-        r = requests.get(f"{self.base}/instances/{instance_id}", headers=self._headers(), timeout=30)
+        r = self.session.get(f"{self.base}/instances/{instance_id}", headers=self._headers(), timeout=30)
         if not r.ok:
             self._handle_error(r)
         return r.json().get("instance", {})
 
+    def find_server_by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """Look up an instance by exact label (used to re-adopt instances after an interrupted create)."""
+        r = self.session.get(f"{self.base}/instances", headers=self._headers(), params={"label": name}, timeout=30)
+        if not r.ok:
+            self._handle_error(r)
+        for inst in r.json().get("instances", []):
+            if inst.get("label") == name:
+                return {"id": inst.get("id"), "status": inst.get("status")}
+        return None
+
+    @traced("provider.wait_for_active_ip", provider="vultr")
     def wait_for_active_ip(self, instance_id: str, timeout: int = 900, poll: float = 5.0) -> Dict[str, Any]:
         """
         Poll until instance.status == 'active' and a main_ip is present.
@@ -180,8 +201,9 @@ class VultrAPI:
             time.sleep(poll)
         raise VultrAPIError(f"Timed out waiting for instance {instance_id} to become active and get IP")
 
+    @traced("provider.delete_server", provider="vultr")
     def delete_server(self, instance_id: str) -> bool:
-        r = requests.delete(f"{self.base}/instances/{instance_id}", headers=self._headers(), timeout=30)
+        r = self.session.delete(f"{self.base}/instances/{instance_id}", headers=self._headers(), timeout=30)
         if r.status_code in (204, 200):
             return True
         if not r.ok:
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Health watchdog: probes every instance on an interval and repairs the ones that
+stay broken.
+
+Each round queries all instances with A2S at once (a2s.info_many). Every
+DOCKER_CHECK_EVERY rounds, and right away for an instance that stops answering, it
+also asks its VM for the container state (the caller's check_containers: agent or
+`docker inspect` over SSH). An instance is unhealthy when A2S failed
+`fail_threshold` probes in a row, its container is not running, or the container
+restarted CRASHLOOP_RESTARTS times since the last check.
+
+Unhealthy instances are remediated with escalating steps:
+
+    restart  ->  reapply  ->  reconfigure  ->  (give up until it recovers)
+
+After each step the instance gets GRACE[step] seconds before it is judged again. It
+returns to the first step once it has stayed healthy for STABLE_AFTER seconds. Actions
+are rate-limited per instance (max_actions_per_hour) and per round
+(MAX_ACTIONS_PER_ROUND). When most of the fleet stops answering at once, the problem
+is assumed to be on the controller's side and nothing is touched.
+
+State survives restarts in .tf2ctl/watchdog/state.json, and every transition and
+action is appended to .tf2ctl/watchdog/events.jsonl:
+
+    {"time": "...Z", "server": "tf2-07", "event": "remediate", "step": "restart", "reason": "..."}
+"""
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    from tf2ctl import periodic
+except ImportError:
+    import periodic
+
+STEPS = ("restart", "reapply", "reconfigure")
+# Seconds an instance gets after each step before it is judged again
+GRACE = {"restart": 120, "reapply": 180, "reconfigure": 900}
+STABLE_AFTER = 600
+DEFAULT_INTERVAL = 30
+DEFAULT_FAIL_THRESHOLD = 3
+DEFAULT_MAX_ACTIONS_PER_HOUR = 3
+MAX_ACTIONS_PER_ROUND = 2
+DOCKER_CHECK_EVERY = 10
+CRASHLOOP_RESTARTS = 2
+# With at least OUTAGE_MIN_FLEET instances, this share failing A2S at once suppresses remediation
+OUTAGE_RATIO = 0.5
+OUTAGE_MIN_FLEET = 4
+A2S_TIMEOUT = 3.0
+
+STATE_NAME = "state.json"
+EVENTS_NAME = "events.jsonl"
+
+# {name: (ip, game port)} -> {name: A2S info or None}
+Prober = Callable[[Dict[str, Tuple[str, int]]], Dict[str, Optional[Dict[str, Any]]]]
+# [names] -> {name: {"running": bool, "restart_count": int} or None when unknown}
+ContainerCheck = Callable[[List[str]], Dict[str, Optional[Dict[str, Any]]]]
+# (name, step) -> (ok, detail)
+Remediate = Callable[[str, str], Tuple[bool, str]]
+
+
+def load_state(state_dir: Path) -> Dict[str, Dict[str, Any]]:
+    return periodic.load_json(state_dir / STATE_NAME)
+
+
+def recent_events(state_dir: Path, limit: int = 50) -> List[Dict[str, Any]]:
+    return periodic.tail_jsonl(state_dir / EVENTS_NAME, limit)
+
+
+def _new_state() -> Dict[str, Any]:
+    return {"health": "unknown", "failures": 0, "problem": "", "step": 0, "grace_until": 0.0,
+            "healthy_since": None, "last_ok": None, "restart_count": None, "actions": []}
+
+
+class Watchdog:
+    """One instance per running watchdog; call run_round() on an interval (or run())."""
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, state_dir: Path, targets: Callable[[], Dict[str, Tuple[str, int]]], probe: Prober,
+                 check_containers: ContainerCheck, remediate: Remediate, fail_threshold: int = DEFAULT_FAIL_THRESHOLD,
+                 max_actions_per_hour: int = DEFAULT_MAX_ACTIONS_PER_HOUR, dry_run: bool = False,
+                 clock: Callable[[], float] = time.time):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.state_dir = state_dir
+        self.targets = targets
+        self.probe = probe
+        self.check_containers = check_containers
+        self.remediate = remediate
+        self.fail_threshold = max(1, fail_threshold)
+        self.max_actions_per_hour = max(1, max_actions_per_hour)
+        self.dry_run = dry_run
+        self.clock = clock
+        self.rounds = 0
+        self.outage = False
+        self.states = load_state(state_dir)
+
+    def _event(self, now: float, server: str, event: str, **fields):
+        entry = {"time": periodic.stamp(now), "server": server, "event": event, **fields}
+        if self.dry_run:
+            entry["dry_run"] = True
+        print(f"[watchdog] {server}: {event} " + " ".join(f"{k}={v}" for k, v in fields.items()))
+        periodic.append_jsonl(self.state_dir / EVENTS_NAME, entry)
+
+    def _save(self):
+        periodic.save_json(self.state_dir / STATE_NAME, self.states)
+
+    @staticmethod
+    def _guarded(what: str, call: Callable[[], Any], fallback: Any) -> Any:
+        """call(), or `fallback` when it raises: one unreachable host must not end the watchdog."""
+        try:
+            return call()
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            print(f"[watchdog] {what} failed: {exc!r}")
+            return fallback
+
+    def _remediate(self, name: str, step: str) -> Tuple[bool, str]:
+        try:
+            return self.remediate(name, step)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            return False, f"{step} raised {exc!r}"
+
+    def _container_problem(self, st: Dict[str, Any], container: Optional[Dict[str, Any]]) -> str:
+        if container is None:
+            return ""
+        count = int(container.get("restart_count") or 0)
+        previous, st["restart_count"] = st["restart_count"], count
+        if not container.get("running"):
+            return "container not running"
+        if previous is not None and count - previous >= CRASHLOOP_RESTARTS:
+            return f"crash-looping ({count - previous} restarts since the last check)"
+        return ""
+
+    def _observe(self, now: float, name: str, st: Dict[str, Any], reply: Optional[Dict[str, Any]],
+                 container: Optional[Dict[str, Any]]) -> bool:
+        """Update one instance's state from this round's probes; True when it needs remediation."""
+        # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-branches
+        if reply is not None:
+            st["failures"], st["last_ok"] = 0, now
+        else:
+            st["failures"] += 1
+        problem = self._container_problem(st, container)
+        if not problem and st["failures"] >= self.fail_threshold:
+            problem = f"no A2S reply for {st['failures']} probes"
+        if not problem and reply is not None:
+            if st["health"] not in ("healthy", "unknown"):
+                self._event(now, name, "recovered", after_step=STEPS[st["step"] - 1] if st["step"] else "")
+            if st["health"] != "healthy":
+                st["healthy_since"] = now
+            st["health"], st["problem"] = "healthy", ""
+            if st["step"] and now - (st["healthy_since"] or now) >= STABLE_AFTER:
+                st["step"] = 0
+            return False
+        if not problem:
+            return False  # a missed probe or two: not yet a verdict
+        if now < st["grace_until"]:
+            st["health"] = "remediating"
+            return False
+        if st["health"] in ("healthy", "unknown", "remediating") and st["problem"] != problem:
+            self._event(now, name, "unhealthy", reason=problem)
+        st["problem"] = problem
+        st["healthy_since"] = None
+        if st["step"] >= len(STEPS):
+            if st["health"] != "gave_up":
+                self._event(now, name, "gave_up", reason=problem)
+            st["health"] = "gave_up"
+            return False
+        if st["health"] != "rate_limited":
+            st["health"] = "unhealthy"
+        return True
+
+    def run_round(self) -> Dict[str, Dict[str, Any]]:
+        """Probe every target once and remediate as needed; returns the states."""
+        # pylint: disable=too-many-locals,too-many-branches
+        now = self.clock()
+        targets = self.targets()
+        for gone in set(self.states) - set(targets):
+            del self.states[gone]
+        for name in targets:
+            self.states.setdefault(name, _new_state())
+        replies = self._guarded("probe", lambda: self.probe(targets), {}) if targets else {}
+        failing = [n for n in targets if replies.get(n) is None]
+        # Scheduled container checks for everyone, and an immediate one for instances that stopped answering
+        check = list(targets) if self.rounds % DOCKER_CHECK_EVERY == 0 else failing
+        containers = self._guarded("container check", lambda: self.check_containers(check), {}) if check else {}
+        self.rounds += 1
+
+        outage = len(targets) >= OUTAGE_MIN_FLEET and len(failing) >= OUTAGE_RATIO * len(targets)
+        candidates = [n for n in sorted(targets)
+                      if self._observe(now, n, self.states[n], replies.get(n), containers.get(n))]
+        if outage and candidates:
+            if not self.outage:
+                self._event(now, "*", "suppressed", reason=f"{len(failing)}/{len(targets)} instances not answering; "
+                                                           "assuming a controller-side problem", servers=candidates)
+            self.outage = True
+            candidates = []
+        elif not outage:
+            self.outage = False
+        acted = 0
+        for name in candidates:
+            st = self.states[name]
+            st["actions"] = [t for t in st["actions"] if now - t < 3600]
+            if len(st["actions"]) >= self.max_actions_per_hour:
+                if st["health"] != "rate_limited":
+                    self._event(now, name, "rate_limited", actions_last_hour=len(st["actions"]))
+                st["health"] = "rate_limited"
+                continue
+            if acted >= MAX_ACTIONS_PER_ROUND:
+                continue  # next round
+            step = STEPS[st["step"]]
+            self._event(now, name, "remediate", step=step, reason=st["problem"])
+            ok, detail = (True, "dry run") if self.dry_run else self._remediate(name, step)
+            done = self.clock()
+            self._event(done, name, "remediated" if ok else "remediation_failed", step=step,
+                        detail=detail[-300:], seconds=round(done - now, 1))
+            acted += 1
+            st["actions"].append(now)
+            st["step"] += 1
+            st["failures"] = 0
+            st["restart_count"] = None  # the remediation itself restarts the container
+            st["grace_until"] = done + GRACE[step]
+            st["health"] = "remediating"
+        self._save()
+        return self.states
+
+    def run(self, interval: float = DEFAULT_INTERVAL, stop: Optional[threading.Event] = None,
+            rounds: Optional[int] = None):
+        """run_round() every `interval` seconds until `stop` is set, `rounds` ran, or Ctrl-C."""
+        periodic.run(self.run_round, interval, stop, rounds, self.clock)
+
+
+def summary(states: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """JSON-friendly view of the states (times as ISO strings, action history as a count)."""
+    out = {}
+    for name, st in sorted(states.items()):
+        out[name] = {
+            "health": st["health"], "problem": st["problem"], "failures": st["failures"],
+            "next_step": STEPS[st["step"]] if st["step"] < len(STEPS) else "",
+            "last_ok": periodic.stamp(st["last_ok"]) if st["last_ok"] else None,
+            "actions_last_hour": len([t for t in st["actions"] if time.time() - t < 3600]),
+        }
+    return out